@@ -0,0 +1,84 @@
+"""
+Microbenchmark: legacy ``util`` codec against the table-driven ``codec``.
+
+Both implementations are first checked to produce identical bytes and
+identical decoded packets, then timed on a representative set of messages.
+
+usage: python bench/bench_codec.py [-n ITERATIONS]
+"""
+import argparse
+import timeit
+
+from c2w.protocol import codec, util
+from c2w.protocol.packet import Packet
+from c2w.protocol.data_strucs import Movie, User
+from c2w.protocol.tables import type_code, room_type, error_code
+
+
+def samplePackets(userCount=50, movieCount=10):
+    users = dict((i, User("user%03d" % i, i, status=i % 2))
+                 for i in range(1, userCount + 1))
+    movies = [Movie("movie number %d" % i, i) for i in range(movieCount)]
+    userListLength = sum(3 + user.length for user in users.values())
+    movieListLength = sum(2 + movie.length for movie in movies)
+    message = "hello everybody, this is a chat message"
+
+    def pack(ack, msgType, roomType, length, data, destId=0):
+        return Packet(frg=0, ack=ack, msgType=msgType, roomType=roomType,
+                      seqNum=7, userId=3, destId=destId, length=length,
+                      data=data)
+
+    movieAck = pack(1, type_code["roomRequest"], room_type["movieRoom"], 6,
+                    {"ip": "127.0.0.1", "port": 1991}, destId=2)
+    return {
+        "message": pack(0, type_code["message"], room_type["mainRoom"],
+                        len(message), message),
+        "ack": pack(1, type_code["message"], room_type["mainRoom"], 0, ""),
+        "error": pack(1, type_code["errorMessage"], room_type["notApplicable"],
+                      1, error_code["userNotAvailable"]),
+        "movieRoomAck": movieAck,
+        "movieList": pack(0, type_code["movieList"],
+                          room_type["notApplicable"], movieListLength, movies),
+        "userList": pack(0, type_code["userList"], room_type["mainRoom"],
+                         userListLength, users),
+    }
+
+
+def checkCompatibility(packets):
+    for name, pack in packets.items():
+        legacy = util.packMsg(pack).raw
+        new = codec.packMsg(pack)
+        assert legacy == new, "encoding differs for %s" % name
+        assert repr(util.unpackMsg(legacy)) == repr(codec.unpackMsg(new)), \
+            "decoding differs for %s" % name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    packets = samplePackets()
+    checkCompatibility(packets)
+    print "%-14s %12s %12s %12s %12s" % ("message", "util.pack",
+            "codec.pack", "util.unpack", "codec.unpack")
+    for name in sorted(packets):
+        pack = packets[name]
+        buf = codec.packMsg(pack)
+        timings = [
+            timeit.timeit(lambda: util.packMsg(pack).raw,
+                          number=args.iterations),
+            timeit.timeit(lambda: codec.packMsg(pack),
+                          number=args.iterations),
+            timeit.timeit(lambda: util.unpackMsg(buf),
+                          number=args.iterations),
+            timeit.timeit(lambda: codec.unpackMsg(buf),
+                          number=args.iterations),
+        ]
+        # microseconds per call
+        print "%-14s %10.2fus %10.2fus %10.2fus %10.2fus" % tuple(
+            [name] + [t * 1e6 / args.iterations for t in timings])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Fan-out benchmark: one chat message forwarded to every user of the main
+room, through ``forwardMessagePack`` of the UDP or the TCP server. The
+users log in by acking their movie list, which puts them in the main room.
+
+It reports how many times a message body is encoded per chat message
+(the ack sent back to the author included) and how many chat messages per
+second the server forwards. With
+``--per-recipient`` the message is sent through ``sendPacket`` once per
+destination, the way the servers used to forward messages.
+
+usage: python bench/bench_fanout.py [--tcp] [--users N] [--messages N]
+"""
+import argparse
+import time
+
+from twisted.internet import task
+
+from c2w.protocol import codec, timer_wheel
+from c2w.protocol import udp_chat_server, tcp_chat_server
+from c2w.protocol.packet import Packet
+from c2w.protocol.tables import type_code, room_type
+from standins import StandInServerProxy
+from standins import RecordingDatagramTransport, RecordingStreamTransport
+
+
+class EncodeCounter():
+    """Count calls to ``codec.encodeBody``."""
+
+    def __init__(self):
+        self.count = 0
+        self.encodeBody = codec.encodeBody
+        codec.encodeBody = self
+
+    def __call__(self, pack):
+        self.count += 1
+        return self.encodeBody(pack)
+
+
+def perRecipientUdp(server):
+    def broadcastPacket(pack, dests):
+        for destId in dests:
+            pack.userId = destId
+            server.sendPacket(pack, server.userAddrs[destId])
+    server.broadcastPacket = broadcastPacket
+
+
+def perRecipientTcp(server):
+    def broadcastPacket(pack, dests):
+        for destId in dests:
+            instance = server.roomIndex.sessions[destId]
+            pack.userId = destId
+            pack.seqNum = instance.seqNum
+            instance.sendPacket(pack)
+    server.broadcastPacket = broadcastPacket
+
+
+def udpScenario(args):
+    timer_wheel.reactor = task.Clock()
+    proxy = StandInServerProxy()
+    server = udp_chat_server.c2wUdpChatServerProtocol(proxy, 0)
+    server.transport = RecordingDatagramTransport()
+    server.initMovieList()
+
+    # every datagram sent by the server is acked right away
+    pending = []
+    server.transport.deliver = lambda datagram, addr: pending.append(
+            (datagram, addr))
+
+    def ackAll():
+        # the writes of a reactor iteration are sent once it is over
+        server.coalescer.flush()
+        while pending:
+            while pending:
+                datagram, addr = pending.pop()
+                header = codec.unpackHeader(datagram)
+                if header.ack == 0:
+                    header.ack = 1
+                    header.length = 0
+                    server.datagramReceived(codec.packHeader(header), addr)
+            server.coalescer.flush()
+
+    for i in range(args.users):
+        address = ("127.0.0.1", 10000 + i)
+        userId = server.addUser("user%d" % i, address)
+        # the user joins the main room once its movie list is acked
+        server.sendMovieList(userId, address)
+        ackAll()
+    if args.per_recipient:
+        perRecipientUdp(server)
+
+    def run(text, seqNum):
+        pack = Packet(frg=0, ack=0, msgType=type_code["message"],
+                      roomType=room_type["mainRoom"], seqNum=seqNum,
+                      userId=1, destId=0, length=len(text), data=text)
+        server.datagramReceived(codec.packHeader(pack) + text,
+                                server.userAddrs[1])
+        ackAll()
+    return (lambda: server.transport.datagrams, run,
+            lambda: server.clientSeqNums[1])
+
+
+def tcpScenario(args):
+    proxy = StandInServerProxy()
+    instances = []
+    for i in range(args.users):
+        instance = tcp_chat_server.c2wTcpChatServerProtocol(
+                proxy, "127.0.0.1", 10000 + i)
+        instance.transport = RecordingStreamTransport()
+        userId = instance.addUser("user%d" % i)
+        # the user joins the main room once its movie list is acked
+        instance.sendMovieList(userId)
+        ack = Packet(frg=0, ack=1, msgType=type_code["movieList"],
+                     roomType=room_type["mainRoom"], seqNum=instance.seqNum,
+                     userId=userId, destId=0, length=0, data="")
+        instance.dataReceived(codec.packHeader(ack))
+        instance.coalescer.flush()
+        instances.append(instance)
+    for instance in instances:
+        if args.per_recipient:
+            perRecipientTcp(instance)
+    sender = instances[0]
+
+    def run(text, seqNum):
+        pack = Packet(frg=0, ack=0, msgType=type_code["message"],
+                      roomType=room_type["mainRoom"], seqNum=seqNum,
+                      userId=1, destId=0, length=len(text), data=text)
+        sender.forwardMessagePack(pack)
+        sender.coalescer.flush()
+    # a single write per connection and reactor iteration
+    return (lambda: sum(instance.transport.writes
+                        for instance in instances), run, lambda: 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tcp", action="store_true")
+    # the users have legacy headers: user ids are a single byte
+    parser.add_argument("--users", type=int, default=250)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--size", type=int, default=30,
+                        help="chat message size in bytes")
+    parser.add_argument("--per-recipient", action="store_true",
+                        help="encode the message once per destination")
+    args = parser.parse_args()
+
+    if args.tcp:
+        delivered, run, nextSeqNum = tcpScenario(args)
+    else:
+        delivered, run, nextSeqNum = udpScenario(args)
+    text = "x" * args.size
+    counter = EncodeCounter()
+    start = time.time()
+    before = delivered()
+    for i in range(args.messages):
+        run(text, nextSeqNum())
+    elapsed = time.time() - start
+    # the ack to the author and a messageForward to each other user
+    assert delivered() - before == args.users * args.messages, \
+        "%d deliveries for %d messages to %d users" % (
+            delivered() - before, args.messages, args.users)
+
+    print "%s server, %d users, %d messages of %d bytes" % (
+        "TCP" if args.tcp else "UDP", args.users, args.messages, args.size)
+    print "encodes per message:  %.1f" % (float(counter.count) / args.messages)
+    print "messages per second:  %.1f" % (args.messages / elapsed)
+
+
+if __name__ == "__main__":
+    main()
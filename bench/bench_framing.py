@@ -0,0 +1,85 @@
+"""
+Framing benchmark: a TCP stream of chat messages cut into chunks.
+
+The stream is fed to ``FrameHandler`` in chunks of several sizes, from
+many frames coalesced in one ``dataReceived`` call to frames split in
+pieces of a few bytes. Every packet extracted is checked against the
+packet sent, then the frames per second and the most bytes kept in the
+receive buffer between two calls are reported.
+
+usage: python bench/bench_framing.py [--frames N]
+"""
+import argparse
+import random
+import time
+
+from c2w.protocol import codec
+from c2w.protocol.frame_handler import FrameHandler
+from c2w.protocol.packet import Packet
+from c2w.protocol.tables import type_code, room_type
+
+
+def sampleStream(frameCount):
+    rand = random.Random(0)
+    packets = []
+    for i in range(frameCount):
+        text = "x" * rand.randint(0, 200)
+        packets.append(Packet(frg=0, ack=0, msgType=type_code["message"],
+                              roomType=room_type["mainRoom"],
+                              seqNum=i % 256, userId=1, destId=0,
+                              length=len(text), data=text or None))
+    return packets, "".join(codec.packMsg(pack) for pack in packets)
+
+
+def chunks(stream, minSize, maxSize):
+    rand = random.Random(1)
+    chunkList = []
+    offset = 0
+    while offset < len(stream):
+        size = rand.randint(minSize, maxSize)
+        chunkList.append(stream[offset:offset + size])
+        offset += size
+    return chunkList
+
+
+def run(packets, chunkList):
+    handler = FrameHandler()
+    received = []
+    maxBuffer = 0
+    start = time.time()
+    for chunk in chunkList:
+        received.extend(handler.extractPackets(chunk))
+        maxBuffer = max(maxBuffer, len(handler.buf))
+    elapsed = time.time() - start
+    assert len(received) == len(packets), "%d frames extracted out of %d" % (
+        len(received), len(packets))
+    for sent, pack in zip(packets, received):
+        assert (pack.seqNum, pack.length, pack.data) == (
+            sent.seqNum, sent.length, sent.data), "frame %d differs" % (
+            sent.seqNum)
+    return elapsed, maxBuffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    packets, stream = sampleStream(args.frames)
+    scenarios = [
+        ("coalesced", 65536, 65536),
+        ("segments", 1460, 1460),
+        ("split", 1, 7),
+    ]
+    print "%d frames, %d bytes" % (len(packets), len(stream))
+    print "%-10s %8s %14s %12s" % ("chunks", "calls", "frames/s",
+                                   "kept bytes")
+    for name, minSize, maxSize in scenarios:
+        chunkList = chunks(stream, minSize, maxSize)
+        elapsed, maxBuffer = run(packets, chunkList)
+        print "%-10s %8d %14.0f %12d" % (name, len(chunkList),
+                                         len(packets) / elapsed, maxBuffer)
+
+
+if __name__ == "__main__":
+    main()
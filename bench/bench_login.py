@@ -0,0 +1,146 @@
+"""
+Login benchmark: cost of one login request to a server which already has
+N users, through ``datagramReceived`` of the UDP server or
+``dataReceived`` of a TCP connection.
+
+For every user count the users log in one after the other, and the mean
+time of the last ``--sample`` logins is reported, with the time of a
+login refused because the name is taken. The users then leave and log in
+again under new names ``--churn`` times: the largest user id given out
+shows whether the ids of the users who left are reused, once out of
+quarantine.
+
+The users never acknowledge their movie list, so they stay out of the
+main room and no userListDelta is sent: only the login path is measured.
+
+usage: python bench/bench_login.py [--tcp] [--users N [N ...]]
+                                   [--sample N] [--churn N]
+"""
+import argparse
+import time
+
+from twisted.internet import task
+
+from c2w.protocol import codec, timer_wheel
+from c2w.protocol.config import id_quarantine
+from c2w.protocol import udp_chat_server, tcp_chat_server
+from c2w.protocol.packet import Packet
+from c2w.protocol.tables import type_code
+from standins import StandInServerProxy
+from standins import RecordingDatagramTransport, RecordingStreamTransport
+
+
+def loginRequest(userName):
+    pack = Packet(frg=0, ack=0, msgType=type_code["loginRequest"],
+                  roomType=3, seqNum=0, userId=0,
+                  destId=codec.packLoginOptions(codec.WIDE_HEADER, 0),
+                  length=len(userName), data=userName)
+    return codec.packMsg(pack)
+
+
+def disconnectRequest(userId):
+    return Packet(frg=0, ack=0, msgType=type_code["disconnectRequest"],
+                  roomType=0, seqNum=0, userId=userId, destId=0, length=0,
+                  data="", headerVersion=codec.WIDE_HEADER)
+
+
+class UdpServer():
+
+    def __init__(self):
+        self.server = udp_chat_server.c2wUdpChatServerProtocol(
+                StandInServerProxy(), 0)
+        self.server.transport = RecordingDatagramTransport()
+        self.server.initMovieList()
+        self.port = 10000
+
+    def login(self, userName):
+        """returns: the user id, or None if the login is refused"""
+        self.port += 1
+        addr = ("127.0.0.1", self.port)
+        self.server.datagramReceived(loginRequest(userName), addr)
+        self.server.coalescer.flush()
+        return self.server.addressUsers.get(addr)
+
+    def leave(self, userId):
+        self.server.leaveResponse(disconnectRequest(userId),
+                                  self.server.userAddrs[userId])
+        self.server.coalescer.flush()
+
+
+class TcpServer():
+
+    def __init__(self):
+        self.proxy = StandInServerProxy()
+        self.instances = {}  # userId: protocol instance
+        self.port = 10000
+
+    def login(self, userName):
+        self.port += 1
+        instance = tcp_chat_server.c2wTcpChatServerProtocol(
+                self.proxy, "127.0.0.1", self.port)
+        instance.transport = RecordingStreamTransport()
+        instance.dataReceived(loginRequest(userName))
+        instance.coalescer.flush()
+        if instance.userId is not None:
+            self.instances[instance.userId] = instance
+        return instance.userId
+
+    def leave(self, userId):
+        instance = self.instances.pop(userId)
+        instance.leaveResponse(disconnectRequest(userId))
+        instance.coalescer.flush()
+
+
+def run(serverClass, users, args):
+    """returns: (seconds per login, seconds per refused login, largest
+    user id after the churn)"""
+    # the timers of the previous runs are never due
+    timer_wheel.reactor = task.Clock()
+    server = serverClass()
+    userIds = []
+    for i in range(users - args.sample):
+        userIds.append(server.login("user%d" % i))
+    start = time.time()
+    for i in range(users - args.sample, users):
+        userIds.append(server.login("user%d" % i))
+    loginTime = (time.time() - start) / args.sample
+    start = time.time()
+    for i in range(args.sample):
+        server.login("user%d" % i)
+    refusedTime = (time.time() - start) / args.sample
+    largest = max(userIds)
+    for round in range(args.churn):
+        for userId in userIds:
+            server.leave(userId)
+        # the ids are reused once out of quarantine
+        timer_wheel.reactor.advance(id_quarantine)
+        userIds = [server.login("user%d.%d" % (round, i))
+                   for i in range(users)]
+        largest = max(largest, max(userIds))
+    return loginTime, refusedTime, largest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tcp", action="store_true")
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[1000, 5000, 10000])
+    parser.add_argument("--sample", type=int, default=500,
+                        help="logins timed at each user count")
+    parser.add_argument("--churn", type=int, default=2,
+                        help="times all the users leave and log in again")
+    args = parser.parse_args()
+
+    print "%s server, %d logins timed, %d churn rounds" % (
+        "TCP" if args.tcp else "UDP", args.sample, args.churn)
+    print "%7s %10s %12s %12s" % ("users", "login us", "refused us",
+                                  "largest id")
+    for users in args.users:
+        loginTime, refusedTime, largest = run(
+                TcpServer if args.tcp else UdpServer, users, args)
+        print "%7d %10.1f %12.1f %12d" % (users, loginTime * 1e6,
+                                          refusedTime * 1e6, largest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Batched datagram I/O benchmark: system calls of the UDP server per chat
+message delivered, with the plain port of the reactor and with a
+``MmsgPort`` (recvmmsg and sendmmsg, see ``c2w.protocol.mmsg``).
+
+For each port a UDP server is started on ``--port`` with the server
+proxy of ``standins``, then a swarm of headless clients (see ``swarm``)
+logs in and chats in the main room against it, in ``--processes``
+processes. Every message is fanned out to all the clients. The receive
+and send calls of the server are counted by the port, for the plain one
+through a wrapper of its socket.
+
+usage: python bench/bench_mmsg.py [--port PORT] [--clients N]
+                                  [--processes N] [--duration S]
+                                  [--think-time S]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+from c2w.protocol import mmsg
+from standins import StandInServerProxy
+from swarm import Stats, runSwarm
+
+
+class CountingSocket():
+    """The socket of a plain port, counting its receive and send calls."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.recvCalls = 0
+        self.sendCalls = 0
+
+    def recvfrom(self, size):
+        self.recvCalls += 1
+        return self.sock.recvfrom(size)
+
+    def sendto(self, data, addr):
+        self.sendCalls += 1
+        return self.sock.sendto(data, addr)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def serve(port, batched, results):
+    """run a UDP server until SIGTERM, then put its call counts"""
+    from twisted.internet import reactor
+    from c2w.protocol.udp_chat_server import c2wUdpChatServerProtocol
+
+    protocol = c2wUdpChatServerProtocol(StandInServerProxy(), 0)
+    if batched:
+        counts = mmsg.listenUDP(port, protocol, interface="127.0.0.1")
+    else:
+        udpPort = reactor.listenUDP(port, protocol, interface="127.0.0.1")
+        counts = udpPort.socket = CountingSocket(udpPort.socket)
+    reactor.run()
+    results.put((counts.recvCalls, counts.sendCalls))
+
+
+def run(args, batched):
+    """returns: the Stats of the swarm, and the calls of the server"""
+    calls = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve,
+                                     args=(args.port, batched, calls))
+    server.start()
+    time.sleep(1)  # the server binds the port
+    results = multiprocessing.Queue()
+    swarms = []
+    for i in range(args.processes):
+        count = (args.clients // args.processes +
+                 (1 if i < args.clients % args.processes else 0))
+        swarm = multiprocessing.Process(target=runSwarm,
+                                        args=(args, i, count, results))
+        swarm.start()
+        swarms.append(swarm)
+    total = Stats()
+    for swarm in swarms:
+        for name, value in results.get().items():
+            setattr(total, name, getattr(total, name) + value)
+    for swarm in swarms:
+        swarm.join()
+    os.kill(server.pid, signal.SIGTERM)
+    recvCalls, sendCalls = calls.get()
+    server.join()
+    return total, recvCalls, sendCalls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=1900)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=2,
+                        help="processes of the clients")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds of activity after the ramp-up")
+    parser.add_argument("--think-time", type=float, default=1,
+                        help="mean seconds between two messages of a client")
+    args = parser.parse_args()
+    if not mmsg.available:
+        parser.error("recvmmsg and sendmmsg are not available here")
+    # the swarm options left out
+    args.tcp = False
+    args.host = "127.0.0.1"
+    args.ramp_up = 2
+    args.size = 30
+    args.hop = 0
+    args.loss = 0
+
+    runs = [(name, run(args, batched))
+            for name, batched in (("plain", False), ("mmsg", True))]
+
+    # imported after the processes have run, it brings in the reactor
+    from loopback import percentile
+
+    print "%d clients in %d processes" % (args.clients, args.processes)
+    print "%5s %12s %10s %10s %14s %9s %9s" % (
+        "port", "delivered/s", "recv", "send", "calls/message", "p50 ms",
+        "p99 ms")
+    for name, (total, recvCalls, sendCalls) in runs:
+        print "%5s %12.1f %10d %10d %14.3f %9.3f %9.3f" % (
+            name, total.received / args.duration, recvCalls, sendCalls,
+            float(recvCalls + sendCalls) / max(total.received, 1),
+            percentile(total.latencies, 0.5) or 0,
+            percentile(total.latencies, 0.99) or 0)
+
+
+if __name__ == "__main__":
+    main()
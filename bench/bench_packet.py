@@ -0,0 +1,137 @@
+"""
+Packet allocation benchmark: chat messages through the UDP server and
+the DatagramHandler of every user of the main room.
+
+Every ``Packet`` created and every ``copy.deepcopy`` call is counted while
+a chat message is forwarded to all the users and acked back. With
+``--legacy-ack`` the acks are built the way they used to be, by deep
+copying the received packet and turning the copy into an ack.
+
+usage: python bench/bench_packet.py [--users N] [--messages N] [--legacy-ack]
+"""
+import argparse
+import copy
+import sys
+import time
+
+from twisted.internet import task
+
+from c2w.protocol import codec, timer_wheel, udp_chat_server
+from c2w.protocol.datagram_handler import DatagramHandler
+from c2w.protocol.packet import Packet
+from c2w.protocol.tables import type_code, room_type
+from standins import StandInServerProxy, RecordingDatagramTransport
+
+
+class AllocationCounter():
+    """Count the Packet objects created and the deep copies."""
+
+    def __init__(self):
+        self.packets = 0
+        self.deepcopies = 0
+        counter = self
+
+        def countingNew(cls, *args, **kwargs):
+            counter.packets += 1
+            return object.__new__(cls)
+        Packet.__new__ = staticmethod(countingNew)
+
+        deepcopy = copy.deepcopy
+
+        def countingDeepcopy(obj, memo=None):
+            counter.deepcopies += 1
+            return deepcopy(obj, memo)
+        copy.deepcopy = countingDeepcopy
+
+
+def legacyMakeAck(pack, data=""):
+    ackPack = copy.deepcopy(pack)
+    ackPack.turnIntoAck(data)
+    return ackPack
+
+
+class StandInClient():
+    """The part of the UDP client used by its DatagramHandler."""
+
+    def __init__(self, server, address):
+        self.server = server
+        self.address = address
+        self.timers = server.timers
+
+    def sendPacket(self, pack):
+        self.server.datagramReceived(codec.packMsg(pack), self.address)
+
+
+class DictPacket():
+    """A packet with an instance dict, as Packet used to be."""
+
+    def __init__(self, pack):
+        for name in Packet.__slots__:
+            setattr(self, name, getattr(pack, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    # the users have legacy headers: user ids are a single byte
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--size", type=int, default=30,
+                        help="chat message size in bytes")
+    parser.add_argument("--legacy-ack", action="store_true",
+                        help="build acks by deep copying the packet")
+    args = parser.parse_args()
+
+    timer_wheel.reactor = task.Clock()
+    server = udp_chat_server.c2wUdpChatServerProtocol(
+            StandInServerProxy(), 0)
+    server.transport = RecordingDatagramTransport()
+    server.initMovieList()
+    handlers = {}  # address: DatagramHandler
+    for i in range(args.users):
+        address = ("127.0.0.1", 10000 + i)
+        server.addUser("user%d" % i, address)
+        handlers[address] = DatagramHandler(StandInClient(server, address))
+    if args.legacy_ack:
+        Packet.makeAck = legacyMakeAck
+
+    pending = []
+    server.transport.deliver = lambda datagram, addr: pending.append(
+            (datagram, addr))
+    sender = StandInClient(server, ("127.0.0.1", 10000))
+    text = "x" * args.size
+
+    counter = AllocationCounter()
+    start = time.time()
+    for i in range(args.messages):
+        sender.sendPacket(Packet(
+                frg=0, ack=0, msgType=type_code["message"],
+                roomType=room_type["mainRoom"],
+                seqNum=server.clientSeqNums[1], userId=1, destId=0,
+                length=len(text), data=text))
+        # the writes of a reactor iteration are sent once it is over
+        server.coalescer.flush()
+        while pending:
+            while pending:
+                datagram, addr = pending.pop()
+                handlers[addr].unpackMsgs(datagram)
+            server.coalescer.flush()
+    elapsed = time.time() - start
+
+    pack = Packet(0, 0, type_code["message"], room_type["mainRoom"], 0, 1, 0,
+                  len(text), text)
+    legacy = DictPacket(pack)
+    print "%d users, %d messages of %d bytes, %s acks" % (
+        args.users, args.messages, args.size,
+        "legacy" if args.legacy_ack else "makeAck")
+    print "packets per message:     %.1f" % (
+        float(counter.packets) / args.messages)
+    print "deep copies per message: %.1f" % (
+        float(counter.deepcopies) / args.messages)
+    print "messages per second:     %.1f" % (args.messages / elapsed)
+    print "packet size in bytes:    %d (with an instance dict: %d)" % (
+        sys.getsizeof(pack),
+        sys.getsizeof(legacy) + sys.getsizeof(legacy.__dict__))
+
+
+if __name__ == "__main__":
+    main()
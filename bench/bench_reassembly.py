@@ -0,0 +1,85 @@
+"""
+Reassembly benchmark: a main room user list of N users, fragmented by the
+server, through the DatagramHandler of a UDP client.
+
+The fragments are handed over in order, or with ``--shuffle`` in a random
+order inside each window of the sender. The time per fragment should not
+grow with the size of the list.
+
+usage: python bench/bench_reassembly.py [--users N [N ...]]
+                                        [--fragment-length N] [--shuffle]
+"""
+import argparse
+import random
+import time
+
+from twisted.internet import task
+
+from c2w.protocol import codec, timer_wheel
+from c2w.protocol.config import window_size
+from c2w.protocol.data_strucs import User
+from c2w.protocol.datagram_handler import DatagramHandler
+from c2w.protocol.packet import Packet
+from c2w.protocol.tables import type_code, room_type
+from c2w.protocol.timer_wheel import TimingWheel
+
+
+class StandInClient():
+    """The part of the UDP client used by its DatagramHandler."""
+
+    def __init__(self):
+        self.timers = TimingWheel()
+        self.acks = 0
+
+    def sendPacket(self, pack):
+        self.acks += 1
+
+
+def userListFragments(users, fragmentLength):
+    """returns: the datagrams of a user list of users entries"""
+    entries = dict((userId, User("user%d" % userId, userId=userId))
+                   for userId in range(1, users + 1))
+    entrySize = codec.userStructs[codec.WIDE_HEADER].size
+    pack = Packet(frg=0, ack=0, msgType=type_code["userList"],
+                  roomType=room_type["mainRoom"], seqNum=0, userId=1,
+                  destId=0, length=sum(entrySize + user.length
+                                       for user in entries.values()),
+                  data=entries, headerVersion=codec.WIDE_HEADER)
+    return [str(frag) for frag in codec.fragmentMsg(pack, fragmentLength)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[1000, 5000, 20000])
+    parser.add_argument("--fragment-length", type=int, default=40,
+                        help="data bytes per fragment")
+    parser.add_argument("--shuffle", action="store_true",
+                        help="fragments out of order inside each window")
+    args = parser.parse_args()
+    timer_wheel.reactor = task.Clock()
+
+    print "%s fragments of %d bytes" % (
+        "shuffled" if args.shuffle else "ordered", args.fragment_length)
+    print "%7s %10s %10s %12s" % ("users", "fragments", "total ms",
+                                  "us/fragment")
+    for users in args.users:
+        frags = userListFragments(users, args.fragment_length)
+        if args.shuffle:
+            for start in range(0, len(frags), window_size):
+                window = frags[start:start + window_size]
+                random.shuffle(window)
+                frags[start:start + window_size] = window
+        handler = DatagramHandler(StandInClient())
+        start = time.time()
+        packs = []
+        for frag in frags:
+            packs.extend(handler.unpackMsgs(frag))
+        elapsed = time.time() - start
+        assert len(packs) == 1 and len(packs[0].data) == users
+        print "%7d %10d %10.1f %12.2f" % (users, len(frags), elapsed * 1e3,
+                                          elapsed / len(frags) * 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Sharded UDP server benchmark: chat messages delivered per second by 1, 2,
+... N worker processes serving the same port.
+
+For every worker count a sharded server is started on ``--port`` with
+the server proxy of ``standins``, then a swarm of headless clients (see
+``swarm``) logs in and chats against it, in ``--processes`` processes.
+The clients are hashed to the workers by the kernel, the main room spans
+all of them. The deliveries can only grow with the worker count while
+the machine has cores left for them.
+
+The runs are repeated for every reactor of ``--reactors`` (see
+``c2w.protocol.reactors``), all the ones of the platform by default, to
+choose the event loop of the workers. Only the Twisted reactors are
+compared, there is no asyncio or uvloop backend.
+
+usage: python bench/bench_shard.py [--workers N] [--port PORT]
+                                   [--clients N] [--processes N]
+                                   [--duration S] [--think-time S]
+                                   [--reactors NAME [NAME ...]]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+from c2w.protocol import shard
+from c2w.protocol.reactors import availableReactors
+from standins import StandInServerProxy
+from swarm import Stats, runSwarm
+
+
+def serve(port, workers, reactorName):
+    shard.runShardedServer(StandInServerProxy(), port, workers,
+                           interface="127.0.0.1", reactorName=reactorName)
+
+
+def run(args, workers, reactorName):
+    """
+    returns: the Stats of the swarm against a server of workers, running
+    on the reactor called reactorName
+    """
+    server = multiprocessing.Process(target=serve,
+                                     args=(args.port, workers, reactorName))
+    server.start()
+    time.sleep(1)  # the workers bind the port
+    results = multiprocessing.Queue()
+    swarms = []
+    for i in range(args.processes):
+        count = (args.clients // args.processes +
+                 (1 if i < args.clients % args.processes else 0))
+        swarm = multiprocessing.Process(target=runSwarm,
+                                        args=(args, i, count, results))
+        swarm.start()
+        swarms.append(swarm)
+    total = Stats()
+    for swarm in swarms:
+        for name, value in results.get().items():
+            setattr(total, name, getattr(total, name) + value)
+    for swarm in swarms:
+        swarm.join()
+    os.kill(server.pid, signal.SIGTERM)
+    server.join()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="the largest worker count")
+    parser.add_argument("--port", type=int, default=1900)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=2,
+                        help="processes of the clients")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds of activity after the ramp-up")
+    parser.add_argument("--think-time", type=float, default=1,
+                        help="mean seconds between two messages of a client")
+    parser.add_argument("--reactors", nargs="+",
+                        choices=availableReactors(),
+                        default=availableReactors(),
+                        help="reactors of the workers")
+    args = parser.parse_args()
+    # the swarm options left out
+    args.tcp = False
+    args.host = "127.0.0.1"
+    args.ramp_up = 2
+    args.size = 30
+    args.hop = 0
+    args.loss = 0
+
+    totals = [(reactorName, workers, run(args, workers, reactorName))
+              for reactorName in args.reactors
+              for workers in range(1, args.workers + 1)]
+
+    # imported after the processes have run, it brings in the reactor
+    from loopback import percentile
+
+    print "%d clients in %d processes, %d cores" % (
+        args.clients, args.processes, multiprocessing.cpu_count())
+    print "Twisted reactors only, no asyncio or uvloop backend"
+    print "%7s %7s %7s %10s %12s %9s %9s" % (
+        "reactor", "workers", "logins", "sent/s", "delivered/s", "p50 ms",
+        "p99 ms")
+    for reactorName, workers, total in totals:
+        print "%7s %7d %7d %10.1f %12.1f %9.3f %9.3f" % (
+            reactorName, workers, total.logins, total.sent / args.duration,
+            total.received / args.duration,
+            percentile(total.latencies, 0.5) or 0,
+            percentile(total.latencies, 0.99) or 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+End-to-end loopback benchmark of the UDP and TCP chat servers.
+
+The servers and their clients run in one process, connected by in-memory
+links standing in for ``LossyTransport`` and the sockets, with the
+server proxy of ``standins``. Every write is queued and delivered in
+order, and the timers of the protocols follow the wall clock.
+
+Scenarios:
+
+* ``login``: all the users send their login request at the same time;
+* ``chat``: main room chat at ``--rate`` messages per second during
+  ``--duration`` seconds, sent by the users in turn;
+* ``showtime``: all the users join the same movie room at the same time.
+
+For each protocol and scenario the operations per second, the p50, p99
+and p999 latencies (from the request to its delivery to the client
+proxy), the writes and bytes on the wire per operation and the peak RSS
+of the process are reported. A write is a datagram for UDP and a
+``transport.write`` call for TCP. With ``--output`` the results are
+also written as JSON to this file, to compare runs.
+
+usage: python bench/loopback.py [--protocols udp tcp] [--users N]
+                                [--scenarios login chat showtime]
+                                [--rate N] [--duration S] [--output FILE]
+"""
+import argparse
+import json
+import math
+import resource
+import subprocess
+import sys
+import time
+from collections import deque
+
+from twisted.internet import task
+
+from c2w.protocol import timer_wheel
+from c2w.protocol import udp_chat_server, udp_chat_client
+from c2w.protocol import tcp_chat_server, tcp_chat_client
+from standins import StandInServerProxy, StandInClientProxy
+
+SERVER_ADDRESS = ("127.0.0.1", 1900)
+
+
+class Loopback():
+    """
+    The writes in flight between all the endpoints, and the clock of the
+    protocol timers.
+    """
+
+    def __init__(self):
+        self.queue = deque()  # (deliver, data, args)
+        self.clock = task.Clock()
+        self.start = time.time()
+        self.writes = 0
+        self.bytes = 0
+        timer_wheel.reactor = self.clock
+
+    def send(self, deliver, data, *args):
+        self.writes += 1
+        self.bytes += len(data)
+        self.queue.append((deliver, data, args))
+
+    def run(self):
+        """
+        Deliver everything, the timers due meanwhile included. Like a
+        reactor iteration, a round delivers the writes queued when it
+        starts, then calls the timers due.
+        """
+        while True:
+            for i in range(len(self.queue)):
+                deliver, data, args = self.queue.popleft()
+                deliver(data, *args)
+            self.clock.advance(time.time() - self.start -
+                               self.clock.seconds())
+            if not self.queue:
+                return
+
+
+class DatagramLink():
+    """Stand-in for the LossyTransport of a UDP endpoint."""
+
+    def __init__(self, loopback, address, endpoints):
+        """
+        :param endpoints: address: protocol, shared by all the links
+        """
+        self.loopback = loopback
+        self.address = address
+        self.endpoints = endpoints
+
+    def write(self, datagram, addr):
+        self.loopback.send(self.endpoints[addr].datagramReceived, datagram,
+                           self.address)
+
+
+class StreamLink():
+    """Stand-in for the transport of one end of a TCP connection."""
+
+    def __init__(self, loopback, peer):
+        self.loopback = loopback
+        self.peer = peer
+
+    def write(self, data):
+        self.loopback.send(self.peer.dataReceived, data)
+
+    def writeSequence(self, seq):
+        self.write("".join(seq))
+
+    def loseConnection(self):
+        pass
+
+
+def udpWorld(loopback, userCount):
+    endpoints = {}
+    server = udp_chat_server.c2wUdpChatServerProtocol(StandInServerProxy(), 0)
+    server.transport = DatagramLink(loopback, SERVER_ADDRESS, endpoints)
+    server.initMovieList()
+    endpoints[SERVER_ADDRESS] = server
+    clients = []
+    for i in range(userCount):
+        address = ("127.0.0.1", 20000 + i)
+        client = udp_chat_client.c2wUdpChatClientProtocol(
+                SERVER_ADDRESS[0], SERVER_ADDRESS[1], StandInClientProxy(), 0)
+        client.transport = DatagramLink(loopback, address, endpoints)
+        endpoints[address] = client
+        clients.append(client)
+    return clients
+
+
+def tcpWorld(loopback, userCount):
+    serverProxy = StandInServerProxy()
+    clients = []
+    for i in range(userCount):
+        server = tcp_chat_server.c2wTcpChatServerProtocol(
+                serverProxy, "127.0.0.1", 20000 + i)
+        client = tcp_chat_client.c2wTcpChatClientProtocol(
+                StandInClientProxy(), SERVER_ADDRESS[0], SERVER_ADDRESS[1])
+        server.transport = StreamLink(loopback, client)
+        client.transport = StreamLink(loopback, server)
+        clients.append(client)
+    return clients
+
+
+worlds = {"udp": udpWorld, "tcp": tcpWorld}
+
+
+class Latencies():
+    """Time between a request and the client proxy call it leads to."""
+
+    def __init__(self):
+        self.sent = {}  # key: time of the request
+        self.values = []
+
+    def request(self, key):
+        self.sent[key] = time.time()
+
+    def delivered(self, key):
+        self.values.append(time.time() - self.sent[key])
+
+    def percentile(self, p):
+        """returns: the latency in milliseconds"""
+        return percentile(self.values, p)
+
+
+def percentile(values, p):
+    """returns: the p percentile of the latencies in milliseconds"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(math.ceil(p * len(values))) - 1)
+    return values[max(0, index)] * 1000
+
+
+def listen(clients, name, callback):
+    """callback(i, args) is called when the client proxy of clients[i]
+    receives a call to name"""
+    for i, client in enumerate(clients):
+        def listener(calledName, args, i=i):
+            if calledName == name:
+                callback(i, args)
+        client.clientProxy.listener = listener
+
+
+def logAll(clients, loopback):
+    for i, client in enumerate(clients):
+        client.sendLoginRequestOIE("user%d" % i)
+        loopback.run()
+
+
+def loginScenario(protocol, args):
+    loopback = Loopback()
+    clients = worlds[protocol](loopback, args.users)
+    latencies = Latencies()
+    listen(clients, "initCompleteONE", lambda i, a: latencies.delivered(i))
+    start = time.time()
+    for i, client in enumerate(clients):
+        latencies.request(i)
+        client.sendLoginRequestOIE("user%d" % i)
+    loopback.run()
+    return report(len(latencies.values), time.time() - start, latencies,
+                  loopback.writes, loopback.bytes)
+
+
+def chatScenario(protocol, args):
+    loopback = Loopback()
+    clients = worlds[protocol](loopback, args.users)
+    logAll(clients, loopback)
+    latencies = Latencies()
+    listen(clients, "chatMessageReceivedONE",
+           lambda i, a: latencies.delivered(int(a[1].split(" ", 1)[0])))
+    padding = "x" * args.size
+    writes, bytes = loopback.writes, loopback.bytes
+    interval = 1.0 / args.rate
+    start = time.time()
+    count = 0
+    while time.time() - start < args.duration:
+        delay = start + count * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        latencies.request(count)
+        clients[count % len(clients)].sendChatMessageOIE(
+                "%d %s" % (count, padding))
+        count += 1
+        loopback.run()
+    result = report(count, time.time() - start, latencies,
+                    loopback.writes - writes, loopback.bytes - bytes)
+    result["deliveries"] = len(latencies.values)
+    return result
+
+
+def showtimeScenario(protocol, args):
+    loopback = Loopback()
+    clients = worlds[protocol](loopback, args.users)
+    logAll(clients, loopback)
+    latencies = Latencies()
+    listen(clients, "joinRoomOKONE", lambda i, a: latencies.delivered(i))
+    movieTitle = clients[0].movieList[0].movieName
+    writes, bytes = loopback.writes, loopback.bytes
+    start = time.time()
+    for i, client in enumerate(clients):
+        latencies.request(i)
+        client.sendJoinRoomRequestOIE(movieTitle)
+    loopback.run()
+    return report(len(latencies.values), time.time() - start, latencies,
+                  loopback.writes - writes, loopback.bytes - bytes)
+
+
+scenarios = {"login": loginScenario, "chat": chatScenario,
+             "showtime": showtimeScenario}
+
+
+def report(operations, elapsed, latencies, writes, bytes):
+    operations = max(operations, 1)
+    return {"operations": operations,
+            "seconds": elapsed,
+            "operationsPerSecond": operations / elapsed,
+            "p50": latencies.percentile(0.5),
+            "p99": latencies.percentile(0.99),
+            "p999": latencies.percentile(0.999),
+            "writesPerOperation": float(writes) / operations,
+            "bytesPerOperation": float(bytes) / operations,
+            # kilobytes on Linux, never decreases during a run
+            "peakRss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+                ["git", "describe", "--always", "--dirty"],
+                stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--protocols", nargs="+", choices=sorted(worlds),
+                        default=["udp", "tcp"])
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(scenarios),
+                        default=["login", "chat", "showtime"])
+    # the clients get wide headers, up to 65535 users
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=200,
+                        help="chat messages per second")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="chat scenario duration in seconds")
+    parser.add_argument("--size", type=int, default=30,
+                        help="chat message size in bytes")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results as JSON to FILE")
+    args = parser.parse_args()
+
+    results = []
+    print "%-4s %-9s %8s %10s %9s %9s %9s %8s %9s %9s" % (
+        "", "scenario", "ops", "ops/s", "p50 ms", "p99 ms", "p999 ms",
+        "writes", "bytes", "rss KB")
+    for protocol in args.protocols:
+        for name in args.scenarios:
+            result = scenarios[name](protocol, args)
+            result["protocol"] = protocol
+            result["scenario"] = name
+            results.append(result)
+            print "%-4s %-9s %8d %10.1f %9.3f %9.3f %9.3f %8.1f %9.1f %9d" % (
+                protocol, name, result["operations"],
+                result["operationsPerSecond"], result["p50"] or 0,
+                result["p99"] or 0, result["p999"] or 0,
+                result["writesPerOperation"], result["bytesPerOperation"],
+                result["peakRss"])
+
+    if args.output is None:
+        return
+    with open(args.output, "w") as output:
+        json.dump({"revision": revision(),
+                   "python": sys.version.split()[0],
+                   "time": time.time(),
+                   "arguments": vars(args),
+                   "results": results}, output, indent=2, sort_keys=True)
+    print "results written to", args.output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Local stand-ins for the ``c2w.main`` server proxy and for the transports
+the chat protocols write to, so that the protocols can be driven in
+memory by the benchmark scripts.
+"""
+from c2w.main.constants import ROOM_IDS
+
+
+class StandInUser():
+
+    def __init__(self, userName, userChatRoom, userId, userChatInstance=None,
+                 userAddress=None):
+        self.userName = userName
+        self.userChatRoom = userChatRoom
+        self.userId = userId
+        self.userChatInstance = userChatInstance
+        self.userAddress = userAddress
+
+
+class StandInMovie():
+
+    def __init__(self, movieTitle, movieIpAddress, moviePort, movieId):
+        self.movieTitle = movieTitle
+        self.movieIpAddress = movieIpAddress
+        self.moviePort = moviePort
+        self.movieId = movieId
+
+
+class StandInServerProxy():
+    """Same interface as the server proxy of ``c2w.main``."""
+
+    def __init__(self, movieCount=5):
+        self.users = {}  # userId: StandInUser
+        self.movies = []
+        self.nextUserId = 1
+        self.streamingRequests = 0
+        for i in range(movieCount):
+            self.addMovie("Movie %d" % i, "127.0.0.1", 1991 + i, None)
+
+    def addMovie(self, movieTitle, movieIpAddress, moviePort, filePath):
+        movie = StandInMovie(movieTitle, movieIpAddress, moviePort,
+                             len(self.movies) + 1)
+        self.movies.append(movie)
+        return movie.movieId
+
+    def getMovieList(self):
+        return self.movies
+
+    def getMovieById(self, movieId):
+        for movie in self.movies:
+            if movie.movieId == movieId:
+                return movie
+        return None
+
+    def getMovieByTitle(self, movieTitle):
+        for movie in self.movies:
+            if movie.movieTitle == movieTitle:
+                return movie
+        return None
+
+    def startStreamingMovie(self, movieTitle):
+        self.streamingRequests += 1
+
+    def stopStreamingMovie(self, movieTitle):
+        pass
+
+    def addUser(self, userName, userChatRoom=ROOM_IDS.MAIN_ROOM,
+                userChatInstance=None, userAddress=None):
+        userId = self.nextUserId
+        self.nextUserId += 1
+        self.users[userId] = StandInUser(userName, userChatRoom, userId,
+                                         userChatInstance, userAddress)
+        return userId
+
+    def getUserList(self):
+        return self.users.values()
+
+    def getUserById(self, userId):
+        return self.users.get(userId)
+
+    def getUserByName(self, userName):
+        for user in self.users.values():
+            if user.userName == userName:
+                return user
+        return None
+
+    def updateUserChatroom(self, userName, userChatRoom):
+        self.getUserByName(userName).userChatRoom = userChatRoom
+
+    def removeUser(self, userName):
+        del self.users[self.getUserByName(userName).userId]
+
+
+class RecordingDatagramTransport():
+    """
+    Stand-in for ``LossyTransport`` around a UDP port: datagrams are
+    counted and handed to ``deliver(datagram, addr)`` when it is set.
+    """
+
+    def __init__(self, deliver=None):
+        self.deliver = deliver
+        self.datagrams = 0
+        self.bytes = 0
+
+    def write(self, datagram, addr):
+        self.datagrams += 1
+        self.bytes += len(datagram)
+        if self.deliver is not None:
+            self.deliver(datagram, addr)
+
+
+class RecordingStreamTransport():
+    """Stand-in for the transport of one TCP connection."""
+
+    def __init__(self, deliver=None):
+        self.deliver = deliver
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+        if self.deliver is not None:
+            self.deliver(data)
+
+    def writeSequence(self, seq):
+        self.write("".join(seq))
+
+    def loseConnection(self):
+        pass
+
+
+class StandInClientProxy():
+    """
+    Same interface as the client proxy of ``c2w.main``. The calls are
+    counted by name, and ``listener(name, args)`` is called for each of
+    them when it is set.
+    """
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self.calls = {}  # method name: number of calls
+
+    def called(self, name, args):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.listener is not None:
+            self.listener(name, args)
+
+    def initCompleteONE(self, userList, movieList):
+        self.called("initCompleteONE", (userList, movieList))
+
+    def setUserListONE(self, userList):
+        self.called("setUserListONE", (userList,))
+
+    def chatMessageReceivedONE(self, userName, message):
+        self.called("chatMessageReceivedONE", (userName, message))
+
+    def joinRoomOKONE(self):
+        self.called("joinRoomOKONE", ())
+
+    def connectionRejectedONE(self, message):
+        self.called("connectionRejectedONE", (message,))
+
+    def updateMovieAddressPort(self, movieTitle, movieIpAddress, moviePort):
+        self.called("updateMovieAddressPort",
+                    (movieTitle, movieIpAddress, moviePort))
+
+    def leaveSystemOKONE(self):
+        self.called("leaveSystemOKONE", ())
+
+    def applicationQuit(self):
+        self.called("applicationQuit", ())
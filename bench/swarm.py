@@ -0,0 +1,215 @@
+"""
+Headless client swarm: load generator for a running chat server.
+
+Many UDP or TCP clients are run without GUI, with a client proxy stand-in
+recording the events. Each one logs in, then until the end of the run
+waits a random think time and either sends a chat message or changes
+room. They connect to a real server port, e.g. one started with the
+usual server script on localhost.
+
+With ``--processes N`` the clients are split between N processes, each
+with its own reactor. The login count, chat messages sent and received,
+room changes and chat latencies (the send time travels in the message)
+are summed over all the processes.
+
+The clients ask for the wide header, with 16 bits user ids, at login. A
+server only giving out single byte user ids accepts at most 255 users at
+the same time.
+
+usage: python bench/swarm.py [--tcp] [--host HOST] [--port PORT]
+                             [--clients N] [--processes N] [--duration S]
+                             [--ramp-up S] [--think-time S] [--size N]
+                             [--hop P] [--loss P]
+"""
+import argparse
+import multiprocessing
+import random
+import time
+
+from standins import StandInClientProxy
+
+
+class Stats():
+    """Counters of one process."""
+
+    def __init__(self):
+        self.logins = 0
+        self.rejected = 0
+        self.sent = 0
+        self.received = 0
+        self.joins = 0
+        self.latencies = []  # seconds
+
+    def summary(self):
+        return dict(self.__dict__)
+
+
+class Bot():
+    """One headless client and its behaviour."""
+
+    def __init__(self, name, args, stats, rand):
+        self.name = name
+        self.args = args
+        self.stats = stats
+        self.rand = rand
+        self.proxy = StandInClientProxy(self.event)
+        self.client = None
+        self.loggedIn = False
+        self.stopped = False
+
+    def start(self):
+        from twisted.internet import reactor
+        from twisted.internet.protocol import ClientCreator
+        from c2w.protocol.udp_chat_client import c2wUdpChatClientProtocol
+        from c2w.protocol.tcp_chat_client import c2wTcpChatClientProtocol
+
+        if self.args.tcp:
+            creator = ClientCreator(reactor, c2wTcpChatClientProtocol,
+                                    self.proxy, self.args.host,
+                                    self.args.port)
+            deferred = creator.connectTCP(self.args.host, self.args.port)
+            deferred.addCallback(self.connected)
+        else:
+            client = c2wUdpChatClientProtocol(self.args.host, self.args.port,
+                                              self.proxy, self.args.loss)
+            # startProtocol leaves its transport in DatagramProtocol.transport,
+            # which makeConnection asserts is None
+            client.transport = None
+            reactor.listenUDP(0, client)
+            self.connected(client)
+
+    def connected(self, client):
+        self.client = client
+        client.sendLoginRequestOIE(self.name)
+
+    def event(self, name, args):
+        if name == "initCompleteONE":
+            self.stats.logins += 1
+            self.loggedIn = True
+            self.schedule()
+        elif name == "connectionRejectedONE":
+            self.stats.rejected += 1
+        elif name == "chatMessageReceivedONE":
+            self.stats.received += 1
+            sent = float(args[1].split(" ", 1)[0])
+            self.stats.latencies.append(time.time() - sent)
+        elif name == "joinRoomOKONE":
+            self.stats.joins += 1
+
+    def schedule(self):
+        from twisted.internet import reactor
+        if not self.stopped:
+            reactor.callLater(self.rand.expovariate(1.0 / self.args.think_time),
+                              self.act)
+
+    def act(self):
+        from c2w.main.constants import ROOM_IDS
+        from c2w.protocol.tables import state_code
+
+        if self.stopped:
+            return
+        state = self.client.state
+        if state == state_code["inMovieRoom"] and (
+                self.rand.random() < self.args.hop):
+            self.client.sendJoinRoomRequestOIE(ROOM_IDS.MAIN_ROOM)
+        elif state == state_code["inMainRoom"] and (
+                self.rand.random() < self.args.hop and self.client.movieList):
+            self.client.sendJoinRoomRequestOIE(
+                    self.rand.choice(self.client.movieList).movieName)
+        elif state in (state_code["inMainRoom"], state_code["inMovieRoom"]):
+            text = "%.6f %s" % (time.time(), "x" * self.args.size)
+            self.client.sendChatMessageOIE(text)
+            self.stats.sent += 1
+        self.schedule()
+
+    def stop(self):
+        self.stopped = True
+        if self.loggedIn:
+            self.client.sendLeaveSystemRequestOIE()
+
+
+def runSwarm(args, processIndex, clientCount, results=None):
+    """
+    Run clientCount clients until the end of the run.
+    The reactor is imported here, after the fork of the worker processes,
+    so that every process gets its own.
+    """
+    from twisted.internet import reactor
+
+    stats = Stats()
+    rand = random.Random(processIndex)
+    bots = [Bot("bot%d-%d" % (processIndex, i), args, stats, rand)
+            for i in range(clientCount)]
+    for i, bot in enumerate(bots):
+        reactor.callLater(args.ramp_up * i / max(clientCount, 1), bot.start)
+
+    def stop():
+        for bot in bots:
+            bot.stop()
+        # let the leave requests go out
+        reactor.callLater(1, reactor.stop)
+    reactor.callLater(args.ramp_up + args.duration, stop)
+    reactor.run()
+    if results is not None:
+        results.put(stats.summary())
+    return stats.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tcp", action="store_true")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1900)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds of activity after the ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=5,
+                        help="seconds to start all the clients")
+    parser.add_argument("--think-time", type=float, default=2,
+                        help="mean seconds between two actions of a client")
+    parser.add_argument("--size", type=int, default=30,
+                        help="chat message size in bytes")
+    parser.add_argument("--hop", type=float, default=0.05,
+                        help="probability that an action is a room change")
+    parser.add_argument("--loss", type=float, default=0,
+                        help="loss probability of the UDP datagrams sent")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        summaries = [runSwarm(args, 0, args.clients)]
+    else:
+        results = multiprocessing.Queue()
+        workers = []
+        for i in range(args.processes):
+            count = (args.clients // args.processes +
+                     (1 if i < args.clients % args.processes else 0))
+            worker = multiprocessing.Process(target=runSwarm,
+                                             args=(args, i, count, results))
+            worker.start()
+            workers.append(worker)
+        summaries = [results.get() for worker in workers]
+        for worker in workers:
+            worker.join()
+
+    # imported after the workers have run, it brings in the reactor
+    from loopback import percentile
+
+    total = Stats()
+    for summary in summaries:
+        for name, value in summary.items():
+            setattr(total, name, getattr(total, name) + value)
+    print "%s swarm of %d clients in %d processes against %s:%d" % (
+        "TCP" if args.tcp else "UDP", args.clients, max(args.processes, 1),
+        args.host, args.port)
+    print "logins:          %d (%d rejected)" % (total.logins, total.rejected)
+    print "chat messages:   %d sent, %d received" % (total.sent,
+                                                      total.received)
+    print "room changes:    %d" % total.joins
+    print "chat rate:       %.1f messages/s" % (total.sent / args.duration)
+    print "chat latency:    p50 %s ms, p99 %s ms" % (
+        percentile(total.latencies, 0.5), percentile(total.latencies, 0.99))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import weakref
+import timer_wheel
+from config import coalesce_limit
+
+
+class Coalescer():
+    """
+    Writes to the peers of a protocol gathered during one reactor
+    iteration.
+
+    The first write queued schedules a call for the next iteration, once
+    every event of the current one is handled, which hands all the
+    buffers written to a peer at once to the flush function: a single
+    ``writeSequence`` for TCP, container datagrams for UDP. A long
+    iteration is flushed every coalesce_limit writes, so that the acks
+    are not held back until its end.
+    """
+
+    def __init__(self, flush, clock=None):
+        """
+        :param flush: function called with a peer and the list of the
+            buffers written to it, in order
+        :param clock: the object providing callLater, the reactor by
+            default
+
+        .. attribute:: writes
+        peer: list of the buffers not flushed yet
+
+        .. attribute:: flushes
+        Number of flush calls, each of them for one peer
+        """
+        self.flushPeer = flush
+        self.clock = clock or timer_wheel.reactor
+        self.writes = {}
+        self.count = 0  # buffers not flushed yet
+        self.call = None
+        self.flushes = 0
+
+    def write(self, peer, buf):
+        bufs = self.writes.get(peer)
+        if bufs is not None:
+            bufs.append(buf)
+        else:
+            self.writes[peer] = [buf]
+            if self.call is None:
+                self.call = self.clock.callLater(0, self.flush)
+        self.count += 1
+        if self.count >= coalesce_limit:
+            self.flush()
+
+    def flush(self):
+        """hand all the buffers written to the flush function now"""
+        if self.call is not None:
+            if self.call.active():
+                self.call.cancel()
+            self.call = None
+        writes, self.writes = self.writes, {}
+        self.count = 0
+        for peer, bufs in writes.iteritems():
+            self.flushes += 1
+            self.flushPeer(peer, bufs)
+
+
+_coalescers = weakref.WeakKeyDictionary()  # owner: Coalescer
+
+
+def getCoalescer(owner, flush):
+    """
+    The Coalescer shared by all the protocol instances of an owner, the
+    serverProxy of the TCP server for instance (one instance per
+    connection), so that a broadcast is flushed by a single call.
+    """
+    if owner not in _coalescers:
+        _coalescers[owner] = Coalescer(flush)
+    return _coalescers[owner]
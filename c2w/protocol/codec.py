@@ -0,0 +1,458 @@
+"""
+Table-driven wire codec.
+
+This module produces exactly the same bytes as ``util.packMsg`` and
+``util.unpackMsg`` but avoids their per-call costs:
+
+* every ``struct`` format is compiled once into a ``struct.Struct``;
+* the body encoder/decoder is picked from a dispatch table indexed by
+  ``msgType`` instead of a chain of ``if`` tests;
+* decoding reads every field with ``unpack_from`` at an offset, so the
+  only strings created are the ones handed back to the caller;
+* bodies are encoded from a dispatch table as well, and ``encodeInto``
+  writes a whole message into a caller-owned, reusable ``bytearray``.
+
+Two header versions exist. The legacy 6 bytes header gives a single byte
+to ``seqNum``, ``userId`` and ``destId``. The wide header is 12 bytes long:
+a marker byte, the legacy first byte, a 32 bits ``seqNum``, then 16 bits
+``userId``, ``destId`` and ``length``. The marker is a first byte with
+the ``msgType`` 4, which no packet uses, so every packet tells its own
+version and ``Packet.headerVersion`` is set when it is decoded. The user
+ids in the bodies are 16 bits as well in a wide packet.
+
+The ``destId`` of a loginRequest, always sent with a legacy header,
+holds the login options of the client: the wide header offer and the
+largest fragments it accepts (see ``packLoginOptions``). The ack of the
+server holds the options chosen for the rest of the session.
+
+Peers using the wide header also accept container datagrams: a wide
+header with the ``msgType`` 11, followed by complete datagrams, each
+with its own header (see ``packContainers``).
+"""
+import struct
+from packet import Packet
+from tables import type_code, room_type
+from data_strucs import Movie, User
+
+LEGACY_HEADER = 0
+WIDE_HEADER = 1
+HEADER_LENGTH = 6
+WIDE_HEADER_LENGTH = 12
+WIDE_MARKER = 4 << 2  # first byte of a wide header
+SEQ_MODULO = 256  # sequence numbers are a single byte in a legacy header
+WIDE_SEQ_MODULO = 2 ** 32
+
+# indexed by header version
+headerLengths = [HEADER_LENGTH, WIDE_HEADER_LENGTH]
+seqModulos = [SEQ_MODULO, WIDE_SEQ_MODULO]
+idLimits = [256, 2 ** 16]  # user ids are below the limit
+FRAGMENT_UNIT = 16  # bytes, of the fragment length in the login options
+MAX_FRAGMENT_UNITS = 127
+
+headerStruct = struct.Struct("!BBBBH")
+wideHeaderStruct = struct.Struct("!BBIHHH")  # marker, then the same fields
+movieStructs = [struct.Struct("BB"),  # name length, roomId
+                struct.Struct("!BH")]
+userStructs = [struct.Struct("BBB"),  # name length, userId, status
+               struct.Struct("!BHB")]
+deltaStructs = [struct.Struct("BBBB"),  # change, name length, userId, status
+                struct.Struct("!BBHB")]
+addrStruct = struct.Struct("HBBBB")  # port, ip (4 bytes)
+errorStruct = struct.Struct("B")
+seqUserStruct = struct.Struct("!BB")  # seqNum and userId inside a header
+wideSeqUserStruct = struct.Struct("!IH")  # at offset 2 of a wide header
+ackStruct = struct.Struct("!BBB")  # first byte, seqNum and userId
+wideAckStruct = struct.Struct("!xBIH")
+firstStruct = struct.Struct("B")
+lengthStruct = struct.Struct("!H")  # length field, the end of a header
+
+
+def firstByte(frg, ack, msgType, roomType):
+    return (frg << 7) | (ack << 6) | (msgType << 2) | roomType
+
+
+CONTAINER_BYTE = firstByte(0, 0, type_code["container"],
+                           room_type["notApplicable"])
+CONTAINER_PREFIX = chr(WIDE_MARKER) + chr(CONTAINER_BYTE)
+
+
+def headerLength(buf, offset=0):
+    """returns: the length of the header starting at offset in buf"""
+    if firstStruct.unpack_from(buf, offset)[0] == WIDE_MARKER:
+        return WIDE_HEADER_LENGTH
+    return HEADER_LENGTH
+
+
+def packLoginOptions(headerVersion, fragmentLength):
+    """
+    returns: the destId of a loginRequest, bit 0 for the wide header and
+    the other bits for the largest data length of the fragments, in
+    FRAGMENT_UNIT bytes, 0 if only max_data_length is accepted
+    """
+    units = min(fragmentLength // FRAGMENT_UNIT, MAX_FRAGMENT_UNITS)
+    return units << 1 | headerVersion
+
+
+def unpackLoginOptions(destId):
+    """returns: (header version, fragment data length or 0)"""
+    return destId & 1, (destId >> 1) * FRAGMENT_UNIT
+
+
+def seqDiff(a, b, modulo=SEQ_MODULO):
+    """
+    returns: a - b in serial number arithmetic (RFC 1982), negative if
+    the sequence number a comes before b. It is right as long as they
+    are less than modulo / 2 apart, whatever the wraparounds.
+    """
+    return (a - b + modulo // 2) % modulo - modulo // 2
+
+
+# ---------------------------------------------------------------- encoding
+# Body encoders return the body as a str: joining small pieces is much
+# cheaper than writing them one by one into a bytearray.
+
+def _encodeStr(pack):
+    return pack.data or ""
+
+
+def _encodeNothing(pack):
+    return ""
+
+
+def _movieListEncoder(movieStruct):
+    packMovie = movieStruct.pack
+
+    def encode(pack):
+        return "".join([packMovie(movie.length, movie.roomId) +
+                        movie.movieName for movie in pack.data])
+    return encode
+
+
+def _userListEncoder(userStruct):
+    packUser = userStruct.pack
+
+    def encode(pack):
+        return "".join([packUser(user.length, user.userId, user.status) +
+                        user.name for user in pack.data.values()])
+    return encode
+
+
+def _userListDeltaEncoder(deltaStruct):
+    packEntry = deltaStruct.pack
+
+    def encode(pack):
+        return "".join([packEntry(change, user.length, user.userId,
+                                  user.status) + user.name
+                        for change, user in pack.data])
+    return encode
+
+
+def _encodeError(pack):
+    return errorStruct.pack(pack.data)
+
+
+def _encodeRoomAck(pack):
+    if pack.roomType == room_type["movieRoom"]:
+        ip = pack.data["ip"].split(".")
+        return addrStruct.pack(pack.data["port"],
+                int(ip[0]), int(ip[1]), int(ip[2]), int(ip[3]))
+    return ""
+
+
+_encoders = []  # header version: encoder of each msgType
+for _version in (LEGACY_HEADER, WIDE_HEADER):
+    _table = [_encodeStr] * 16
+    _table[type_code["movieList"]] = _movieListEncoder(movieStructs[_version])
+    _table[type_code["userList"]] = _userListEncoder(userStructs[_version])
+    _table[type_code["userListDelta"]] = _userListDeltaEncoder(
+            deltaStructs[_version])
+    _table[type_code["roomRequest"]] = _encodeNothing
+    _encoders.append(_table)
+
+# an ack only carries a body for errors and movie room requests
+_ackEncoders = [_encodeNothing] * 16
+_ackEncoders[type_code["errorMessage"]] = _encodeError
+_ackEncoders[type_code["roomRequest"]] = _encodeRoomAck
+
+
+def encodeBody(pack):
+    """
+    Return the body of ``pack`` as a str of exactly ``pack.length`` bytes,
+    truncated or zero padded like the legacy "Ns" formats.
+    """
+    if pack.ack == 1:
+        body = _ackEncoders[pack.msgType](pack)
+    else:
+        body = _encoders[pack.headerVersion][pack.msgType](pack)
+    if len(body) != pack.length:
+        body = body[:pack.length].ljust(pack.length, "\x00")
+    return body
+
+
+def _packHeader(headerVersion, byte_1, seqNum, userId, destId, length):
+    if headerVersion == WIDE_HEADER:
+        return wideHeaderStruct.pack(WIDE_MARKER, byte_1, seqNum, userId,
+                                     destId, length)
+    return headerStruct.pack(byte_1, seqNum, userId, destId, length)
+
+
+def packHeader(pack):
+    """Same bytes as ``util.packHeader(pack).raw`` for a legacy header."""
+    return _packHeader(pack.headerVersion,
+            firstByte(pack.frg, pack.ack, pack.msgType, pack.roomType),
+            pack.seqNum, pack.userId, pack.destId, pack.length)
+
+
+def packMsg(pack):
+    """Same bytes as ``util.packMsg(pack).raw`` for a legacy header."""
+    return packHeader(pack) + encodeBody(pack)
+
+
+def encodeInto(pack, buf, offset=0):
+    """
+    Write ``pack`` into the bytearray ``buf`` at ``offset``, growing the
+    buffer if needed. Returns the offset following the message.
+    """
+    header = packHeader(pack)
+    body = encodeBody(pack)
+    bodyStart = offset + len(header)
+    end = bodyStart + len(body)
+    if len(buf) < end:
+        buf.extend("\x00" * (end - len(buf)))
+    view = memoryview(buf)
+    view[offset:bodyStart] = header
+    view[bodyStart:end] = body
+    return end
+
+
+def fragmentMsg(pack, maxLength):
+    """
+    Encode ``pack`` once and split its body into fragments of at most
+    ``maxLength`` bytes. Returns a list of bytearrays, each holding a
+    complete header of ``pack.headerVersion``; fragments are numbered from
+    ``pack.seqNum`` and addressed to ``pack.userId`` until changed with
+    ``rewriteHeader``.
+    """
+    body = encodeBody(pack)
+    modulo = seqModulos[pack.headerVersion]
+    frags = []
+    offset = 0
+    seqNum = pack.seqNum
+    while True:
+        chunk = body[offset:offset + maxLength]
+        offset += len(chunk)
+        frg = 1 if offset < len(body) else 0
+        frags.append(bytearray(_packHeader(pack.headerVersion,
+                firstByte(frg, pack.ack, pack.msgType, pack.roomType),
+                seqNum, pack.userId, pack.destId, len(chunk)) + chunk))
+        seqNum = (seqNum + 1) % modulo
+        if frg == 0:
+            return frags
+
+
+def packContainers(datagrams, maxLength):
+    """
+    Pack the complete datagrams sent to a peer using the wide header into
+    as few datagrams of at most ``maxLength`` bytes as possible. A
+    datagram alone, or too long to share one, is left as it is. Returns
+    the list of the datagrams to send, in order.
+    """
+    packed = []
+    group = []
+    length = WIDE_HEADER_LENGTH
+    for datagram in datagrams + [None]:
+        if datagram is None or length + len(datagram) > maxLength:
+            if len(group) == 1:
+                packed.append(group[0])
+            elif group:
+                packed.append(_packHeader(WIDE_HEADER, CONTAINER_BYTE, 0, 0,
+                        len(group), length - WIDE_HEADER_LENGTH) +
+                        "".join(group))
+            group = []
+            length = WIDE_HEADER_LENGTH
+        if datagram is not None:
+            group.append(datagram)
+            length += len(datagram)
+    return packed
+
+
+def rewriteHeader(buf, seqNum, userId):
+    """
+    Change the seqNum and userId of an encoded message, a bytearray, in
+    place.
+    """
+    if buf[0] == WIDE_MARKER:
+        wideSeqUserStruct.pack_into(buf, 2, seqNum, userId)
+    else:
+        seqUserStruct.pack_into(buf, 1, seqNum, userId)
+
+
+# ---------------------------------------------------------------- decoding
+
+def _decodeStr(data, offset, end, roomType):
+    # the legacy decoder keeps everything after the header
+    if len(data) > offset:
+        return data[offset:]
+    return None
+
+
+def _entryStructs(entryStruct):
+    """
+    returns: for each name length, the Struct of a whole entry: the fields
+    of entryStruct, then the name. A user entry is then read by a single
+    unpack_from, the name is not sliced out of the datagram.
+    """
+    return [struct.Struct(entryStruct.format + "%ds" % nameLength)
+            for nameLength in range(256)]
+
+
+def _movieListDecoder(movieStruct):
+    unpack_from = movieStruct.unpack_from
+    size = movieStruct.size
+
+    def decode(data, offset, end, roomType):
+        movies = []
+        while offset < end:
+            nameLength, roomId = unpack_from(data, offset)
+            offset += size
+            movies.append(Movie(data[offset:offset + nameLength], roomId))
+            offset += nameLength
+        return movies
+    return decode
+
+
+def _userListDecoder(userStruct):
+    entryStructs = _entryStructs(userStruct)
+
+    def decode(data, offset, end, roomType):
+        users = []
+        append = users.append
+        while offset < end:
+            entry = entryStructs[ord(data[offset])]  # name length
+            nameLength, userId, status, name = entry.unpack_from(data, offset)
+            offset += entry.size
+            append(User(name, userId, status))
+        return users
+    return decode
+
+
+def _userListDeltaDecoder(deltaStruct):
+    entryStructs = _entryStructs(deltaStruct)
+
+    def decode(data, offset, end, roomType):
+        entries = []
+        while offset < end:
+            entry = entryStructs[ord(data[offset + 1])]  # name length
+            change, nameLength, userId, status, name = entry.unpack_from(
+                    data, offset)
+            offset += entry.size
+            entries.append((change, User(name, userId, status)))
+        return entries
+    return decode
+
+
+def _decodeError(data, offset, end, roomType):
+    return errorStruct.unpack_from(data, offset)[0]
+
+
+def _decodeRoomAck(data, offset, end, roomType):
+    if roomType == room_type["movieRoom"]:
+        msg = addrStruct.unpack_from(data, offset)
+        return {"port": msg[0], "ip": "%d.%d.%d.%d" % msg[1:]}
+    return None
+
+
+_decoders = []  # header version: decoder of each msgType
+_ackDecoders = []
+for _version in (LEGACY_HEADER, WIDE_HEADER):
+    _table = [_decodeStr] * 16
+    _table[type_code["movieList"]] = _movieListDecoder(movieStructs[_version])
+    _table[type_code["userList"]] = _userListDecoder(userStructs[_version])
+    _table[type_code["userListDelta"]] = _userListDeltaDecoder(
+            deltaStructs[_version])
+    _decoders.append(_table)
+    _table = list(_table)
+    _table[type_code["errorMessage"]] = _decodeError
+    _table[type_code["roomRequest"]] = _decodeRoomAck
+    _ackDecoders.append(_table)
+
+
+def decodeBody(header, data, offset=None):
+    """
+    Decode the body of ``data`` described by the ``header`` Packet, it
+    starts right after the header unless offset is given.
+    """
+    if offset is None:
+        offset = headerLengths[header.headerVersion]
+    if header.ack == 1:
+        decoder = _ackDecoders[header.headerVersion][header.msgType]
+    else:
+        decoder = _decoders[header.headerVersion][header.msgType]
+    return decoder(data, offset, offset + header.length, header.roomType)
+
+
+def unpackHeader(datagram, offset=0):
+    """Same result as ``util.unpackHeader`` for a legacy header."""
+    byte_1, seqNum, userId, destId, length = headerStruct.unpack_from(
+            datagram, offset)
+    if byte_1 != WIDE_MARKER:
+        return Packet(byte_1 >> 7 & 1, byte_1 >> 6 & 1, byte_1 >> 2 & 15,
+                      byte_1 & 3, seqNum=seqNum, userId=userId,
+                      destId=destId, length=length, data=None)
+    marker, byte_1, seqNum, userId, destId, length = (
+            wideHeaderStruct.unpack_from(datagram, offset))
+    return Packet(byte_1 >> 7 & 1, byte_1 >> 6 & 1, byte_1 >> 2 & 15,
+                  byte_1 & 3, seqNum=seqNum, userId=userId, destId=destId,
+                  length=length, data=None, headerVersion=WIDE_HEADER)
+
+
+def peekAck(datagram):
+    """
+    returns: (seqNum, userId) if ``datagram`` is an ack, None otherwise.
+    No Packet is created.
+    """
+    byte_1, seqNum, userId = ackStruct.unpack_from(datagram)
+    if byte_1 == WIDE_MARKER:
+        byte_1, seqNum, userId = wideAckStruct.unpack_from(datagram)
+    if byte_1 >> 6 & 1:
+        return seqNum, userId
+    return None
+
+
+def isContainer(datagram):
+    return datagram[:2] == CONTAINER_PREFIX
+
+
+def splitContainer(datagram):
+    """returns: the list of the datagrams held by a container"""
+    datagrams = []
+    offset = WIDE_HEADER_LENGTH
+    while offset < len(datagram):
+        length = headerLength(datagram, offset)
+        end = offset + length + lengthStruct.unpack_from(
+                datagram, offset + length - 2)[0]
+        datagrams.append(datagram[offset:end])
+        offset = end
+    return datagrams
+
+
+def peekType(buf):
+    """
+    returns: (ack, msgType) of an encoded message. No Packet is created.
+    """
+    byte_1 = firstStruct.unpack_from(buf)[0]
+    if byte_1 == WIDE_MARKER:
+        byte_1 = firstStruct.unpack_from(buf, 1)[0]
+    return byte_1 >> 6 & 1, byte_1 >> 2 & 15
+
+
+def unpackMsg(datagram):
+    """
+    Same result as ``util.unpackMsg`` for a legacy header. ``datagram``
+    may be a str, a bytearray or a buffer; the header is only parsed once.
+    """
+    if type(datagram) is not str:
+        datagram = buffer(datagram)
+    pack = unpackHeader(datagram)
+    pack.data = decodeBody(pack, datagram)
+    return pack
@@ -1,3 +1,28 @@
-timeout = 2  # seconds
-attempt_num = 3  # times of resend attempts
+timeout = 2  # seconds, before the first round trip time is measured
+min_timeout = 0.2  # seconds
+max_timeout = 10  # seconds
+attempt_num = 6  # times of resend attempts, 12.6 s from a 0.2 s timeout
 max_data_length = 40  # bytes, header not included
+window_size = 8  # packets in flight per peer
+timer_tick = 0.1  # seconds between two ticks of the retransmission timers
+timer_slots = 64  # slots of the timing wheel, a turn lasts 6.4 seconds
+flight_recorder_size = 256  # packet headers kept for postmortem dumps
+dump_interval = 60  # seconds, at least between two dumps on errors
+header_version = 1  # highest header version used, 0 for the legacy header
+max_datagram_length = 1200  # bytes, header included, safe on the usual paths
+fragment_loss_limit = 2  # large datagrams lost in a row halve the fragments
+fragment_probe_after = 32  # large datagrams acked in a row double them back
+coalesce_limit = 256  # writes gathered in a reactor iteration before a flush
+send_queue_high = 65536  # bytes queued for a TCP client before chat is dropped
+send_queue_low = 16384  # bytes below which it gets chat again, and a resync
+send_queue_budget = 524288  # bytes queued before the client is disconnected
+ayt_interval = 5  # seconds between two sweeps of the idle UDP users
+ayt_idle = 15  # seconds without a datagram before a user is sent an AYT
+ayt_batch = 256  # AYT sent, and users evicted, at most per sweep
+session_timeout = 60  # seconds without a datagram before a user is evicted
+reassembly_timeout = 60  # seconds without a fragment before a packet is dropped
+replay_cache_size = 16  # acks kept per UDP user for its retransmitted requests
+replay_cache_age = 60  # seconds an ack is kept for a retransmitted request
+request_window = 4  # requests of a client in flight, the others are queued
+mmsg_batch = 64  # datagrams per recvmmsg or sendmmsg call of a MmsgPort
+id_quarantine = 60  # seconds before the id of a user who left is reused
@@ -1,67 +1,48 @@
-import util
+import codec
+import tracing
+from reassembly import Reassembler
 
 class DatagramHandler():
     """
     A class designed for client to handle fragmentation.
+    Every packet kept is acked on its own, and packets arriving out of
+    order inside the window are kept until the missing ones are received.
+    A packet beyond the window is dropped unacked. The window is that of
+    the senders of the server, window_size packets at most.
     """
 
     def __init__(self, c2wUdpChatClient):
         """
-        .. attribute:: serverSeqNum
-        The next expected packet from server
-
-        .. attribute:: dataBuf
-        Binary data, to be completed by following packets
-
         .. attribute:: c2wUdpChatClient
         An object of the class c2wUdpChatClientProtocol
 
-        .. attribute:: header
-        Header of a fragmentation packet
+        .. attribute:: reassembler
+        Reassembler of the packets from the server
         """
-        self.serverSeqNum = 0  # sequence number of the next not ack packet
         self.client = c2wUdpChatClient
-        self.dataBuf = ""
-        self.header = None
+        self.reassembler = Reassembler(c2wUdpChatClient.timers)
 
     def sendAck(self, pack):
-        ackPack = pack.copy()
-        ackPack.turnIntoAck()
-        self.client.sendPacket(ackPack)
+        self.client.sendPacket(pack.makeAck())
         return
 
-    def unpackMsg(self, datagram):
-        packHeader = util.unpackHeader(datagram)
+    def unpackMsgs(self, datagram):
+        """
+        returns: the list of the complete packets which can be handled,
+        in the order of their seqNums
+        """
+        packHeader = codec.unpackHeader(datagram)
         if packHeader.ack == 1:
-            return util.unpackMsg(datagram)
-        else:
-            if packHeader.seqNum == self.serverSeqNum:
-                self.serverSeqNum += 1
-                self.sendAck(packHeader)
-            else:
-                print "Unexpected seqNum packet received, aborted"
-                self.sendAck(packHeader)
-                return
-
-            if packHeader.frg == 1:
-                if self.header == None:  # first frg packet
-                    self.header = util.unpackHeader(datagram)
-                else:
-                    self.header.length += packHeader.length
-                # save current buf
-                self.dataBuf += datagram[6:]
-            elif packHeader.frg == 0 and self.header != None:  # last frgment packet
-                self.header.length += packHeader.length
-                self.header.seqNum = packHeader.seqNum
-                self.header.frg = 0
-                self.dataBuf += datagram[6:]
-                headerBuf = util.packHeader(self.header).raw
-                finalPackBuf = headerBuf + self.dataBuf
-                # reset attributes before return packet
-                self.dataBuf = ""
-                self.header = None
-                return util.unpackMsg(finalPackBuf)
-            elif packHeader.frg == 0 and self.header == None:  # not a frgment packet
-                return util.unpackMsg(datagram)
-            else:
-                print "Unexpected error when unpacking datagram"
+            packHeader.data = codec.decodeBody(packHeader, datagram)
+            return [packHeader]
+
+        packs = self.reassembler.receive(packHeader, datagram)
+        if packs is None:
+            # dropped, the server sends it again
+            if tracing.reliability.infoOn:
+                tracing.reliability.info("packet beyond the window "
+                                         "aborted: %s", packHeader)
+            return []
+        # the ack of a duplicate may have been lost, ack it again
+        self.sendAck(packHeader)
+        return packs
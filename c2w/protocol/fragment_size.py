@@ -0,0 +1,63 @@
+from config import max_data_length, fragment_loss_limit, fragment_probe_after
+
+
+class FragmentSize():
+    """
+    Data length of the fragments sent to a peer.
+
+    It starts at the length negotiated at login. When large datagrams keep
+    getting lost it is halved, down to max_data_length, as a path dropping
+    them would lose every one of them. After a run of large datagrams
+    acked at their first transmission it is doubled back, up to the
+    negotiated length. Fragments already sent keep their length.
+    """
+
+    def __init__(self, negotiated, floor=max_data_length):
+        """
+        .. attribute:: length
+        The data length of the next fragments
+        """
+        self.negotiated = negotiated
+        self.floor = min(floor, negotiated)
+        self.length = negotiated
+        self.losses = 0  # large datagrams lost in a row
+        self.successes = 0  # large datagrams acked in a row
+        self.fallbacks = 0
+
+    def isCurrentSize(self, dataLength):
+        """
+        returns: True for a datagram of the current length, the others say
+        nothing about it
+        """
+        return self.length // 2 < dataLength <= self.length
+
+    def lost(self, dataLength):
+        """a datagram with dataLength bytes of data is retransmitted"""
+        if self.length == self.floor or not self.isCurrentSize(dataLength):
+            return
+        self.successes = 0
+        self.losses += 1
+        if self.losses >= fragment_loss_limit:
+            self.length = max(self.floor, self.length // 2)
+            self.losses = 0
+            self.fallbacks += 1
+
+    def delivered(self, dataLength):
+        """a datagram is acked at its first transmission"""
+        if not self.isCurrentSize(dataLength):
+            return
+        self.losses = 0
+        self.successes += 1
+        if (self.successes >= fragment_probe_after and
+                self.length < self.negotiated):
+            self.length = min(self.negotiated, self.length * 2)
+            self.successes = 0
+
+    def getStats(self):
+        """
+        returns: a dict with the negotiated and the current data lengths,
+        and the number of fallbacks
+        """
+        return {"negotiated": self.negotiated,
+                "length": self.length,
+                "fallbacks": self.fallbacks}
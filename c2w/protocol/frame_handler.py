@@ -1,57 +1,69 @@
-from packet import Packet
-import util
+import struct
+import codec
+import tracing
+from codec import HEADER_LENGTH, WIDE_HEADER_LENGTH, WIDE_MARKER
+
+lengthStruct = struct.Struct("!H")  # length field, the end of a header
+
 
 class FrameHandler:
+    """
+    Split the TCP stream into c2w packets.
 
-    def __init__(self):
-        self.headFound = False
-        self.currentHead = ""  # current header in binary mode
-        self.currentSize = 0
-        self.buf = ""
-        self.header = Packet(0, 0, 0, 3, 0, 0, 0, 0, None)
+    The received bytes are appended to a single bytearray and the frames
+    are read in place, at an offset moved forward after every frame, and
+    each packet is decoded when the caller reaches it. The consumed bytes
+    are dropped once they are the larger part of the buffer, so it never
+    holds much more than the last incomplete frame.
+    """
+
+    def __init__(self, peer=None):
+        """
+        :param peer: the address of the other end, for the flight recorder
+        """
+        self.peer = peer
+        self.buf = bytearray()
+        self.start = 0  # offset of the first byte not consumed yet
 
     def extractPackets(self, data):
         """
-        return: a list of packet objects
+        Append data to the stream.
+        return: an iterator over the complete packets, each of them is
+        decoded only when it is reached. The packets not reached are kept
+        for the next call.
         """
-        packList = []
-        while data != "":
-            # header detected
-            if not self.headFound:
-                print "PACKET HEADER DETECTED"
-                remainHeadLength = 6 - len(self.currentHead)
-                if len(data) >= remainHeadLength:
-                    if self.currentHead != "":
-                        self.currentHead += data[0:remainHeadLength]
-                        data = data[remainHeadLength:]
-                    else:
-                        self.currentHead = data[0:6]
-                        data = data[6:]
-                    self.header = util.unpackHeader(self.currentHead)
-                    self.buf += self.currentHead
-                    self.currentHead = ""
-                    self.headFound = True
+        # the bytes consumed by an iterator not exhausted
+        self.compact()
+        self.buf += data
+        return self.frames()
+
+    def frames(self):
+        buf = self.buf
+        try:
+            while len(buf) - self.start >= HEADER_LENGTH:
+                if buf[self.start] == WIDE_MARKER:
+                    headerLength = WIDE_HEADER_LENGTH
+                    if len(buf) - self.start < headerLength:
+                        break
                 else:
-                    self.currentHead += data
-                    data = ""
-            # remain msg in the packet
-            else:
-                # The packet is separated into many TCP packets
-                if len(data) <= (self.header.length - self.currentSize):
-                    self.buf += data
-                    self.currentSize += len(data)
-                    data = ""
-                # Multiple packets are packed into one TCP packet, always happen
-                else:  # cut the data
-                    t_data = data[0:self.header.length - self.currentSize]
-                    self.buf += t_data
-                    self.currentSize += len(t_data)
-                    data = data[self.header.length - self.currentSize:]
-
-            if self.currentSize >= self.header.length and self.headFound:
-                packList.append(util.unpackMsg(self.buf))
-                self.header = Packet(0, 0, 0, 3, 0, 0, 0, 0, None)
-                self.headFound = False
-                self.currentSize = 0
-                self.buf = ""
-        return packList
+                    headerLength = HEADER_LENGTH
+                frameLength = headerLength + lengthStruct.unpack_from(
+                        buf, self.start + headerLength - 2)[0]
+                if len(buf) - self.start < frameLength:
+                    break  # the end of the frame is not received yet
+                frame = buffer(buf, self.start, frameLength)
+                self.start += frameLength
+                tracing.recorder.record("in", self.peer, frame)
+                yield codec.unpackMsg(frame)
+        finally:
+            # also when the caller stops early, or raises
+            self.compact()
+
+    def compact(self):
+        """drop the consumed bytes"""
+        if self.start == len(self.buf):
+            del self.buf[:]
+            self.start = 0
+        elif self.start > len(self.buf) // 2:
+            del self.buf[:self.start]
+            self.start = 0
@@ -0,0 +1,57 @@
+import heapq
+from collections import deque
+import timer_wheel
+from config import id_quarantine
+
+
+class IdAllocator():
+    """
+    User ids of a server. The ids of the users who left are given out
+    again, the smallest first, so that they stay under the limit of the
+    legacy header (see ``codec.idLimits``) while the server has fewer
+    users than it allows. An id is only given out again id_quarantine
+    seconds after its user left, once the late datagrams of the old user
+    can no longer be taken for the new one's. Taking an id from the free
+    ids costs O(log(free ids)), a new id O(1).
+    """
+
+    def __init__(self, first=1, step=1, clock=None,
+                 quarantine=id_quarantine):
+        """
+        :param first: the first id given out
+        :param step: difference between two new ids, the workers of a
+            sharded server interleave their ids
+        :param clock: the object providing seconds, the reactor by default
+
+        .. attribute:: free
+        Heap of the ids released and not given out again
+
+        .. attribute:: released
+        (time released, id) of the ids in quarantine, oldest first
+        """
+        self.nextId = first
+        self.step = step
+        self.clock = clock or timer_wheel.reactor
+        self.quarantine = quarantine
+        self.free = []
+        self.released = deque()
+
+    def allocate(self):
+        now = self.clock.seconds()
+        while self.released and now - self.released[0][0] >= self.quarantine:
+            heapq.heappush(self.free, self.released.popleft()[1])
+        if self.free:
+            return heapq.heappop(self.free)
+        userId = self.nextId
+        self.nextId += self.step
+        return userId
+
+    def release(self, userId, quarantine=True):
+        """
+        userId: an id given out by this allocator, its user has left
+        quarantine: False if the id was never told to a client
+        """
+        if quarantine:
+            self.released.append((self.clock.seconds(), userId))
+        else:
+            heapq.heappush(self.free, userId)
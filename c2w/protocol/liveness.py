@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import timer_wheel
+from config import ayt_interval, ayt_idle, ayt_batch, session_timeout
+
+
+class Liveness():
+    """
+    Last activity of the users of a UDP server, which is not told when a
+    client vanishes without a disconnectRequest.
+
+    The users are kept in the order of their last datagram, so a sweep,
+    every ayt_interval seconds, only walks the idle ones at the front. A
+    user idle for ayt_idle seconds is sent an AYT, which its client acks.
+    A user idle for session_timeout seconds is evicted. A sweep sends at
+    most ayt_batch AYT and evicts at most ayt_batch users, so that a mass
+    departure does not stall the reactor.
+    """
+
+    def __init__(self, probe, evict, clock=None, interval=ayt_interval,
+                 idle=ayt_idle, timeout=session_timeout, batch=ayt_batch):
+        """
+        :param probe: function called with the userId of an idle user, it
+            must send it an AYT
+        :param evict: function called with the userId of a user gone
+            silent, it must remove the user, forget() included
+        :param clock: the object providing callLater and seconds, the
+            reactor by default
+
+        .. attribute:: seen
+        userId: time of the last datagram of the user, oldest first. A user
+        is only moved to the end once per interval, the times are late by
+        less than an interval.
+
+        .. attribute:: probed
+        The userIds sent an AYT since their last datagram
+        """
+        self.probe = probe
+        self.evict = evict
+        self.clock = clock or timer_wheel.reactor
+        self.interval = interval
+        self.idle = idle
+        self.timeout = timeout
+        self.batch = batch
+        self.seen = OrderedDict()
+        self.probed = set()
+        self.call = None
+        self.probes = 0
+        self.evictions = 0
+
+    def touch(self, userId):
+        """a datagram is received from the user"""
+        now = self.clock.seconds()
+        last = self.seen.get(userId)
+        if last is not None:
+            if now - last < self.interval:
+                return
+            del self.seen[userId]
+            self.probed.discard(userId)
+        self.seen[userId] = now
+        if self.call is None:
+            self.call = self.clock.callLater(self.interval, self.sweep)
+
+    def forget(self, userId):
+        """the user has left"""
+        self.seen.pop(userId, None)
+        self.probed.discard(userId)
+
+    def sweep(self):
+        self.call = None
+        now = self.clock.seconds()
+        probes = []
+        expired = []
+        for userId, last in self.seen.iteritems():
+            if now - last < self.idle:
+                break  # the following ones are more recent
+            if now - last >= self.timeout:
+                expired.append(userId)
+                if len(expired) == self.batch:
+                    break  # the others in the next sweeps
+            elif len(probes) == self.batch:
+                break  # and none of the following ones is expired
+            elif userId not in self.probed:
+                probes.append(userId)
+        for userId in probes:
+            self.probed.add(userId)
+            self.probes += 1
+            self.probe(userId)
+        for userId in expired:
+            self.evictions += 1
+            self.evict(userId)
+        if self.seen:
+            self.call = self.clock.callLater(self.interval, self.sweep)
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def getStats(self):
+        """
+        returns: a dict with the number of users followed and of users
+        probed, and the number of AYT sent and of users evicted
+        """
+        return {"users": len(self.seen),
+                "probed": len(self.probed),
+                "probes": self.probes,
+                "evictions": self.evictions}
@@ -0,0 +1,218 @@
+"""
+Batched datagram I/O for the UDP server, with the recvmmsg and sendmmsg
+system calls of Linux, through ctypes.
+
+``MmsgPort`` is a Twisted UDP port, so the protocol is unchanged: each
+datagram of a batch is handed to ``datagramReceived``, and the
+datagrams written are queued until the end of the reactor iteration,
+then sent together. A room broadcast costs a few sendmmsg calls instead
+of one sendto per user. ``available`` is False where the calls are
+missing, the plain port of the reactor must be used there.
+"""
+import ctypes
+import ctypes.util
+import errno
+import socket
+import sys
+from errno import EAGAIN, EWOULDBLOCK, EINTR
+
+from twisted.internet import udp
+from twisted.python import log
+
+import tracing
+from config import mmsg_batch
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort),
+                ("sin_port", ctypes.c_uint16),  # network byte order
+                ("sin_addr", ctypes.c_ubyte * 4),
+                ("sin_zero", ctypes.c_char * 8)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+MSG_DONTWAIT = 0x40
+
+_libc = None
+if sys.platform.startswith("linux"):
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+available = (_libc is not None and hasattr(_libc, "recvmmsg") and
+             hasattr(_libc, "sendmmsg"))
+if available:
+    _libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                               ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                               ctypes.c_uint, ctypes.c_int]
+
+
+class MmsgPort(udp.Port):
+    """
+    UDP port over IPv4, reading up to batch datagrams per recvmmsg call
+    and sending the datagrams of a reactor iteration with sendmmsg.
+    """
+
+    def __init__(self, port, proto, interface="", maxPacketSize=8192,
+                 reactor=None, batch=mmsg_batch):
+        """
+        .. attribute:: outgoing
+        (datagram, (host, port)) written and not sent yet
+        """
+        udp.Port.__init__(self, port, proto, interface=interface,
+                          maxPacketSize=maxPacketSize, reactor=reactor)
+        self.batch = batch
+        self.outgoing = []
+        self.call = None
+        # the receive vector is allocated once, the names are reset before
+        # every call
+        self.buffers = [ctypes.create_string_buffer(maxPacketSize)
+                        for i in range(batch)]
+        self.names = (sockaddr_in * batch)()
+        self.iovecs = (iovec * batch)()
+        self.recvVector = (mmsghdr * batch)()
+        for i in range(batch):
+            self.iovecs[i].iov_base = ctypes.addressof(self.buffers[i])
+            self.iovecs[i].iov_len = maxPacketSize
+            hdr = self.recvVector[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.names[i])
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+        self.recvCalls = 0
+        self.sendCalls = 0
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def doRead(self):
+        read = 0
+        while read < self.maxThroughput:
+            for i in range(self.batch):
+                self.recvVector[i].msg_hdr.msg_namelen = ctypes.sizeof(
+                        sockaddr_in)
+            count = _libc.recvmmsg(self.fileno(), self.recvVector,
+                                   self.batch, MSG_DONTWAIT, None)
+            self.recvCalls += 1
+            if count < 0:
+                no = ctypes.get_errno()
+                if no == EINTR:
+                    continue
+                if no not in (EAGAIN, EWOULDBLOCK):
+                    tracing.session.warning("recvmmsg failed: %s",
+                                            errno.errorcode.get(no, no))
+                return
+            self.received += count
+            for i in range(count):
+                length = self.recvVector[i].msg_len
+                read += length
+                data = ctypes.string_at(self.buffers[i], length)
+                name = self.names[i]
+                addr = (socket.inet_ntoa(str(bytearray(name.sin_addr))),
+                        socket.ntohs(name.sin_port))
+                try:
+                    self.protocol.datagramReceived(data, addr)
+                except:
+                    log.err()
+            if count < self.batch:
+                return  # nothing left to read
+
+    def write(self, datagram, addr=None):
+        if addr is None:  # connected mode
+            return udp.Port.write(self, datagram)
+        self.outgoing.append((str(datagram), addr))
+        if self.call is None:
+            self.call = self.reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """send the datagrams written, batch of them per sendmmsg call"""
+        if self.call is not None:
+            if self.call.active():
+                self.call.cancel()
+            self.call = None
+        outgoing, self.outgoing = self.outgoing, []
+        for start in range(0, len(outgoing), self.batch):
+            self.sendBatch(outgoing[start:start + self.batch])
+
+    def sendBatch(self, outgoing):
+        count = len(outgoing)
+        names = (sockaddr_in * count)()
+        iovecs = (iovec * count)()
+        vector = (mmsghdr * count)()
+        for i, (datagram, (host, port)) in enumerate(outgoing):
+            names[i].sin_family = socket.AF_INET
+            names[i].sin_port = socket.htons(port)
+            names[i].sin_addr[:] = bytearray(socket.inet_aton(host))
+            iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(datagram),
+                                             ctypes.c_void_p)
+            iovecs[i].iov_len = len(datagram)
+            hdr = vector[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(names[i])
+            hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+            hdr.msg_iov = ctypes.pointer(iovecs[i])
+            hdr.msg_iovlen = 1
+        done = 0
+        while done < count:
+            sent = _libc.sendmmsg(self.fileno(), ctypes.byref(vector[done]),
+                                  count - done, 0)
+            self.sendCalls += 1
+            if sent < 0:
+                no = ctypes.get_errno()
+                if no == EINTR:
+                    continue
+                # like sendto, the datagram is lost, the protocol
+                # retransmits it if needed
+                if tracing.reliability.infoOn:
+                    tracing.reliability.info(
+                            "sendmmsg failed: %s, datagram dropped",
+                            errno.errorcode.get(no, no))
+                self.dropped += 1
+                done += 1
+            else:
+                self.sent += sent
+                done += sent
+
+    def connectionLost(self, reason=None):
+        if self.outgoing:
+            self.flush()
+        udp.Port.connectionLost(self, reason)
+
+    def getStats(self):
+        """
+        returns: a dict with the number of recvmmsg and sendmmsg calls, and
+        of the datagrams received, sent and dropped
+        """
+        return {"recvCalls": self.recvCalls,
+                "sendCalls": self.sendCalls,
+                "received": self.received,
+                "sent": self.sent,
+                "dropped": self.dropped}
+
+
+def listenUDP(port, protocol, interface="", reactor=None):
+    """
+    Serve the UDP port with protocol through a MmsgPort, the
+    counterpart of reactor.listenUDP.
+    returns: the port, listening
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    udpPort = MmsgPort(port, protocol, interface=interface, reactor=reactor)
+    udpPort.startListening()
+    return udpPort
@@ -0,0 +1,96 @@
+import weakref
+from packet import Packet
+from data_strucs import Movie
+from tables import type_code, room_type
+import codec
+
+
+class MovieCatalog():
+    """
+    The movieList message of a server, encoded once per header version
+    and shared by all the sessions. Sending it to a user only costs a
+    header rewrite.
+    """
+
+    def __init__(self, serverProxy):
+        """
+        .. attribute:: movies
+        Movie objects of the catalog
+
+        .. attribute:: serverMovies
+        The movie list of the serverProxy the catalog was built from
+
+        .. attribute:: entries
+        (movieTitle, movieId) of the serverMovies, compared on refresh
+        """
+        self.serverProxy = serverProxy
+        self.movies = []
+        self.serverMovies = []
+        self.entries = []
+        self.messages = None  # header version: complete movieList message
+        self.fragments = {}  # (max data length, header version): fragments
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuild the catalog if the movie list of the serverProxy has
+        changed since the last call, the messages of each header version are
+        encoded again the next time they are asked for.
+        returns: True if the catalog has changed
+        """
+        serverMovies = self.serverProxy.getMovieList()
+        # a movie replaced keeps the length of the list
+        entries = [(movie.movieTitle, movie.movieId)
+                   for movie in serverMovies]
+        if self.messages is not None and entries == self.entries:
+            return False
+        self.serverMovies = list(serverMovies)
+        self.entries = entries
+        self.movies = [Movie(movie.movieTitle, movie.movieId)
+                       for movie in serverMovies]
+        self.messages = {}
+        self.fragments = {}
+        return True
+
+    def getPacket(self, userId, seqNum, headerVersion=codec.LEGACY_HEADER):
+        entrySize = codec.movieStructs[headerVersion].size
+        length = 0
+        for movie in self.movies:
+            length = length + entrySize + movie.length
+        return Packet(frg=0, ack=0, msgType=type_code["movieList"],
+                      roomType=room_type["notApplicable"], seqNum=seqNum,
+                      userId=userId, destId=0, length=length,
+                      data=self.movies, headerVersion=headerVersion)
+
+    def getMessage(self, headerVersion=codec.LEGACY_HEADER):
+        """
+        returns: the whole message in a bytearray, its header must be
+        rewritten with codec.rewriteHeader before sending it
+        """
+        if headerVersion not in self.messages:
+            self.messages[headerVersion] = bytearray(codec.packMsg(
+                    self.getPacket(0, 0, headerVersion)))
+        return self.messages[headerVersion]
+
+    def getFragments(self, maxLength, headerVersion=codec.LEGACY_HEADER):
+        """
+        returns: the message split in fragments of at most maxLength bytes
+        of data, their headers must be rewritten before sending them
+        """
+        key = (maxLength, headerVersion)
+        if key not in self.fragments:
+            self.fragments[key] = codec.fragmentMsg(
+                    self.getPacket(0, 0, headerVersion), maxLength)
+        return self.fragments[key]
+
+
+# serverProxy: MovieCatalog, released with the serverProxy
+_catalogs = weakref.WeakKeyDictionary()
+
+
+def getMovieCatalog(serverProxy):
+    """The MovieCatalog shared by all the sessions of this serverProxy."""
+    if serverProxy not in _catalogs:
+        # the catalog must not keep its key alive
+        _catalogs[serverProxy] = MovieCatalog(weakref.proxy(serverProxy))
+    return _catalogs[serverProxy]
@@ -4,9 +4,13 @@ import copy
 
 
 
-class Packet():
+class Packet(object):
+    # no instance dict, a packet is created for every datagram
+    __slots__ = ("frg", "ack", "msgType", "roomType", "seqNum", "userId",
+                 "destId", "length", "data", "headerVersion")
 
-    def __init__(self, frg, ack, msgType, roomType, seqNum, userId, destId, length, data):
+    def __init__(self, frg, ack, msgType, roomType, seqNum, userId, destId, length, data,
+                 headerVersion=0):
         self.frg = frg
         self.ack = ack
         self.msgType = msgType
@@ -16,15 +20,15 @@ class Packet():
         self.destId = destId
         self.data = data
         self.length = length
-        pass
+        self.headerVersion = headerVersion  # 0: legacy header, 1: wide header
 
     def __repr__(self):
         return "[frg:%d; ack:%d; msgType:%s(%d); roomType:%s(%d); seqNum:%d; \
-userId:%d; destId:%d; length:%d; data(%s):%s]" % (
+userId:%d; destId:%d; length:%d; headerVersion:%d; data(%s):%s]" % (
                     self.frg, self.ack, type_decode[self.msgType], self.msgType,
                     room_type_decode[self.roomType], self.roomType,
-                    self.seqNum, self.userId, self.destId,
-                    self.length, type(self.data), repr(self.data))
+                    self.seqNum, self.userId, self.destId, self.length,
+                    self.headerVersion, type(self.data), repr(self.data))
 
     def turnIntoAck(self, data=""):
         # FIXME potential problems
@@ -47,5 +51,24 @@ userId:%d; destId:%d; length:%d; data(%s):%s]" % (
         self.data = error_type
         return
 
+    def makeAck(self, data=""):
+        """
+        returns: a new ack packet of this packet, the data of this packet
+        is not copied
+        """
+        ackPack = Packet(self.frg, 1, self.msgType, self.roomType,
+                         self.seqNum, self.userId, self.destId, 0, None,
+                         self.headerVersion)
+        ackPack.turnIntoAck(data)
+        return ackPack
+
+    def makeErrorPack(self, error_type):
+        """returns: a new error packet answering this packet"""
+        return Packet(self.frg, 1, type_code["errorMessage"], self.roomType,
+                      self.seqNum, self.userId, self.destId, 1, error_type,
+                      self.headerVersion)
+
     def copy(self):
-        return copy.deepcopy(self)
+        return Packet(self.frg, self.ack, self.msgType, self.roomType,
+                      self.seqNum, self.userId, self.destId, self.length,
+                      copy.deepcopy(self.data), self.headerVersion)
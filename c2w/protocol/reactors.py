@@ -0,0 +1,43 @@
+"""
+The event loops a server process can run on.
+
+The protocols only use the Twisted reactor interface, so the reactor
+implementation is chosen when the process starts, before anything
+imports ``twisted.internet.reactor`` (``timer_wheel`` does). ``epoll``
+is only built on Linux, ``installReactor(None)`` takes the best one
+available.
+"""
+import select
+
+reactorModules = {
+    "epoll": "twisted.internet.epollreactor",
+    "poll": "twisted.internet.pollreactor",
+    "select": "twisted.internet.selectreactor",
+}
+
+
+def availableReactors():
+    """returns: the names of the reactors of this platform, best first"""
+    names = []
+    if hasattr(select, "epoll"):
+        names.append("epoll")
+    if hasattr(select, "poll"):
+        names.append("poll")
+    names.append("select")
+    return names
+
+
+def installReactor(name=None):
+    """
+    Install the reactor called name, the best available one if it is None.
+    It must be called before the reactor is imported.
+    returns: the name of the reactor installed
+    """
+    if name is None:
+        name = availableReactors()[0]
+    elif name not in availableReactors():
+        raise ValueError("reactor %s not available here, only %s" % (
+            name, ", ".join(availableReactors())))
+    module = __import__(reactorModules[name], fromlist=["install"])
+    module.install()
+    return name
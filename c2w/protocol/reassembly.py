@@ -0,0 +1,133 @@
+import codec
+import tracing
+from config import window_size, reassembly_timeout
+
+
+class Reassembler():
+    """
+    Reassembly of the fragmented packets received from one peer.
+
+    The bodies of the fragments are kept in a list and joined once the
+    last fragment is received, then the body is decoded once. Datagrams
+    arriving before the next expected one are held, as long as they are
+    inside the window of the sender. A packet which gets no fragment for
+    reassembly_timeout seconds, longer than the retransmissions of the
+    sender, is discarded with the fragments of it received later.
+    """
+
+    def __init__(self, timers, windowSize=window_size,
+                 timeout=reassembly_timeout):
+        """
+        :param timers: the TimingWheel of the protocol
+
+        .. attribute:: expected
+        The seqNum of the next datagram handed over in order
+
+        .. attribute:: pending
+        seqNum: (header, datagram) received before the expected one
+        """
+        self.timers = timers
+        self.windowSize = windowSize
+        self.timeout = timeout
+        self.expected = 0
+        self.pending = {}
+        self.header = None  # of the first fragment of the packet
+        self.parts = []  # bodies of its fragments
+        self.length = 0
+        self.timer = None
+        self.lastAdded = None  # time of the last fragment of the packet
+        self.discarding = False  # until the end of a discarded packet
+        self.completed = 0  # fragmented packets
+        self.discarded = 0
+
+    def receive(self, header, datagram):
+        """
+        :param header: the decoded header of the datagram, not an ack
+        returns: the list of the complete packets which can be handled,
+        in the order of their seqNums, or None if the datagram is beyond
+        the window and dropped: it must not be acked
+        """
+        modulo = codec.seqModulos[header.headerVersion]
+        offset = codec.seqDiff(header.seqNum, self.expected, modulo)
+        if offset < 0:
+            return []  # already received
+        if offset >= self.windowSize:
+            return None  # not sent by a sender window
+        self.pending[header.seqNum] = (header, datagram)
+
+        packs = []
+        while self.expected in self.pending:
+            pack = self.add(*self.pending.pop(self.expected))
+            self.expected = (self.expected + 1) % modulo
+            if pack is not None:
+                packs.append(pack)
+        return packs
+
+    def add(self, header, datagram):
+        """
+        Handle the next datagram in order, header is its header.
+        returns: the packet, with its data, or None if the datagram is a
+        fragment of a packet not complete yet
+        """
+        if self.discarding:
+            self.discarding = header.frg == 1
+            return None
+        if header.frg == 0 and self.header is None:  # not fragmented
+            header.data = codec.decodeBody(header, datagram)
+            return header
+        body = datagram[codec.headerLengths[header.headerVersion]:]
+        self.parts.append(body)
+        self.length += len(body)
+        self.lastAdded = self.timers.clock.seconds()
+        if self.header is None:  # first fragment
+            self.header = header
+            self.timer = self.timers.callLater(self.timeout, self.expire)
+        if header.frg == 1:
+            return None
+        # last fragment: the packet has its seqNum
+        pack = self.header
+        pack.frg = 0
+        pack.seqNum = header.seqNum
+        pack.length = self.length
+        pack.data = codec.decodeBody(pack, "".join(self.parts), offset=0)
+        self.completed += 1
+        self.reset()
+        return pack
+
+    def expire(self):
+        """the packet is still incomplete"""
+        idle = self.timers.clock.seconds() - self.lastAdded
+        if idle < self.timeout:  # fragments were added meanwhile
+            self.timer = self.timers.callLater(self.timeout - idle,
+                                               self.expire)
+            return
+        tracing.codec.warning("no fragment for %s seconds, packet of %s "
+                              "fragments discarded", self.timeout,
+                              len(self.parts))
+        self.timer = None
+        self.discarded += 1
+        # the rest of the packet is dropped when it comes
+        self.discarding = True
+        self.reset()
+
+    def reset(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.header = None
+        self.parts = []
+        self.length = 0
+
+    def stop(self):
+        """cancel the reassembly timeout"""
+        self.reset()
+
+    def getStats(self):
+        """
+        returns: a dict with the number of fragmented packets completed
+        and discarded, and the fragments held
+        """
+        return {"completed": self.completed,
+                "discarded": self.discarded,
+                "fragments": len(self.parts),
+                "pending": len(self.pending)}
@@ -0,0 +1,150 @@
+from collections import deque
+from config import attempt_num, window_size
+from rtt import RttEstimator
+import codec
+from codec import SEQ_MODULO
+import tracing
+
+
+
+class ReliableSender():
+    """
+    Selective repeat sender of the packets to one peer.
+
+    Up to windowSize packets are in flight at the same time. Each of them
+    is acknowledged on its own, and retransmitted on its own when its
+    timeout expires, so a lost fragment does not stall the others.
+    """
+
+    def __init__(self, write, timers, windowSize=window_size, onGiveUp=None,
+                 seqModulo=SEQ_MODULO, fragmentSize=None, resend=None):
+        """
+        :param write: function sending a binary packet to the peer
+        :param resend: function sending a retransmitted packet, write by
+            default; it may skip the coalescing of write
+        :param timers: the TimingWheel of the protocol
+        :param onGiveUp: function called with the seqNum of a packet which
+            is still not acked after attempt_num tries. The packet is
+            dropped, its onAcked is not called, and the packets after it
+            go on.
+        :param seqModulo: the seqNums wrap at this value, given by the
+            header version of the peer
+        :param fragmentSize: FragmentSize of the peer, told about the
+            datagrams lost and acked
+
+        .. attribute:: base
+        The oldest seqNum not acked yet
+
+        .. attribute:: nextSeqNum
+        The seqNum given to the next queued packet
+
+        .. attribute:: rtt
+        RttEstimator of the peer, giving the timeout of the packets
+        """
+        self.write = write
+        self.resend = resend or write
+        self.timers = timers
+        self.rtt = RttEstimator()
+        self.windowSize = windowSize
+        self.onGiveUp = onGiveUp
+        self.seqModulo = seqModulo
+        self.fragmentSize = fragmentSize
+        self.base = 0
+        self.nextSeqNum = 0
+        self.queue = deque()  # (seqNum, buf) waiting for room in the window
+        self.inFlight = {}  # seqNum: [buf, attempts, timer, sent time]
+        self.acked = set()  # acked seqNums after base
+        self.callbacks = {}  # seqNum: function called when acked in order
+
+    def send(self, frags, userId, onAcked=None):
+        """
+        Queue encoded fragments, their headers are rewritten with the userId
+        and the next seqNums. onAcked is called once all the fragments and
+        the packets queued before them are acked.
+        """
+        for frag in frags:
+            codec.rewriteHeader(frag, self.nextSeqNum, userId)
+            self.queue.append((self.nextSeqNum, str(frag)))
+            self.nextSeqNum = (self.nextSeqNum + 1) % self.seqModulo
+        if onAcked is not None:
+            self.callbacks[(self.nextSeqNum - 1) % self.seqModulo] = onAcked
+        self.fillWindow()
+
+    def fillWindow(self):
+        while (self.queue and codec.seqDiff(self.queue[0][0], self.base,
+                                           self.seqModulo) < self.windowSize):
+            seqNum, buf = self.queue.popleft()
+            self.inFlight[seqNum] = [buf, 0, None, None]
+            self.transmit(seqNum)
+
+    def transmit(self, seqNum, write=None):
+        entry = self.inFlight[seqNum]
+        (write or self.write)(entry[0])
+        entry[1] += 1
+        entry[3] = self.timers.clock.seconds()
+        entry[2] = self.timers.callLater(self.rtt.getTimeout(),
+                                         self.timeoutExpired, seqNum)
+
+    def timeoutExpired(self, seqNum):
+        entry = self.inFlight.get(seqNum)
+        if entry is None:
+            return
+        if entry[1] < attempt_num:
+            if tracing.reliability.debugOn:
+                tracing.reliability.debug("packet %s retransmitted", seqNum)
+            # the timers of a lost window expire together, the timeout is
+            # backed off once for them, by the oldest packet
+            if seqNum == self.base:
+                self.rtt.backoff()
+            self.rtt.retransmissions += 1
+            if self.fragmentSize is not None:
+                self.fragmentSize.lost(self.dataLength(entry[0]))
+            self.transmit(seqNum, self.resend)
+        else:
+            tracing.reliability.warning("too many tries, packet %s aborted",
+                                        seqNum)
+            del self.inFlight[seqNum]
+            self.callbacks.pop(seqNum, None)
+            if self.onGiveUp is not None:
+                self.onGiveUp(seqNum)
+            self.done(seqNum)
+
+    def ackReceived(self, seqNum):
+        """
+        returns: False if the ack is not expected (duplicate or unknown)
+        """
+        entry = self.inFlight.pop(seqNum, None)
+        if entry is None:
+            return False
+        if entry[2] is not None:
+            entry[2].cancel()
+        if entry[1] == 1:  # not retransmitted, the ack is not ambiguous
+            self.rtt.sample(self.timers.clock.seconds() - entry[3])
+            if self.fragmentSize is not None:
+                self.fragmentSize.delivered(self.dataLength(entry[0]))
+        self.done(seqNum)
+        return True
+
+    def done(self, seqNum):
+        """the packet is acked or given up, the window slides past it"""
+        self.acked.add(seqNum)
+        while self.base in self.acked:
+            self.acked.remove(self.base)
+            callback = self.callbacks.pop(self.base, None)
+            self.base = (self.base + 1) % self.seqModulo
+            if callback is not None:
+                callback()
+        self.fillWindow()
+
+    def dataLength(self, buf):
+        return len(buf) - codec.headerLength(buf)
+
+    def stop(self):
+        """cancel all the retransmissions"""
+        for entry in self.inFlight.values():
+            if entry[2] is not None:
+                entry[2].cancel()
+        self.inFlight = {}
+        self.queue.clear()
+        self.callbacks = {}
+        self.acked.clear()
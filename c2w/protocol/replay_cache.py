@@ -0,0 +1,58 @@
+from collections import OrderedDict
+import timer_wheel
+from config import replay_cache_size, replay_cache_age
+
+
+class ReplayCache():
+    """
+    The acks sent to one user, by seqNum of the request they answer.
+
+    A request retransmitted because its ack was lost gets the same ack
+    again, the request is not handled twice: a chat message is not
+    forwarded again, a movie is not restarted. At most replay_cache_size
+    acks are kept, none older than replay_cache_age seconds.
+    """
+
+    def __init__(self, clock=None, size=replay_cache_size,
+                 age=replay_cache_age):
+        """
+        :param clock: the object providing seconds, the reactor by default
+
+        .. attribute:: acks
+        seqNum: (time sent, encoded ack), oldest first
+        """
+        self.clock = clock or timer_wheel.reactor
+        self.size = size
+        self.age = age
+        self.acks = OrderedDict()
+        self.replays = 0
+        self.misses = 0
+
+    def store(self, seqNum, buf):
+        now = self.clock.seconds()
+        self.acks.pop(seqNum, None)  # the seqNums wrap
+        self.acks[seqNum] = (now, buf)
+        while len(self.acks) > self.size:
+            self.acks.popitem(last=False)
+        for seqNum, (sent, buf) in self.acks.items():
+            if now - sent < self.age:
+                break
+            del self.acks[seqNum]
+
+    def lookup(self, seqNum):
+        """returns: the ack of the request, None if it is not kept"""
+        entry = self.acks.get(seqNum)
+        if entry is None or self.clock.seconds() - entry[0] >= self.age:
+            self.misses += 1
+            return None
+        self.replays += 1
+        return entry[1]
+
+    def getStats(self):
+        """
+        returns: a dict with the number of acks kept, and the number of
+        acks replayed and of duplicates without an ack
+        """
+        return {"acks": len(self.acks),
+                "replays": self.replays,
+                "misses": self.misses}
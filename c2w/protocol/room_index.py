@@ -0,0 +1,150 @@
+import weakref
+import codec
+from data_strucs import User
+from id_allocator import IdAllocator
+from tables import status_code
+from c2w.main.constants import ROOM_IDS
+
+
+class RoomIndex():
+    """
+    Room membership of the users of a server, updated incrementally when
+    users log in, change room or leave, so that routing a message costs
+    O(room size) instead of a scan of all the users.
+
+    A room is identified like in the serverProxy: ``ROOM_IDS.MAIN_ROOM`` or
+    the title of a movie.
+    """
+
+    def __init__(self):
+        """
+        .. attribute:: users
+        userId: User, the status is available for main room users
+
+        .. attribute:: names
+        userName: userId, for the logins
+
+        .. attribute:: members
+        room: set of userIds
+
+        .. attribute:: userRooms
+        userId: room, None while the user is logging in
+
+        .. attribute:: loggingIn
+        userIds of the users in no room yet
+
+        .. attribute:: sessions
+        userId: the object used to reach the user (a protocol instance
+        for TCP, a (host, port) address for UDP)
+
+        .. attribute:: movieTitles
+        movieId: movie title
+
+        .. attribute:: userListVersions
+        Version of the main room user list by header version, increased
+        for every userListDelta the clients of this version get: those
+        of a legacy client skip the users whose id does not fit in its
+        header. It is a single byte on the wire.
+
+        .. attribute:: ids
+        IdAllocator of the user ids. The serverProxy has ids of its own,
+        those sent on the wire come from here.
+        """
+        self.users = {}
+        self.names = {}
+        self.members = {ROOM_IDS.MAIN_ROOM: set()}
+        self.userRooms = {}
+        self.loggingIn = set()
+        self.sessions = {}
+        self.movieTitles = {}
+        self.userListVersions = [0] * len(codec.idLimits)
+        self.ids = IdAllocator()
+
+    def nextUserListVersion(self, userId):
+        """
+        userId: the user whose change is sent
+        returns: the new versions, by header version
+        """
+        for headerVersion, limit in enumerate(codec.idLimits):
+            if userId < limit:
+                self.userListVersions[headerVersion] = (
+                        self.userListVersions[headerVersion] + 1) % 256
+        return self.userListVersions
+
+    def setMovies(self, movies):
+        """movies: the movie list of the serverProxy"""
+        self.movieTitles = dict((movie.movieId, movie.movieTitle)
+                                for movie in movies)
+
+    def getMovieTitle(self, movieId):
+        return self.movieTitles.get(movieId)
+
+    def addUser(self, userId, userName, room=ROOM_IDS.MAIN_ROOM,
+                session=None):
+        self.users[userId] = User(userName, userId)
+        self.names[userName] = userId
+        self.sessions[userId] = session
+        self.userRooms[userId] = None
+        self.moveUser(userId, room)
+
+    def moveUser(self, userId, room):
+        previous = self.userRooms[userId]
+        if previous is not None:
+            self.members[previous].discard(userId)
+        if room is not None:
+            self.members.setdefault(room, set()).add(userId)
+            self.loggingIn.discard(userId)
+        else:
+            self.loggingIn.add(userId)
+        self.userRooms[userId] = room
+        if room == ROOM_IDS.MAIN_ROOM:
+            self.users[userId].status = status_code["available"]
+        else:
+            self.users[userId].status = status_code["notAvailable"]
+
+    def removeUser(self, userId):
+        room = self.userRooms.pop(userId, None)
+        if room is not None:
+            self.members[room].discard(userId)
+        self.loggingIn.discard(userId)
+        user = self.users.pop(userId, None)
+        if user is not None:
+            self.names.pop(user.name, None)
+        self.sessions.pop(userId, None)
+
+    def getUserIdByName(self, userName):
+        """returns: the userId of the user with this name, or None"""
+        return self.names.get(userName)
+
+    def getRoom(self, userId):
+        return self.userRooms.get(userId)
+
+    def getListedUsers(self):
+        """
+        returns: userId: User of the main room user list, the users still
+        logging in are left out, do not modify it
+        """
+        if not self.loggingIn:
+            return self.users
+        return dict((userId, user) for userId, user in self.users.iteritems()
+                    if userId not in self.loggingIn)
+
+    def getMembers(self, room):
+        """returns the set of userIds in the room, do not modify it"""
+        return self.members.get(room, frozenset())
+
+
+# serverProxy: RoomIndex, released with the serverProxy
+_indexes = weakref.WeakKeyDictionary()
+
+
+def getRoomIndex(serverProxy):
+    """
+    The RoomIndex shared by all the protocol instances using this
+    serverProxy (one per connection for TCP).
+    """
+    if serverProxy not in _indexes:
+        index = RoomIndex()
+        index.setMovies(serverProxy.getMovieList())
+        _indexes[serverProxy] = index
+    return _indexes[serverProxy]
@@ -0,0 +1,71 @@
+from config import timeout, min_timeout, max_timeout
+
+
+class RttEstimator():
+    """
+    Round trip time estimation of a peer (RFC 6298), giving the timeout
+    of the retransmissions to this peer.
+
+    Only packets acked after their first transmission give samples (Karn's
+    rule), and the timeout is doubled every time the oldest packet in
+    flight is retransmitted until a new sample is taken.
+    """
+
+    alpha = 0.125
+    beta = 0.25
+
+    def __init__(self, initial=timeout, floor=min_timeout,
+                 ceiling=max_timeout):
+        """
+        .. attribute:: srtt
+        Smoothed round trip time in seconds, None before the first sample
+
+        .. attribute:: rttvar
+        Round trip time variation in seconds
+
+        .. attribute:: rto
+        The current retransmission timeout in seconds
+
+        .. attribute:: retransmissions
+        Packets retransmitted to the peer, counted by its sender
+        """
+        self.floor = floor
+        self.ceiling = ceiling
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.clamp(initial)
+        self.samples = 0
+        self.retransmissions = 0
+
+    def clamp(self, rto):
+        return min(self.ceiling, max(self.floor, rto))
+
+    def sample(self, rtt):
+        """rtt: round trip time of a packet acked at its first transmission"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = ((1 - self.beta) * self.rttvar +
+                           self.beta * abs(self.srtt - rtt))
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.rto = self.clamp(self.srtt + 4 * self.rttvar)
+        self.samples += 1
+
+    def backoff(self):
+        """the oldest packet in flight is retransmitted"""
+        self.rto = self.clamp(self.rto * 2)
+
+    def getTimeout(self):
+        return self.rto
+
+    def getStats(self):
+        """
+        returns: a dict with the srtt, the rttvar and the rto in seconds,
+        the number of samples and of retransmissions
+        """
+        return {"srtt": self.srtt,
+                "rttvar": self.rttvar,
+                "rto": self.rto,
+                "samples": self.samples,
+                "retransmissions": self.retransmissions}
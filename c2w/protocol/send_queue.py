@@ -0,0 +1,147 @@
+from collections import deque
+from zope.interface import implementer
+from twisted.internet.interfaces import IPushProducer
+import codec
+import tracing
+from tables import type_code
+from config import send_queue_high, send_queue_low, send_queue_budget
+
+# packets a slow client can miss: chat, and deltas it gets a resync for
+droppable = frozenset([type_code["messageForward"],
+                       type_code["userListDelta"]])
+
+
+@implementer(IPushProducer)
+class SendQueue():
+    """
+    Outbound queue of a TCP connection, registered with its transport as
+    a streaming producer.
+
+    The writes go straight to the transport until Twisted pauses the
+    queue, when the write buffer of the connection is full. They are kept
+    here until it resumes. Above the high watermark the chat messages and
+    the userListDeltas are dropped, the acks and the other packets are
+    kept. Once the queue is back under the low watermark, a client which
+    missed a delta is sent the whole user list, and nothing is dropped
+    after it. A client whose queue exceeds the budget is shed.
+    """
+
+    def __init__(self, protocol, onResync, onShed, high=send_queue_high,
+                 low=send_queue_low, budget=send_queue_budget):
+        """
+        :param protocol: the protocol of the connection, the queue writes
+            to its transport
+        :param onResync: function called when the client can get the
+            whole user list again, it must send a userList and return
+            True, or return False if the client has no list to resync
+        :param onShed: function called once when the queue exceeds the
+            budget, it must drop the connection
+
+        .. attribute:: queuedBytes
+        Bytes held in the queue
+        """
+        self.protocol = protocol
+        self.onResync = onResync
+        self.onShed = onShed
+        self.high = high
+        self.low = low
+        self.budget = budget
+        self.queue = deque()
+        self.queuedBytes = 0
+        self.paused = False
+        self.dropping = False  # from the high watermark to the resync
+        self.missedDelta = False
+        self.resyncing = False  # the userList of the resync is not sent
+        self.shed = False
+        self.peakBytes = 0
+        self.dropped = 0  # packets
+        self.pauses = 0
+        self.resyncs = 0
+
+    def write(self, bufs):
+        """bufs: a list of encoded packets"""
+        if not (self.paused or self.queue or self.dropping):
+            self.protocol.transport.writeSequence(bufs)
+            return
+        for buf in bufs:
+            if self.shed or not self.admit(buf):
+                continue
+            if self.paused or self.queue:
+                self.enqueue(buf)
+            else:
+                self.protocol.transport.write(buf)
+
+    def admit(self, buf):
+        """returns: False if the packet is dropped"""
+        ack, msgType = codec.peekType(buf)
+        if ack or not self.dropping:
+            return True
+        if msgType in droppable:
+            self.dropped += 1
+            if msgType == type_code["userListDelta"]:
+                self.missedDelta = True
+            return False
+        if msgType == type_code["userList"] and self.resyncing:
+            # the deltas are applied to this list
+            self.dropping = self.resyncing = self.missedDelta = False
+        return True
+
+    def enqueue(self, buf):
+        self.queue.append(buf)
+        self.queuedBytes += len(buf)
+        self.peakBytes = max(self.peakBytes, self.queuedBytes)
+        if self.queuedBytes >= self.high and not self.dropping:
+            tracing.session.info("slow client, %s bytes queued: chat "
+                                 "dropped", self.queuedBytes)
+            self.dropping = True
+        if self.queuedBytes > self.budget:
+            tracing.session.warning("slow client, %s bytes queued: "
+                                    "disconnected", self.queuedBytes)
+            self.shed = True
+            self.queue.clear()
+            self.queuedBytes = 0
+            self.onShed()
+
+    def pauseProducing(self):
+        """called by Twisted when the write buffer is full"""
+        self.paused = True
+        self.pauses += 1
+
+    def resumeProducing(self):
+        """called by Twisted when the write buffer is empty"""
+        self.paused = False
+        # the transport pauses the queue again as soon as it is full
+        while self.queue and not self.paused:
+            buf = self.queue.popleft()
+            self.queuedBytes -= len(buf)
+            self.protocol.transport.write(buf)
+        if (self.dropping and not self.resyncing and
+                self.queuedBytes <= self.low):
+            if self.missedDelta:
+                self.resyncing = True
+                self.resyncs += 1
+                if not self.onResync():
+                    # no userList comes, nothing is dropped any more
+                    self.dropping = self.resyncing = False
+                    self.missedDelta = False
+            else:
+                self.dropping = False
+
+    def stopProducing(self):
+        """called by Twisted when the connection is lost"""
+        self.queue.clear()
+        self.queuedBytes = 0
+
+    def getStats(self):
+        """
+        returns: a dict with the bytes and packets queued, the peak of the
+        queued bytes, whether the client is paused, and the number of
+        pauses, of dropped packets and of resyncs
+        """
+        return {"queuedBytes": self.queuedBytes,
+                "queuedPackets": len(self.queue),
+                "peakBytes": self.peakBytes,
+                "paused": self.paused,
+                "pauses": self.pauses,
+                "dropped": self.dropped,
+                "resyncs": self.resyncs}
@@ -0,0 +1,167 @@
+"""
+Sharded UDP chat server: several worker processes serving the same port.
+
+Every worker binds its own socket to the port with ``SO_REUSEPORT``, the
+kernel then hashes the address of each client to one of them, so a
+worker owns the whole session of the users it has logged in: their
+sequence numbers, retransmissions and fragments. The workers are
+connected two by two by Unix stream sockets. Each of them publishes to
+the others the user list changes and the chat messages of its users, and
+keeps a replica of the room membership of the other users, so that the
+rooms span all the workers.
+
+Nothing here imports the reactor: it must not be imported before the
+workers are forked, each of them runs its own.
+"""
+import marshal
+import os
+import signal
+import socket
+
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import Int32StringReceiver
+
+import mmsg
+import tracing
+from reactors import availableReactors, installReactor
+
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)  # 15 on Linux
+
+
+class BusConnection(Int32StringReceiver):
+    """The connection to one other worker, events are marshalled tuples."""
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def connectionMade(self):
+        self.bus.connections.append(self)
+
+    def connectionLost(self, reason):
+        self.bus.connections.remove(self)
+        tracing.session.info("connection to a worker lost: %s",
+                             reason.getErrorMessage())
+
+    def stringReceived(self, data):
+        self.bus.eventReceived(marshal.loads(data))
+
+
+class Bus(Factory):
+    """
+    The connections of a worker to all the others. The events published
+    by a worker are received by the others in the order they were
+    published.
+    """
+
+    def __init__(self, eventReceived):
+        """
+        :param eventReceived: called with every event published by the
+            other workers
+        """
+        self.eventReceived = eventReceived
+        self.connections = []
+
+    def buildProtocol(self, addr):
+        return BusConnection(self)
+
+    def publish(self, event):
+        """event: a tuple of the types marshal knows"""
+        if self.connections:
+            data = marshal.dumps(event)
+            for connection in self.connections:
+                connection.sendString(data)
+
+
+def runWorker(index, count, serverProxy, port, interface, lossPr,
+              busSockets, reactorName=None, batchedIO=False):
+    """
+    Serve the port in this process until the reactor stops.
+    :param busSockets: the sockets connected to the other workers
+    :param reactorName: the reactor of the worker (see reactors), the best
+        available one if None
+    :param batchedIO: serve the port with a MmsgPort (see mmsg)
+    """
+    # imported after the fork, every worker has its own reactor
+    reactorName = installReactor(reactorName)
+    from twisted.internet import reactor
+    from sharded_udp_chat_server import c2wShardedUdpChatServerProtocol
+
+    protocol = c2wShardedUdpChatServerProtocol(serverProxy, lossPr, index,
+                                               count)
+    for busSocket in busSockets:
+        reactor.adoptStreamConnection(busSocket.fileno(), socket.AF_UNIX,
+                                      protocol.bus)
+        busSocket.close()  # the reactor has its own copy
+    udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udpSocket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    udpSocket.bind((interface, port))
+    udpSocket.setblocking(False)
+    if batchedIO:
+        udpPort = mmsg.MmsgPort._fromListeningDescriptor(
+                reactor, udpSocket.fileno(), socket.AF_INET, protocol, 8192)
+        udpPort.startListening()
+    else:
+        reactor.adoptDatagramPort(udpSocket.fileno(), socket.AF_INET,
+                                  protocol)
+    udpSocket.close()  # startProtocol is called meanwhile
+    tracing.session.info("worker %s of %s serving port %s on %s", index,
+                         count, port, reactorName)
+    reactor.run()
+
+
+def runShardedServer(serverProxy, port, workers, interface="", lossPr=0,
+                     reactorName=None, batchedIO=False):
+    """
+    Fork the workers and wait for them. Stopping this process (SIGINT or
+    SIGTERM) stops all of them.
+    :param serverProxy: copied into every worker, which adds the users it
+        serves and starts the streaming of their movies
+    :param reactorName: the reactor of the workers (see reactors)
+    :param batchedIO: serve the port with recvmmsg and sendmmsg (see mmsg)
+    """
+    if reactorName is not None and reactorName not in availableReactors():
+        raise ValueError("reactor %s not available here" % reactorName)
+    if batchedIO and not mmsg.available:
+        raise ValueError("recvmmsg and sendmmsg not available here")
+    # pairs[i][j]: the socket of worker i connected to worker j
+    pairs = [[None] * workers for i in range(workers)]
+    for i in range(workers):
+        for j in range(i + 1, workers):
+            pairs[i][j], pairs[j][i] = socket.socketpair(socket.AF_UNIX,
+                                                         socket.SOCK_STREAM)
+    pids = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            for i in range(workers):
+                if i != index:
+                    for busSocket in pairs[i]:
+                        if busSocket is not None:
+                            busSocket.close()
+            try:
+                runWorker(index, workers, serverProxy, port, interface,
+                          lossPr, [busSocket for busSocket in pairs[index]
+                                   if busSocket is not None], reactorName,
+                          batchedIO)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for row in pairs:
+        for busSocket in row:
+            if busSocket is not None:
+                busSocket.close()
+
+    def stop(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass  # already gone
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while pids:
+        try:
+            pid, status = os.wait()
+        except OSError:  # interrupted by a signal
+            continue
+        pids.remove(pid)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import codec
+import tracing
+from udp_chat_server import c2wUdpChatServerProtocol
+from tables import delta_code, error_code
+from data_strucs import User
+from id_allocator import IdAllocator
+from shard import Bus
+
+
+class c2wShardedUdpChatServerProtocol(c2wUdpChatServerProtocol):
+    """
+    The UDP server of one worker of a sharded server (see ``shard``).
+
+    The users logged in by the other workers are in the room index as
+    well, without a session, so the user lists and the rooms are those of
+    the whole server. Each worker sends the userListDeltas of all the
+    changes to its own users, with its own userListVersion sequence.
+
+    A user name is reserved on all the workers before its login is acked:
+    the worker publishes the login, the others reply whether they already
+    know the name. A worker which knows it, be it a login still waiting
+    for its replies, denies it. Two logins of the same name through two
+    workers at the same time are then both rejected, the clients may try
+    again.
+    """
+
+    def __init__(self, serverProxy, lossPr, index, count):
+        """
+        :param count: the number of workers
+
+        .. attribute:: index
+        The number of the worker
+
+        .. attribute:: bus
+        The connections to the other workers
+
+        .. attribute:: reservations
+        userId: [replies still missing, the last loginRequest, its
+        address], the logins waiting for the replies of the other workers
+        """
+        c2wUdpChatServerProtocol.__init__(self, serverProxy, lossPr)
+        self.index = index
+        self.bus = Bus(self.eventReceived)
+        self.reservations = {}
+        # the ids of the workers are interleaved, unique in the whole server
+        self.roomIndex.ids = IdAllocator(first=index + 1, step=count)
+
+    def addUser(self, userName, (host, port), *args, **kwargs):
+        userId = c2wUdpChatServerProtocol.addUser(self, userName,
+                                                  (host, port), *args,
+                                                  **kwargs)
+        if userId >= 0 and self.bus.connections:
+            self.reservations[userId] = [len(self.bus.connections), None,
+                                         None]
+            self.bus.publish(("login", userId, userName))
+        return userId
+
+    def acceptLogin(self, pack, (host, port)):
+        reservation = self.reservations.get(pack.userId)
+        if reservation is None:
+            c2wUdpChatServerProtocol.acceptLogin(self, pack, (host, port))
+        else:  # acked once all the workers have replied
+            reservation[1:] = pack, (host, port)
+
+    def forgetUser(self, userId):
+        self.reservations.pop(userId, None)
+        c2wUdpChatServerProtocol.forgetUser(self, userId)
+
+    def loginReceived(self, userId, userName):
+        """another worker reserves the name for its new user"""
+        if self.roomIndex.getUserIdByName(userName) is not None:
+            self.bus.publish(("denied", userId))
+            return
+        self.roomIndex.addUser(userId, userName, room=None)
+        self.bus.publish(("granted", userId))
+
+    def replyReceived(self, userId, granted):
+        """a worker replied to the login of one of the users"""
+        reservation = self.reservations.get(userId)
+        if reservation is None:  # denied already, or another worker's
+            return
+        if not granted:
+            pack, (host, port) = reservation[1:]
+            tracing.session.info("username %s reserved by another worker",
+                                 self.users[userId].name)
+            self.forgetUser(userId)
+            self.bus.publish(("cancelled", userId))
+            pack.turnIntoErrorPack(error_code["userNotAvailable"])
+            pack.userId = 0  # send back to the login failed user
+            pack.seqNum = 0  # no seqNum allocated
+            self.sendPacket(pack, (host, port))
+            return
+        reservation[0] -= 1
+        if reservation[0] == 0:
+            del self.reservations[userId]
+            pack, (host, port) = reservation[1:]
+            c2wUdpChatServerProtocol.acceptLogin(self, pack, (host, port))
+
+    def informUserListChange(self, user, change, movieName=None):
+        self.bus.publish(("change", user.userId, user.name, change,
+                          self.roomIndex.getRoom(user.userId), movieName))
+        c2wUdpChatServerProtocol.informUserListChange(self, user, change,
+                                                      movieName)
+
+    def deliverMessage(self, pack, room):
+        self.bus.publish(("message", room, codec.packMsg(pack)))
+        c2wUdpChatServerProtocol.deliverMessage(self, pack, room)
+
+    def eventReceived(self, event):
+        """an event published by another worker"""
+        if event[0] == "change":
+            self.changeReceived(*event[1:])
+        elif event[0] == "login":
+            self.loginReceived(*event[1:])
+        elif event[0] in ("granted", "denied"):
+            self.replyReceived(event[1], event[0] == "granted")
+        elif event[0] == "cancelled":
+            # unknown to the worker which denied it
+            self.roomIndex.removeUser(event[1])
+        elif event[0] == "message":
+            room, buf = event[1:]
+            c2wUdpChatServerProtocol.deliverMessage(
+                    self, codec.unpackMsg(buf), room)
+        else:
+            tracing.routing.error("unexpected event from a worker: %s",
+                                  event)
+
+    def changeReceived(self, userId, userName, change, room, movieName):
+        """apply the change to a user of another worker, and tell it to
+        the users of this one"""
+        if change == delta_code["removed"]:
+            # it may leave before it is added
+            user = self.users.get(userId) or User(userName, userId)
+            self.roomIndex.removeUser(userId)
+        else:
+            if userId not in self.users:
+                self.roomIndex.addUser(userId, userName, room=room)
+            else:
+                self.roomIndex.moveUser(userId, room)
+            user = self.users[userId]
+        c2wUdpChatServerProtocol.informUserListChange(self, user, change,
+                                                      movieName)
@@ -10,7 +10,9 @@ type_code = {
         "leavePrivateChatRequest": 7,
         "leavePrivateChatRequestForward": 9,
         "AYT": 6,
-        "errorMessage": 14
+        "errorMessage": 14,
+        "userListDelta": 2,
+        "container": 11
         }
 
 room_type = {
@@ -81,12 +83,19 @@ type_decode = {
         6: "AYT",
         14: "errorMessage",
         4: "unknownPacket1",  # For stream use?
-        2: "unknownPacket2",
-        11: "unknownPacket3",
+        2: "userListDelta",
+        11: "container",
         13: "unknownPacket4"
         }
 
 
+# change carried by each entry of a userListDelta
+delta_code = {
+        "added": 0,
+        "removed": 1,
+        "statusChanged": 2
+        }
+
 error_decode = {
         1: "usernameNotAvailable",
         2: "idNotExist",
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+from collections import deque
 from twisted.internet.protocol import Protocol
 import logging
 from frame_handler import FrameHandler
 import util
+import codec
+import tracing
+from config import header_version, request_window
 from c2w.main.constants import ROOM_IDS
 from packet import Packet
 from tables import state_code, type_code
@@ -52,40 +56,62 @@ class c2wTcpChatClientProtocol(Protocol):
         self.serverAddress = serverAddress
         self.serverPort = serverPort
         self.clientProxy = clientProxy
-        self.frameHandler = FrameHandler()
+        self.frameHandler = FrameHandler((serverAddress, serverPort))
+        tracing.installSignalHandler()
 
         self.seqNum = 0  # sequence number for the next packet to be sent
+        self.base = 0  # sequence number of the oldest request not acked
+        self.queue = deque()  # requests waiting for room in the window
         self.serverSeqNum = 0  # sequence number of the next not ack packet
         self.userId = 0
         self.userName = ""
+        self.headerVersion = codec.LEGACY_HEADER  # chosen by the server
         self.packReceived = False
         self.movieList = []
         self.users = []  # userId: user
+        self.userListVersion = None  # version of the main room user list
         self.state = state_code["disconnected"]
         self.movieRoomId = -1  # not in movie room
         self.currentMovieRoom = None
 
     def sendPacket(self, packet):
         """
-        param packet: Packet object
-        param callCount: only used for the timeout mechanism.
+        param packet: Packet object, a request is queued: up to
+        request_window requests are in flight, given their seqNums when
+        sent.
         """
         if packet.ack == 1:
-            print "###sending ACK packet###:", packet
-            buf = util.packMsg(packet)
-            self.transport.write(buf.raw)
+            if tracing.routing.debugOn:
+                tracing.routing.debug("sending ACK packet: %s", packet)
+            self.writeData(codec.packMsg(packet))
             return
 
-        if packet.seqNum != self.seqNum:
-            return
-
-        print "###sending packet###:", packet
-        buf = util.packMsg(packet)
-        self.transport.write(buf.raw)
+        self.queue.append(packet)
+        self.fillWindow()
+
+    def fillWindow(self):
+        modulo = codec.seqModulos[self.headerVersion]
+        while (self.queue and codec.seqDiff(self.seqNum, self.base,
+                                           modulo) < request_window):
+            packet = self.queue.popleft()
+            packet.seqNum = self.seqNum
+            self.seqNum = (self.seqNum + 1) % modulo
+            if tracing.routing.debugOn:
+                tracing.routing.debug("sending packet: %s", packet)
+            self.writeData(codec.packMsg(packet))
+
+    def writeData(self, buf):
+        tracing.recorder.record("out", (self.serverAddress, self.serverPort),
+                                buf)
+        self.transport.write(buf)
 
     def userListReceived(self, pack):
         """ save users, and send ack"""
         self.users = pack.data
+        if pack.roomType == room_type["mainRoom"]:
+            self.userListVersion = pack.destId
+        else:
+            self.userListVersion = None
         pack.turnIntoAck()
         self.sendPacket(pack)
 
@@ -99,13 +125,19 @@ class c2wTcpChatClientProtocol(Protocol):
         moduleLogger.debug('loginRequest called with username=%s', userName)
         self.roomType = 3
         self.seqNum = 0  # reset seqNum
+        self.base = 0
+        self.queue.clear()
         self.userId = 0  # use reserved userId when login
         self.userName = userName
+        self.headerVersion = codec.LEGACY_HEADER
 
+        # the highest header version of the client is offered in the
+        # destId, a legacy server ignores it
         loginRequest = Packet(frg=0, ack=0, msgType=0,
-                    roomType=self.roomType, seqNum=self.seqNum,
-                    userId=self.userId, destId=0, length=len(userName),
-                    data=userName)
+                    roomType=self.roomType, seqNum=0,
+                    userId=self.userId,
+                    destId=codec.packLoginOptions(header_version, 0),
+                    length=len(userName), data=userName)
         self.sendPacket(loginRequest)
         self.state = state_code["loginWaitForAck"]
 
@@ -132,13 +164,15 @@ class c2wTcpChatClientProtocol(Protocol):
             roomType = room_type["movieRoom"]
             destId = self.movieRoomId
         else:
-            print "State error!"
+            tracing.session.warning("chat message in state %s",
+                                    state_decode[self.state])
             return
 
         messagePack = Packet(frg=0, ack=0, msgType=type_code["message"],
-                            roomType=roomType, seqNum=self.seqNum,
+                            roomType=roomType, seqNum=0,
                             userId=self.userId, destId=destId,
-                            length=len(message), data=message)
+                            length=len(message), data=message,
+                            headerVersion=self.headerVersion)
         self.sendPacket(messagePack)
 
     def sendJoinRoomRequestOIE(self, roomName):
@@ -158,8 +192,9 @@ class c2wTcpChatClientProtocol(Protocol):
             joinRoomRequest = Packet(frg=0, ack=0,
                                     msgType=type_code["roomRequest"],
                                     roomType=room_type["mainRoom"],
-                                    seqNum=self.seqNum, userId=self.userId,
-                                    destId=0, length=0, data=None)
+                                    seqNum=0, userId=self.userId,
+                                    destId=0, length=0, data=None,
+                                    headerVersion=self.headerVersion)
             self.sendPacket(joinRoomRequest)
             self.state = state_code["waitForMainRoomAck"]
             self.movieRoomId = -1
@@ -169,8 +204,9 @@ class c2wTcpChatClientProtocol(Protocol):
             joinRoomRequest = Packet(frg=0, ack=0,
                                     msgType=type_code["roomRequest"],
                                     roomType=room_type["movieRoom"],
-                                    seqNum=self.seqNum, userId=self.userId,
-                                    destId=roomId, length=0, data=None)
+                                    seqNum=0, userId=self.userId,
+                                    destId=roomId, length=0, data=None,
+                                    headerVersion=self.headerVersion)
             self.sendPacket(joinRoomRequest)
             self.state = state_code["waitForMovieRoomAck"]
             self.currentMovieRoom = roomName
@@ -183,8 +219,9 @@ class c2wTcpChatClientProtocol(Protocol):
         """
         LeaveSystemRequest=Packet(frg=0, ack=0, msgType=type_code["disconnectRequest"],
                                 roomType=room_type["notApplicable"],
-                                seqNum=self.seqNum, userId=self.userId,
-                                destId=0, length=0, data="")
+                                seqNum=0, userId=self.userId,
+                                destId=0, length=0, data="",
+                                headerVersion=self.headerVersion)
         self.sendPacket(LeaveSystemRequest)
 
     def showMainRoom(self):
@@ -217,6 +254,39 @@ class c2wTcpChatClientProtocol(Protocol):
         pack.turnIntoAck()
         self.sendPacket(pack)
 
+    def sendUserListRequest(self):
+        """ask for the whole main room user list"""
+        userListRequest = Packet(frg=0, ack=0,
+                                msgType=type_code["userListDelta"],
+                                roomType=room_type["mainRoom"],
+                                seqNum=0, userId=self.userId,
+                                destId=0, length=0, data="",
+                                headerVersion=self.headerVersion)
+        self.sendPacket(userListRequest)
+
+    def userListDeltaReceived(self, pack):
+        """apply a userListDelta to the main room user list, or ask for the
+        whole list if a previous delta is missing"""
+        entries = pack.data
+        pack.turnIntoAck()
+        self.sendPacket(pack)
+        if self.userListVersion == None:
+            return  # the whole list is on its way
+        version = pack.destId
+        gap = codec.seqDiff(version, self.userListVersion)
+        if gap <= 0:  # already applied
+            return
+        if gap != 1:
+            tracing.session.info("userListDelta missing, ask for the whole "
+                                 "user list")
+            self.userListVersion = None
+            self.sendUserListRequest()
+            return
+        self.users = util.applyUserListDelta(self.users, entries)
+        self.userListVersion = version
+        if self.state == state_code["inMainRoom"]:
+            self.updateUserList()
+
     def dataReceived(self, data):
         """
         :param data: The message received from the server
@@ -225,17 +295,21 @@ class c2wTcpChatClientProtocol(Protocol):
         Twisted calls this method whenever new data is received on this
         connection.
         """
-        print "#### data received!"
         packList = self.frameHandler.extractPackets(data)
 
         for pack in packList:
-            print "## packet received:", pack
-            # the previous packet is received
-            if pack.ack == 1 and pack.seqNum == self.seqNum:
-                self.seqNum += 1
+            if tracing.routing.debugOn:
+                tracing.routing.debug("packet received: %s", pack)
+            # the oldest request in flight is received, the stream keeps
+            # the acks in order
+            if pack.ack == 1 and pack.seqNum == self.base:
+                self.base = (self.base + 1) % codec.seqModulos[
+                        self.headerVersion]
                 if pack.msgType == type_code["errorMessage"]:
-                    print "error message received:", error_decode[pack.data]
-                    print "state:", state_decode[self.state]
+                    tracing.session.warning("error message received: %s, "
+                                            "state: %s",
+                                            error_decode[pack.data],
+                                            state_decode[self.state])
                     if self.state == state_code["loginWaitForAck"]:  # loginFailed
                         # prompt error message
                         self.clientProxy.connectionRejectedONE(
@@ -243,6 +317,8 @@ class c2wTcpChatClientProtocol(Protocol):
                 if pack.msgType == type_code["loginRequest"]:
                     self.state = state_code["loginWaitForMovieList"]
                     self.userId = pack.userId  # get distributed userId
+                    # a wide ack if the server accepted the wide header
+                    self.headerVersion = pack.headerVersion
                 if pack.msgType == type_code["roomRequest"]:
                     if (pack.roomType == room_type["movieRoom"] and
                             self.state == state_code["waitForMovieRoomAck"]):
@@ -256,10 +332,12 @@ class c2wTcpChatClientProtocol(Protocol):
                 if pack.msgType == type_code["disconnectRequest"]:
                     self.clientProxy.leaveSystemOKONE()
                     self.clientProxy.applicationQuit()
+                self.fillWindow()
                 continue
 
             # Packet lost will never happen
-            self.serverSeqNum += 1
+            self.serverSeqNum = (self.serverSeqNum + 1) % codec.seqModulos[
+                    self.headerVersion]
             if pack.msgType == type_code["movieList"]:
                 self.movieListReceived(pack)
                 self.state = state_code["loginWaitForUserList"]
@@ -283,5 +361,8 @@ class c2wTcpChatClientProtocol(Protocol):
                     self.updateUserList()
             elif pack.msgType == type_code["messageForward"]:
                 self.messageReceived(pack)
+            elif pack.msgType == type_code["userListDelta"]:
+                self.userListDeltaReceived(pack)
             else:  # type not defined
-                print "type not defined on client side"
+                tracing.routing.warning("type not defined on client side: %s",
+                                        pack)
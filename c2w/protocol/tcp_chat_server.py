@@ -1,17 +1,28 @@
 # -*- coding: utf-8 -*-
 from twisted.internet.protocol import Protocol
 import logging
-import util
+import codec
+import tracing
 from frame_handler import FrameHandler
+from coalescer import getCoalescer
+from send_queue import SendQueue
 from data_strucs import Movie, User
+from room_index import getRoomIndex
+from movie_catalog import getMovieCatalog
 from c2w.main.constants import ROOM_IDS
 from packet import Packet
-from tables import type_code, error_code, room_type
+from tables import type_code, error_code, room_type, delta_code
+from config import header_version
 
 logging.basicConfig()
 moduleLogger = logging.getLogger('c2w.protocol.tcp_chat_server_protocol')
 
 
+def flushWrites(protocol, bufs):
+    """the writes to a connection during a reactor iteration"""
+    protocol.sendQueue.write(bufs)
+
+
 class c2wTcpChatServerProtocol(Protocol):
 
     def __init__(self, serverProxy, clientAddress, clientPort):
@@ -58,137 +69,236 @@ class c2wTcpChatServerProtocol(Protocol):
         self.clientAddress = clientAddress
         self.clientPort = clientPort
         self.serverProxy = serverProxy
-        self.frameHandler = FrameHandler()
+        self.frameHandler = FrameHandler((clientAddress, clientPort))
+        tracing.installSignalHandler()
 
-        self.users = {}  # userId: user
+        self.roomIndex = getRoomIndex(serverProxy)
+        self.users = self.roomIndex.users  # userId: user
+        self.userId = None  # of the user logged in on this connection
         self.seqNum = 0
         self.clientSeqNum = 0  # userId: seqNum expected to receive
+        self.headerVersion = codec.LEGACY_HEADER  # chosen at login
         self.currentId = 1  # a variable for distributing user id,
                             # 0 is reserved for login use
-        self.movieList = []
+        self.movieCatalog = getMovieCatalog(serverProxy)
         self.userAddrs = {}  # userId: (host, addr)
-        movies = self.serverProxy.getMovieList()
-        for movie in movies:
-            self.movieList.append(Movie(movie.movieTitle, movie.movieId))
+        # shared by all the connections, a broadcast is a single call
+        self.coalescer = getCoalescer(serverProxy, flushWrites)
+        # what a slow client cannot take yet
+        self.sendQueue = SendQueue(self, self.resyncUserList, self.shed)
+
+    def connectionMade(self):
+        # Twisted pauses the queue while the write buffer is full
+        self.transport.registerProducer(self.sendQueue, True)
+
+    def connectionLost(self, reason):
+        """a user who did not leave is removed"""
+        if self.userId is not None:
+            tracing.session.info("connection of user id=%s lost: %s",
+                                 self.userId, reason.getErrorMessage())
+            self.removeUser(self.userId)
+
+    def shed(self):
+        """drop the connection of a client too slow to read its packets"""
+        self.transport.abortConnection()
+
+    def resyncUserList(self):
+        """
+        send the whole user list to a client which missed deltas
+        returns: False if the user is in no room, nothing is sent
+        """
+        room = self.roomIndex.getRoom(self.userId)
+        if room == ROOM_IDS.MAIN_ROOM:
+            self.sendUserList(self.userId, roomType=room_type["mainRoom"])
+        elif room is not None:
+            self.sendUserList(self.userId, roomType=room_type["movieRoom"],
+                              movieName=room)
+        else:
+            return False  # logging in or gone, no list to resync
+        return True
+
+    def getSendQueueStats(self):
+        """
+        returns: userId: send queue statistics of the users of all the
+        connections (see SendQueue.getStats)
+        """
+        return dict((userId, session.sendQueue.getStats())
+                    for userId, session in self.roomIndex.sessions.items())
 
     def sendPacket(self, packet, callCount=0):
         # send an ack packet to registered or non registered user
         # ack packet is sent only once
         if packet.ack == 1:
-            print "###sending ACK packet### : ", packet
-            buf = util.packMsg(packet)
-            self.transport.write(buf.raw)
+            if tracing.routing.debugOn:
+                tracing.routing.debug("sending ACK packet: %s", packet)
+            self.writeData(codec.packMsg(packet))
             return
 
         # not ack packet, set timeout and send later if packet is not received
         # when an un-ack packet is received, we stop the timeout
         if packet.seqNum != self.seqNum:  # packet is received
             return
-        print "###sending packet### : ", packet
-        buf = util.packMsg(packet)
-        self.transport.write(buf.raw)
+        if tracing.routing.debugOn:
+            tracing.routing.debug("sending packet: %s", packet)
+        self.writeData(codec.packMsg(packet))
+
+    def writeData(self, buf):
+        tracing.recorder.record("out", (self.clientAddress, self.clientPort),
+                                buf)
+        self.coalescer.write(self, buf)
 
     def sendUserList(self, userId, roomType=0, movieName=None):
         """send userList to a user. This user can be in main room and movie room,
         if the user is in a movie room, the movieName should not be None
         """
         users = {}
+        version = 0
         if (roomType == room_type["movieRoom"] and movieName != None):
-            for user in self.serverProxy.getUserList():
-                if user.userChatRoom == movieName:
-                    users[user.userId] = User(user.userName, user.userId,
-                                              status=0)
+            # users of a movie room are all not available
+            for memberId in self.roomIndex.getMembers(movieName):
+                users[memberId] = self.users[memberId]
         elif roomType == room_type["mainRoom"]:
-            for user in self.serverProxy.getUserList():
-                status = 0
-                if user.userChatRoom == ROOM_IDS.MAIN_ROOM:
-                    status = 1
-                users[user.userId] = User(user.userName, user.userId, status=status)
+            users = self.roomIndex.getListedUsers()
+            # the following userListDeltas are applied from this version
+            version = self.roomIndex.userListVersions[self.headerVersion]
         else:
-            print "Unexpected error!"
+            tracing.routing.error("unexpected user list request: %s %s",
+                                  roomType, movieName)
 
+        if max(users or [0]) >= codec.idLimits[self.headerVersion]:
+            users = dict((memberId, user) for memberId, user in users.items()
+                         if self.knowsUser(userId, memberId))
+        entrySize = codec.userStructs[self.headerVersion].size
         length = 0
         for user in users.values():
-            length = length + 3 + user.length
+            length = length + entrySize + user.length
 
         userListPack = Packet(frg=0, ack=0, msgType=type_code["userList"],
                               roomType=roomType, seqNum=self.seqNum,
-                              userId=userId, destId=0, length=length,
-                              data=users)
+                              userId=userId, destId=version, length=length,
+                              data=users, headerVersion=self.headerVersion)
         self.sendPacket(userListPack)
 
-    def informRefreshUserList(self, movieName=None):
-        """send userList to all the available main room users,
-        and if the movieName is not None, send all the new user
-        list to all the users in this movie room"""
-        userList = self.serverProxy.getUserList()
-        for user in userList:
-            if user.userChatRoom == ROOM_IDS.MAIN_ROOM:
-                user.userChatInstance.sendUserList(user.userId,
-                                  roomType=room_type["mainRoom"])
-            elif user.userChatRoom == movieName:
-                user.userChatInstance.sendUserList(user.userId,
-                                  roomType=room_type["movieRoom"],
-                                  movieName=movieName)
+    def informUserListChange(self, user, change, movieName=None):
+        """send a userListDelta with the change of this user to the other
+        main room users, and if the movieName is not None, send all the new
+        user list to all the users in this movie room"""
+        versions = self.roomIndex.nextUserListVersion(user.userId)
+        dests = [userId for userId
+                 in self.roomIndex.getMembers(ROOM_IDS.MAIN_ROOM)
+                 if userId != user.userId and
+                 self.knowsUser(userId, user.userId)]
+        # the size of an entry depends on the header version
+        for headerVersion, versionDests in self.groupByHeaderVersion(
+                dests).items():
+            deltaPack = Packet(frg=0, ack=0,
+                               msgType=type_code["userListDelta"],
+                               roomType=room_type["mainRoom"], seqNum=0,
+                               userId=0, destId=versions[headerVersion],
+                               length=(codec.deltaStructs[headerVersion].size
+                                       + user.length),
+                               data=[(change, user)],
+                               headerVersion=headerVersion)
+            self.broadcastPacket(deltaPack, versionDests)
+        sessions = self.roomIndex.sessions
+        if movieName != None:
+            for userId in self.roomIndex.getMembers(movieName):
+                sessions[userId].sendUserList(userId,
+                                              roomType=room_type["movieRoom"],
+                                              movieName=movieName)
 
     def forwardMessagePack(self, pack):
         """forward a message to related users
         There are two kinds of messages: mainRoom and movieRoom
         """
-        ackPack = pack.copy()
-        ackPack.turnIntoAck()
+        ackPack = pack.makeAck()
         self.sendPacket(ackPack)
-        dests = []
-        userList = self.serverProxy.getUserList()
+        room = None
         if pack.roomType == room_type["mainRoom"]:
             # forward message to all the available users
-            for user in userList:
-                if user.userChatRoom == ROOM_IDS.MAIN_ROOM:
-                    dests.append(user.userId)
+            room = ROOM_IDS.MAIN_ROOM
         elif pack.roomType == room_type["movieRoom"]:
             # forward message to all the users in the same movie room
-            movie = self.serverProxy.getMovieById(pack.destId)
-            for user in userList:
-                if user.userChatRoom == movie.movieTitle:
-                    dests.append(user.userId)
+            room = self.roomIndex.getMovieTitle(pack.destId)
         else:
-            print "Unexpected room type when forwarding message!"
-        dests.remove(pack.userId)
+            tracing.routing.warning("unexpected room type when forwarding "
+                                    "message: %s", pack)
+        dests = [userId for userId in self.roomIndex.getMembers(room)
+                 if userId != pack.userId and
+                 self.knowsUser(userId, pack.userId)]
         pack.msgType = type_code["messageForward"]
         pack.destId = pack.userId  # the packet's sender
-        for destId in dests:
-            pack.userId = destId  # the packet's receiver
-            user = self.serverProxy.getUserById(destId)
-            pack.seqNum = user.userChatInstance.seqNum
-            user.userChatInstance.sendPacket(pack)
+        self.broadcastPacket(pack, dests)
         return
 
+    def broadcastPacket(self, pack, dests):
+        """
+        Send the same packet to several users.
+        The packet is encoded only once per header version, then its header
+        is rewritten with the userId and the seqNum of every destination.
+        """
+        sessions = self.roomIndex.sessions
+        # the header fields of the received packet may not fit in a legacy
+        # header, they are rewritten anyway
+        pack.seqNum = 0
+        pack.userId = 0
+        for headerVersion, versionDests in self.groupByHeaderVersion(
+                dests).items():
+            pack.headerVersion = headerVersion
+            buf = bytearray(codec.packMsg(pack))
+            for destId in versionDests:
+                instance = sessions[destId]
+                codec.rewriteHeader(buf, instance.seqNum, destId)
+                instance.writeData(str(buf))
+
+    def groupByHeaderVersion(self, userIds):
+        """returns: header version: the userIds using it"""
+        sessions = self.roomIndex.sessions
+        groups = {}
+        for userId in userIds:
+            groups.setdefault(sessions[userId].headerVersion,
+                              []).append(userId)
+        return groups
+
+    def knowsUser(self, destId, userId):
+        """
+        returns: True if the id of the user fits in the header version of
+        the destination, legacy users never hear about the other ones
+        """
+        return userId < codec.idLimits[
+                self.roomIndex.sessions[destId].headerVersion]
+
     def sendMovieList(self, userId):
-        length = 0
-        for movie in self.movieList:
-            length = length + 2 + movie.length
-        movieListPack = Packet(frg=0, ack=0, msgType=3,
-                            roomType=room_type["notApplicable"],
-                            seqNum=self.seqNum,
-                            userId=userId, destId=0, length=length,
-                            data=self.movieList)
-        self.sendPacket(movieListPack)
-        pass
+        if self.movieCatalog.refresh():  # the serverProxy movies changed
+            self.roomIndex.setMovies(self.movieCatalog.serverMovies)
+        buf = self.movieCatalog.getMessage(self.headerVersion)
+        codec.rewriteHeader(buf, self.seqNum, userId)
+        self.writeData(str(buf))
 
-    def addUser(self, userName):
+    def addUser(self, userName, headerVersion=codec.LEGACY_HEADER):
         """ add a new user into userList
-        returns: -1 if server is full, otherwise a user id
-                 -2 if userName exists
+        returns: -1 if userName exists,
+                 -2 if server is full for the header version of the user,
+                 otherwise a user id
         """
-        for user in self.serverProxy.getUserList():
-            if user.userName == userName:
-                print "### WARNING: username exist!"
-                return -1
+        if self.roomIndex.getUserIdByName(userName) is not None:
+            tracing.session.info("username %s exists", userName)
+            return -1
 
         # Add new user
-        userId = self.serverProxy.addUser(userName, ROOM_IDS.MAIN_ROOM,
+        userId = self.roomIndex.ids.allocate()
+        if userId >= codec.idLimits[headerVersion]:
+            tracing.session.warning("user id %s too large for header "
+                                    "version %s", userId, headerVersion)
+            self.roomIndex.ids.release(userId, quarantine=False)
+            return -2
+        self.serverProxy.addUser(userName, ROOM_IDS.MAIN_ROOM,
                                  userChatInstance=self,
                                  userAddress=(self.clientAddress, self.clientPort))
+        self.headerVersion = headerVersion
+        # no message is forwarded to the user before its user list
+        self.roomIndex.addUser(userId, userName, room=None, session=self)
+        self.userId = userId
         self.seqNum = 0
         self.clientSeqNum = 1
         return userId
@@ -204,7 +314,16 @@ class c2wTcpChatServerProtocol(Protocol):
             self.sendPacket(pack)
             return
 
-        tempUserId = self.addUser(pack.data)
+        # the client offers its highest header version in the destId, the
+        # stream is not fragmented
+        headerVersion = codec.unpackLoginOptions(pack.destId)[0]
+        tempUserId = self.addUser(pack.data, min(headerVersion, header_version))
+        if tempUserId == -2:
+            pack.turnIntoErrorPack(error_code["serverFilled"])
+            pack.userId = 0
+            pack.seqNum = 0
+            self.sendPacket(pack)
+            return
         # userName exists
         if tempUserId == -1:
             # the server should send an errorMessage when login failed
@@ -216,6 +335,9 @@ class c2wTcpChatServerProtocol(Protocol):
 
         pack.userId = tempUserId
         pack.turnIntoAck()
+        # the ack tells the header version used from now on
+        pack.headerVersion = self.headerVersion
+        pack.destId = codec.packLoginOptions(self.headerVersion, 0)
         self.sendPacket(pack)
 
         # send movieList
@@ -225,9 +347,31 @@ class c2wTcpChatServerProtocol(Protocol):
     def leaveResponse(self, pack):
         pack.turnIntoAck()
         self.sendPacket(pack)
-        user = self.serverProxy.getUserById(pack.userId)
-        self.serverProxy.removeUser(user.userName)
-        self.informRefreshUserList()
+        self.removeUser(pack.userId)
+
+    def removeUser(self, userId):
+        """forget a user who left or is gone, and tell its rooms"""
+        user = self.users[userId]
+        room = self.roomIndex.getRoom(userId)
+        self.serverProxy.removeUser(user.name)
+        self.roomIndex.removeUser(userId)
+        self.roomIndex.ids.release(userId)
+        self.userId = None
+        movieName = None
+        if room is not None and room != ROOM_IDS.MAIN_ROOM:
+            movieName = room  # its members get their new user list
+        self.informUserListChange(user, delta_code["removed"],
+                                  movieName=movieName)
+
+    def userListResponse(self, pack):
+        """
+        The pack is a userListDelta request: the user missed a delta and
+        asks for the whole main room user list.
+        """
+        pack.turnIntoAck()
+        self.sendPacket(pack)
+        if self.roomIndex.getRoom(pack.userId) == ROOM_IDS.MAIN_ROOM:
+            self.sendUserList(pack.userId, roomType=room_type["mainRoom"])
 
     def changeRoomResponse(self, pack):
         if pack.roomType == room_type["movieRoom"]:
@@ -237,25 +381,30 @@ class c2wTcpChatServerProtocol(Protocol):
             self.sendPacket(pack)
 
             # update user list in the system
-            user = self.serverProxy.getUserById(pack.userId)
-            self.serverProxy.updateUserChatroom(user.userName, movie.movieTitle)
+            self.roomIndex.moveUser(pack.userId, movie.movieTitle)
+            self.serverProxy.updateUserChatroom(self.users[pack.userId].name,
+                                                movie.movieTitle)
 
             # This function will also send user list to the current user
-            self.informRefreshUserList(movieName=movie.movieTitle)
+            self.informUserListChange(self.users[pack.userId],
+                                      delta_code["statusChanged"],
+                                      movieName=movie.movieTitle)
             self.serverProxy.startStreamingMovie(movie.movieTitle)
         elif pack.roomType == room_type["mainRoom"]:
             pack.turnIntoAck()
             self.sendPacket(pack)
             # update user list
-            user = self.serverProxy.getUserById(pack.userId)
-            movieName = user.userChatRoom
-            self.serverProxy.updateUserChatroom(user.userName,
+            movieName = self.roomIndex.getRoom(pack.userId)
+            self.roomIndex.moveUser(pack.userId, ROOM_IDS.MAIN_ROOM)
+            self.serverProxy.updateUserChatroom(self.users[pack.userId].name,
                                                 ROOM_IDS.MAIN_ROOM)
-            user = self.serverProxy.getUserById(pack.userId)
-            # This function will also send user list to the current user
-            self.informRefreshUserList(movieName=movieName)
+            self.informUserListChange(self.users[pack.userId],
+                                      delta_code["statusChanged"],
+                                      movieName=movieName)
+            self.sendUserList(pack.userId, roomType=room_type["mainRoom"])
         else:
-            print "change room error: not expected roomType:", pack.roomType
+            tracing.session.warning("change room error: not expected "
+                                    "roomType: %s", pack.roomType)
         return
 
     def dataReceived(self, data):
@@ -266,34 +415,52 @@ class c2wTcpChatServerProtocol(Protocol):
         Twisted calls this method whenever new data is received on this
         connection.
         """
-        print "#### data received!"
         packList = self.frameHandler.extractPackets(data)
         for pack in packList:
-            print "## packet received:", pack
+            if tracing.routing.debugOn:
+                tracing.routing.debug("packet received: %s", pack)
             # the previous packet is received
             if pack.ack == 1 and pack.seqNum == self.seqNum:
-                self.seqNum += 1
+                self.seqNum = (self.seqNum + 1) % codec.seqModulos[
+                        self.headerVersion]
                 if pack.msgType == type_code["movieList"]:
-                    self.informRefreshUserList()
+                    # the new user gets the whole list, the others a delta
+                    self.roomIndex.moveUser(pack.userId, ROOM_IDS.MAIN_ROOM)
+                    self.informUserListChange(self.users[pack.userId],
+                                              delta_code["added"])
+                    self.sendUserList(pack.userId,
+                                      roomType=room_type["mainRoom"])
+                elif (pack.msgType == type_code["userListDelta"] or
+                        pack.msgType == type_code["messageForward"]):
+                    pass
                 elif pack.msgType == type_code["userList"]:
                     # login success or change to movie room
                     if pack.seqNum == 1:
-                        print "user id=", pack.userId, " login success"
+                        if tracing.session.infoOn:
+                            tracing.session.info("user id=%s login success",
+                                                 pack.userId)
                 else:
-                    print "unexpected ACK packet"
-                return
+                    tracing.reliability.warning("unexpected ACK packet: %s",
+                                                pack)
+                continue
             elif pack.ack == 1 and pack.seqNum != self.seqNum:
-                print "Packet aborted because of seqNum error ", pack
+                if tracing.reliability.infoOn:
+                    tracing.reliability.info("unexpected ack aborted: %s",
+                                             pack)
+                continue
 
             # packet arrived is a request
             if pack.seqNum != self.clientSeqNum:
-                print "an unexpected packet is received, aborted"
-                return
+                if tracing.reliability.infoOn:
+                    tracing.reliability.info("unexpected packet aborted: %s",
+                                             pack)
+                continue
 
-            self.clientSeqNum += 1
+            self.clientSeqNum = (self.clientSeqNum + 1) % codec.seqModulos[
+                    self.headerVersion]
 
             # new user
-            if (pack.userId not in self.users.keys() and
+            if (pack.userId not in self.users and
                     pack.msgType == type_code["loginRequest"]):
                 self.loginResponse(pack)
             elif pack.msgType == type_code["message"]:
@@ -304,5 +471,8 @@ class c2wTcpChatServerProtocol(Protocol):
                 self.changeRoomResponse(pack)
             elif pack.msgType == type_code["disconnectRequest"]:
                 self.leaveResponse(pack)
+            elif pack.msgType == type_code["userListDelta"]:
+                self.userListResponse(pack)
             else:  # type not defined
-                print "type not defined or error packet"
+                tracing.routing.warning("type not defined or error packet: %s",
+                                        pack)
@@ -0,0 +1,147 @@
+from twisted.internet import reactor
+from config import timer_tick, timer_slots
+
+
+class Timer():
+    """
+    A retransmission scheduled in a TimingWheel, it can be cancelled like
+    a twisted DelayedCall.
+    """
+
+    def __init__(self, wheel, deadline, slot, rounds, function, args):
+        self.wheel = wheel
+        self.deadline = deadline
+        self.slot = slot
+        self.rounds = rounds  # turns of the wheel left before it is due
+        self.function = function
+        self.args = args
+        self.called = False
+        self.cancelled = False
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        """O(1), the timer is only removed from its slot"""
+        if self.active():
+            self.cancelled = True
+            self.wheel.remove(self)
+
+
+class TimingWheel():
+    """
+    Hashed timing wheel shared by all the retransmissions of a protocol.
+
+    A timer goes to the slot of the tick where it is due. The wheel wakes
+    up once per tick while timers are pending, and fires all the timers of
+    the current slot at once, instead of one reactor call per packet.
+    """
+
+    def __init__(self, tick=timer_tick, slotNum=timer_slots, clock=None):
+        """
+        :param clock: the object providing callLater and seconds,
+            the reactor by default
+
+        .. attribute:: timerCount
+        Number of pending timers
+
+        .. attribute:: firedCount
+        Number of timers fired since the wheel was created
+
+        .. attribute:: maxLateness
+        The longest time between the deadline of a timer and its call,
+        in seconds
+        """
+        if clock is None:
+            clock = reactor
+        self.clock = clock
+        self.tick = tick
+        self.slots = [set() for i in range(slotNum)]
+        self.current = 0  # slot handled at the next tick
+        self.nextTick = None  # time of the next tick
+        self.tickCall = None
+        self.timerCount = 0
+        self.firedCount = 0
+        self.totalLateness = 0.0
+        self.maxLateness = 0.0
+
+    def callLater(self, delay, function, *args):
+        """
+        Call function(*args) in at least delay seconds.
+        returns: the Timer, to be cancelled when the packet is acked
+        """
+        now = self.clock.seconds()
+        if self.tickCall is None:
+            self.nextTick = now + self.tick
+            self.tickCall = self.clock.callLater(self.tick, self.advance)
+        deadline = now + delay
+        # number of ticks after the next one
+        ticks = max(0, int(-(-(deadline - self.nextTick) // self.tick)))
+        slotNum = len(self.slots)
+        timer = Timer(self, deadline, (self.current + ticks) % slotNum,
+                      ticks // slotNum, function, args)
+        self.slots[timer.slot].add(timer)
+        self.timerCount += 1
+        return timer
+
+    def remove(self, timer):
+        slot = self.slots[timer.slot]
+        if timer in slot:  # not taken out by the tick firing it
+            slot.remove(timer)
+            self.timerCount -= 1
+
+    def advance(self):
+        """called by the clock at every tick"""
+        now = self.clock.seconds()
+        slot = self.slots[self.current]
+        due = []
+        for timer in slot:
+            if timer.rounds == 0:
+                due.append(timer)
+            else:
+                timer.rounds -= 1
+        for timer in due:
+            slot.remove(timer)
+        self.timerCount -= len(due)
+        self.current = (self.current + 1) % len(self.slots)
+        self.nextTick += self.tick
+
+        for timer in sorted(due, key=lambda timer: timer.deadline):
+            if timer.cancelled:  # by a timer fired before it
+                continue
+            timer.called = True
+            lateness = max(0.0, now - timer.deadline)
+            self.firedCount += 1
+            self.totalLateness += lateness
+            self.maxLateness = max(self.maxLateness, lateness)
+            timer.function(*timer.args)
+
+        if self.timerCount > 0:
+            self.tickCall = self.clock.callLater(
+                    max(0, self.nextTick - self.clock.seconds()), self.advance)
+        else:
+            self.tickCall = None
+
+    def stop(self):
+        """cancel all the timers"""
+        if self.tickCall is not None and self.tickCall.active():
+            self.tickCall.cancel()
+        self.tickCall = None
+        for slot in self.slots:
+            for timer in slot:
+                timer.cancelled = True
+            slot.clear()
+        self.timerCount = 0
+
+    def getStats(self):
+        """
+        returns: a dict with the number of pending timers, the number of
+        fired timers, and their mean and max lateness in seconds
+        """
+        meanLateness = 0.0
+        if self.firedCount > 0:
+            meanLateness = self.totalLateness / self.firedCount
+        return {"timers": self.timerCount,
+                "fired": self.firedCount,
+                "meanLateness": meanLateness,
+                "maxLateness": self.maxLateness}
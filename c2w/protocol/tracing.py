@@ -0,0 +1,153 @@
+"""
+Tracing of the protocol events, by category.
+
+Each category has its own level, read from the ``C2W_TRACE`` environment
+variable, e.g. ``C2W_TRACE=routing=debug,session=info`` or
+``C2W_TRACE=all=debug``. Categories default to warnings only. The
+messages go to the ``c2w.protocol.<category>`` loggers.
+
+A disabled level costs one attribute test at the call site::
+
+    if tracing.routing.debugOn:
+        tracing.routing.debug("sending packet: %s", pack)
+
+The packets themselves are not traced but their headers are kept in the
+flight recorder, a ring buffer dumped on stderr when the process receives
+SIGUSR1, or when an error is traced, at most once every dump_interval
+seconds. Errors are internal faults; a malformed or unexpected packet
+from a peer is a warning, it must not flood stderr with dumps.
+"""
+import logging
+import os
+import signal
+import sys
+import time
+from collections import deque
+from codec import unpackHeader, headerLength, WIDE_HEADER_LENGTH
+from config import flight_recorder_size, dump_interval
+
+levels = {"debug": logging.DEBUG, "info": logging.INFO,
+          "warning": logging.WARNING, "error": logging.ERROR}
+
+
+class Category():
+    """The events of one part of the protocol."""
+
+    def __init__(self, name, level=logging.WARNING):
+        """
+        .. attribute:: debugOn
+        True if the debug messages are traced
+
+        .. attribute:: infoOn
+        True if the info messages are traced
+        """
+        self.name = name
+        self.logger = logging.getLogger("c2w.protocol." + name)
+        self.setLevel(level)
+
+    def setLevel(self, level):
+        self.level = level
+        self.logger.setLevel(level)
+        self.debugOn = level <= logging.DEBUG
+        self.infoOn = level <= logging.INFO
+
+    def debug(self, message, *args):
+        self.logger.debug(message, *args)
+
+    def info(self, message, *args):
+        self.logger.info(message, *args)
+
+    def warning(self, message, *args):
+        self.logger.warning(message, *args)
+
+    def error(self, message, *args):
+        """trace an internal fault and dump the flight recorder"""
+        self.logger.error(message, *args)
+        recorder.dumpOnError()
+
+
+class FlightRecorder():
+    """
+    The headers of the last packets sent and received by the process,
+    kept for postmortem analysis.
+    """
+
+    def __init__(self, size=flight_recorder_size, interval=dump_interval):
+        """
+        .. attribute:: lastDump
+        Time of the last dump on an error, None before the first one
+        """
+        self.entries = deque(maxlen=size)  # (time, direction, peer, header)
+        self.interval = interval
+        self.lastDump = None
+
+    def record(self, direction, peer, buf):
+        """
+        direction: "in" or "out"
+        buf: the packet, only its header is kept
+        """
+        self.entries.append((time.time(), direction, peer,
+                             buf[:WIDE_HEADER_LENGTH]))
+
+    def dumpOnError(self):
+        """dump, unless the last dump on an error is less than interval
+        seconds old"""
+        now = time.time()
+        if self.lastDump is not None and now - self.lastDump < self.interval:
+            return
+        self.lastDump = now
+        self.dump()
+
+    def dump(self, out=None):
+        """write the recorded headers, they are kept"""
+        if out is None:
+            out = sys.stderr
+        out.write("---- flight recorder: %d packets\n" % len(self.entries))
+        for when, direction, peer, header in self.entries:
+            header = str(header)
+            if header and len(header) >= headerLength(header):
+                header = unpackHeader(header)
+            out.write("%.6f %-3s %s %s\n" % (when, direction, peer, header))
+
+
+recorder = FlightRecorder()
+
+codec = Category("codec")  # decoding and fragmentation
+reliability = Category("reliability")  # acks and retransmissions
+routing = Category("routing")  # packets sent, received and forwarded
+session = Category("session")  # logins, room changes and user lists
+categories = dict((category.name, category)
+                  for category in (codec, reliability, routing, session))
+
+
+def configure(spec):
+    """spec: comma separated category=level, the category may be all"""
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = [word.strip().lower() for word in item.split("=", 1)]
+        if level not in levels:
+            continue
+        if name == "all":
+            for category in categories.values():
+                category.setLevel(levels[level])
+        elif name in categories:
+            categories[name].setLevel(levels[level])
+
+
+_signalInstalled = False
+
+
+def installSignalHandler(signum=getattr(signal, "SIGUSR1", None)):
+    """dump the flight recorder when the process receives signum"""
+    global _signalInstalled
+    if _signalInstalled or signum is None:
+        return
+    try:
+        signal.signal(signum, lambda signum, frame: recorder.dump())
+    except ValueError:  # not in the main thread
+        return
+    _signalInstalled = True
+
+
+configure(os.environ.get("C2W_TRACE", ""))
@@ -4,8 +4,12 @@ from c2w.main.lossy_transport import LossyTransport
 import logging
 from packet import Packet
 import util
-from twisted.internet import reactor
-from config import attempt_num, timeout
+import codec
+from config import header_version, max_datagram_length
+from config import max_data_length, request_window
+from timer_wheel import TimingWheel
+from reliable import ReliableSender
+import tracing
 from tables import type_code, state_code
 from tables import error_decode, state_decode, room_type
 from c2w.main.constants import ROOM_IDS
@@ -61,13 +65,22 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
         self.serverPort = serverPort
         self.clientProxy = clientProxy
         self.lossPr = lossPr
-        self.seqNum = 0  # sequence number for the next packet to be sent
+        self.timers = TimingWheel()
         self.dHandler = DatagramHandler(self)
+        self.sender = self.newSender()
+        self.requests = {}  # seqNum: request not acked yet
+        self.acks = {}  # seqNum: ack handled after the previous ones
         self.userId = 0
         self.userName = ""
+        self.headerVersion = codec.LEGACY_HEADER  # chosen by the server
+        # the acks of the datagrams of a container are sent together, in
+        # datagrams no longer than the fragments of the server
+        self.batch = None  # datagrams written while a container is handled
+        self.containerLength = codec.WIDE_HEADER_LENGTH + max_data_length
         self.packReceived = False
         self.movieList = []
         self.users = []  # userId: user
+        self.userListVersion = None  # version of the main room user list
         self.state = state_code["disconnected"]
         self.movieRoomId = -1  # not in movie room
         self.currentMovieRoom = None
@@ -78,31 +91,70 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
         """
         self.transport = LossyTransport(self.transport, self.lossPr)
         DatagramProtocol.transport = self.transport
+        tracing.installSignalHandler()
 
-    def sendPacket(self, packet, callCount=0):
+    def writeDatagram(self, buf):
+        address = (self.serverAddress, self.serverPort)
+        tracing.recorder.record("out", address, buf)
+        if self.batch is not None:
+            self.batch.append(buf)
+        else:
+            self.transport.write(buf, address)
+
+    def sendPacket(self, packet):
         """
-        param packet: Packet object
-        param callCount: only used for the timeout mechanism.
+        param packet: Packet object, a request is given the next seqNum and
+        queued: up to request_window requests are in flight, and their
+        acks are handled in the order of the requests.
         """
         # the packet is received
         if packet.ack == 1:
-            print "###sending ACK packet###:", packet
-            buf = util.packMsg(packet)
-            self.transport.write(buf.raw, (self.serverAddress, self.serverPort))
+            if tracing.routing.debugOn:
+                tracing.routing.debug("sending ACK packet: %s", packet)
+            self.writeDatagram(codec.packMsg(packet))
             return
 
-        if packet.seqNum != self.seqNum:
-            return
+        seqNum = packet.seqNum = self.sender.nextSeqNum
+        if tracing.routing.debugOn:
+            tracing.routing.debug("sending packet: %s", packet)
+        self.requests[seqNum] = packet
+        self.sender.send([bytearray(codec.packMsg(packet))], self.userId,
+                         lambda: self.requestAcked(seqNum))
+
+    def newSender(self):
+        """the requests in flight, their seqNums are given when sent"""
+        return ReliableSender(self.writeDatagram, self.timers,
+                              windowSize=request_window,
+                              onGiveUp=self.requestGaveUp)
+
+    def requestAcked(self, seqNum):
+        del self.requests[seqNum]
+        self.ackReceived(self.acks.pop(seqNum))
 
-        print "###sending packet###:", packet
-        buf = util.packMsg(packet)
-        self.transport.write(buf.raw, (self.serverAddress, self.serverPort))
-        callCount += 1
-        if callCount < attempt_num:
-            reactor.callLater(timeout, self.sendPacket, packet, callCount)
+    def requestGaveUp(self, seqNum):
+        """
+        The server never acked the request. Its seqNum cannot be skipped,
+        the server would hold the following requests until it comes: the
+        session is over. The client no longer sends or acks anything, so
+        the server evicts the silent user.
+        """
+        request = self.requests.pop(seqNum)
+        tracing.session.warning("no ack from the server, session closed: "
+                                "%s", request)
+        self.sender.stop()
+        self.sender = self.newSender()
+        self.requests = {}
+        self.acks = {}
+        self.state = state_code["disconnected"]
+        if request.msgType == type_code["disconnectRequest"]:
+            self.clientProxy.leaveSystemOKONE()
+            self.clientProxy.applicationQuit()
         else:
-            print "too many tries, packet:", packet," aborted"
-            return
+            self.clientProxy.connectionRejectedONE("server unreachable")
+
+    def getRttStats(self):
+        """round trip time statistics of the server (see RttEstimator)"""
+        return self.sender.rtt.getStats()
 
     def sendLoginRequestOIE(self, userName):
         """
@@ -114,16 +166,28 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
         moduleLogger.debug('loginRequest called with username=%s', userName)
 
         self.roomType = 3
-        self.seqNum = 0  # reset seqNum
+        self.sender.stop()  # the seqNums start again from 0
+        self.sender = self.newSender()
+        self.dHandler.reassembler.stop()
+        self.dHandler = DatagramHandler(self)  # so do those of the server
+        self.requests = {}
+        self.acks = {}
         self.userId = 0  # use reserved userId when login
         self.userName = userName
+        self.headerVersion = codec.LEGACY_HEADER
 
+        # the highest header version of the client and the largest
+        # fragments it accepts are offered in the destId, a legacy server
+        # ignores them
         loginRequest = Packet(frg=0, ack=0, msgType=0,
-                    roomType=self.roomType, seqNum=self.seqNum,
-                    userId=self.userId, destId=0, length=len(userName),
-                    data=userName)
-        self.sendPacket(loginRequest)
+                    roomType=self.roomType, seqNum=0,
+                    userId=self.userId,
+                    destId=codec.packLoginOptions(header_version,
+                            max_datagram_length - codec.WIDE_HEADER_LENGTH),
+                    length=len(userName), data=userName)
+        # waiting before the request goes out, its ack may come at once
         self.state = state_code["loginWaitForAck"]
+        self.sendPacket(loginRequest)
 
 
     def sendChatMessageOIE(self, message):
@@ -150,13 +214,15 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
             roomType = room_type["movieRoom"]
             destId = self.movieRoomId
         else:
-            print "State error!"
+            tracing.session.warning("chat message in state %s",
+                                    state_decode[self.state])
             return
 
         messagePack = Packet(frg=0, ack=0, msgType=type_code["message"],
-                            roomType=roomType, seqNum=self.seqNum,
+                            roomType=roomType, seqNum=0,
                             userId=self.userId, destId=destId,
-                            length=len(message), data=message)
+                            length=len(message), data=message,
+                            headerVersion=self.headerVersion)
         self.sendPacket(messagePack)
 
     def sendJoinRoomRequestOIE(self, roomName):
@@ -176,8 +242,9 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
             joinRoomRequest = Packet(frg=0, ack=0,
                                     msgType=type_code["roomRequest"],
                                     roomType=room_type["mainRoom"],
-                                    seqNum=self.seqNum, userId=self.userId,
-                                    destId=0, length=0, data=None)
+                                    seqNum=0, userId=self.userId,
+                                    destId=0, length=0, data=None,
+                                    headerVersion=self.headerVersion)
             self.sendPacket(joinRoomRequest)
             self.state = state_code["waitForMainRoomAck"]
             self.movieRoomId = -1
@@ -187,8 +254,9 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
             joinRoomRequest = Packet(frg=0, ack=0,
                                     msgType=type_code["roomRequest"],
                                     roomType=room_type["movieRoom"],
-                                    seqNum=self.seqNum, userId=self.userId,
-                                    destId=roomId, length=0, data=None)
+                                    seqNum=0, userId=self.userId,
+                                    destId=roomId, length=0, data=None,
+                                    headerVersion=self.headerVersion)
             self.sendPacket(joinRoomRequest)
             self.state = state_code["waitForMovieRoomAck"]
             self.currentMovieRoom = roomName
@@ -202,8 +270,9 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
 
         LeaveSystemRequest=Packet(frg=0, ack=0, msgType=type_code["disconnectRequest"],
                                 roomType=room_type["notApplicable"],
-                                seqNum=self.seqNum, userId=self.userId,
-                                destId=0, length=0, data="")
+                                seqNum=0, userId=self.userId,
+                                destId=0, length=0, data="",
+                                headerVersion=self.headerVersion)
         self.sendPacket(LeaveSystemRequest)
 
     def messageReceived(self, pack):
@@ -228,6 +297,35 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
         userList = util.adaptUserList(self.users, movieName=movieName)
         self.clientProxy.setUserListONE(userList)
 
+    def sendUserListRequest(self):
+        """ask for the whole main room user list"""
+        userListRequest = Packet(frg=0, ack=0,
+                                msgType=type_code["userListDelta"],
+                                roomType=room_type["mainRoom"],
+                                seqNum=0, userId=self.userId,
+                                destId=0, length=0, data="",
+                                headerVersion=self.headerVersion)
+        self.sendPacket(userListRequest)
+
+    def userListDeltaReceived(self, pack):
+        """apply a userListDelta to the main room user list, or ask for the
+        whole list if a previous delta is missing"""
+        if self.userListVersion == None:
+            return  # the whole list is on its way
+        gap = codec.seqDiff(pack.destId, self.userListVersion)
+        if gap <= 0:  # already applied
+            return
+        if gap != 1:
+            tracing.session.info("userListDelta missing, ask for the whole "
+                                 "user list")
+            self.userListVersion = None
+            self.sendUserListRequest()
+            return
+        self.users = util.applyUserListDelta(self.users, pack.data)
+        self.userListVersion = pack.destId
+        if self.state == state_code["inMainRoom"]:
+            self.updateUserList()
+
     def datagramReceived(self, datagram, (host, port)):
         """
         :param string datagram: the payload of the UDP packet.
@@ -237,44 +335,82 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
         Called **by Twisted** when the client has received a UDP
         packet.
         """
-        pack = self.dHandler.unpackMsg(datagram)
-        if pack == None:
+        if self.state == state_code["disconnected"]:
+            return  # no session, an ack would keep the old one alive
+        if codec.isContainer(datagram):
+            self.batch = []
+            try:
+                for inner in codec.splitContainer(datagram):
+                    self.datagramReceived(inner, (host, port))
+            finally:
+                batch, self.batch = self.batch, None
+            if self.headerVersion == codec.WIDE_HEADER:
+                batch = codec.packContainers(batch, self.containerLength)
+            for buf in batch:
+                self.transport.write(buf, (self.serverAddress,
+                                           self.serverPort))
             return
-        print "####packet received:", pack
-
-        # the previous packet is received
-        if pack.ack == 1 and pack.seqNum == self.seqNum:
-            self.seqNum += 1
-            if pack.msgType == type_code["errorMessage"]:  # error handling
-                print "error message received:", error_decode[pack.data]
-                print "state:", state_decode[self.state]
-                if self.state == state_code["loginWaitForAck"]:  # loginFailed
-                    self.clientProxy.connectionRejectedONE(
-                                            error_decode[pack.data])  # back to login window
-                else:
-                    print "unexpected error code"
-            elif pack.msgType == type_code["loginRequest"]:  # wait for movieList
-                self.state = state_code["loginWaitForMovieList"]
-                self.userId = pack.userId  # get userId from server
-            elif pack.msgType == type_code["roomRequest"]:
-                if (pack.roomType == room_type["movieRoom"] and
-                        self.state == state_code["waitForMovieRoomAck"]):
-                    # This packet contains the ip and the port of the movie requested
-                    self.state = state_code["waitForMovieRoomUserList"]
-                    self.clientProxy.updateMovieAddressPort(self.currentMovieRoom,
-                            pack.data["ip"], pack.data["port"])
-                elif (pack.roomType == room_type["mainRoom"] and
-                        self.state == state_code["waitForMainRoomAck"]):
-                    self.state = state_code["waitForMainRoomUserList"]
-                else:
-                    print "unexpected roomrequest ACK"
-            elif pack.msgType == type_code["disconnectRequest"]:
-                self.clientProxy.leaveSystemOKONE()
-                self.clientProxy.applicationQuit()
-            elif pack.msgType == type_code["message"]:
-                pass
+        tracing.recorder.record("in", (host, port), datagram)
+        for pack in self.dHandler.unpackMsgs(datagram):
+            self.packetReceived(pack)
+
+    def ackReceived(self, pack):
+        """handle the ack of a request, the previous ones are handled"""
+        if pack.msgType == type_code["errorMessage"]:  # error handling
+            tracing.session.warning("error message received: %s, "
+                                    "state: %s", error_decode[pack.data],
+                                    state_decode[self.state])
+            if self.state == state_code["loginWaitForAck"]:  # loginFailed
+                self.clientProxy.connectionRejectedONE(
+                                        error_decode[pack.data])  # back to login window
+            else:
+                tracing.session.warning("unexpected error code")
+        elif pack.msgType == type_code["loginRequest"]:  # wait for movieList
+            self.state = state_code["loginWaitForMovieList"]
+            self.userId = pack.userId  # get userId from server
+            # a wide ack if the server accepted the wide header
+            self.headerVersion = pack.headerVersion
+            self.sender.seqModulo = codec.seqModulos[self.headerVersion]
+            fragmentLength = codec.unpackLoginOptions(pack.destId)[1]
+            self.containerLength = codec.WIDE_HEADER_LENGTH + (
+                    fragmentLength or max_data_length)
+        elif pack.msgType == type_code["roomRequest"]:
+            if (pack.roomType == room_type["movieRoom"] and
+                    self.state == state_code["waitForMovieRoomAck"]):
+                # This packet contains the ip and the port of the movie requested
+                self.state = state_code["waitForMovieRoomUserList"]
+                self.clientProxy.updateMovieAddressPort(self.currentMovieRoom,
+                        pack.data["ip"], pack.data["port"])
+            elif (pack.roomType == room_type["mainRoom"] and
+                    self.state == state_code["waitForMainRoomAck"]):
+                self.state = state_code["waitForMainRoomUserList"]
             else:
-                print "Unexpected type of ACK packet"
+                tracing.session.warning("unexpected roomRequest ACK: %s",
+                                        pack)
+        elif pack.msgType == type_code["disconnectRequest"]:
+            self.clientProxy.leaveSystemOKONE()
+            self.clientProxy.applicationQuit()
+        elif pack.msgType == type_code["message"]:
+            pass
+        elif pack.msgType == type_code["userListDelta"]:
+            pass
+        else:
+            tracing.reliability.warning("unexpected type of ACK "
+                                        "packet: %s", pack)
+
+    def packetReceived(self, pack):
+        """handle a complete packet received from the server"""
+        if tracing.routing.debugOn:
+            tracing.routing.debug("packet received: %s", pack)
+
+        # a request in flight is received, its ack is handled after the
+        # acks of the previous ones
+        if pack.ack == 1:
+            if pack.seqNum in self.sender.inFlight:
+                self.acks[pack.seqNum] = pack
+                self.sender.ackReceived(pack.seqNum)
+            elif tracing.reliability.infoOn:
+                tracing.reliability.info("unexpected ack aborted: %s", pack)
             return
 
         if pack.msgType == type_code["movieList"]:
@@ -284,6 +420,10 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
         elif pack.msgType == type_code["userList"]:
             # save userList
             self.users = pack.data
+            if pack.roomType == room_type["mainRoom"]:
+                self.userListVersion = pack.destId
+            else:
+                self.userListVersion = None
             if self.state == state_code["loginWaitForUserList"]:
                 self.state = state_code["inMainRoom"]
                 self.showMainRoom()
@@ -300,8 +440,14 @@ class c2wUdpChatClientProtocol(DatagramProtocol):
                 self.changeRoom()
                 self.updateUserList()
             else:
-                print "unexpected userList"
+                tracing.session.warning("unexpected userList in state %s",
+                                        state_decode[self.state])
         elif pack.msgType == type_code["messageForward"]:
             self.messageReceived(pack)
+        elif pack.msgType == type_code["userListDelta"]:
+            self.userListDeltaReceived(pack)
+        elif pack.msgType == type_code["AYT"]:
+            pass  # the DatagramHandler acked it
         else:  # type not defined
-            print "type not defined on client side"
+            tracing.routing.warning("type not defined on client side: %s",
+                                    pack)
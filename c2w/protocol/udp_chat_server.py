@@ -3,13 +3,23 @@ from twisted.internet.protocol import DatagramProtocol
 from c2w.main.lossy_transport import LossyTransport
 import logging
 from packet import Packet
-import util
+import codec
 from tables import type_code, error_code
 from tables import room_type
-from tables import status_code
+from tables import status_code, delta_code
 from data_strucs import Movie, User
-from config import attempt_num, timeout, max_data_length
-from twisted.internet import reactor
+from room_index import getRoomIndex
+from movie_catalog import getMovieCatalog
+from config import max_data_length, max_datagram_length, header_version
+from config import request_window, window_size
+from reliable import ReliableSender
+from fragment_size import FragmentSize
+from timer_wheel import TimingWheel
+from coalescer import Coalescer
+from liveness import Liveness
+from reassembly import Reassembler
+from replay_cache import ReplayCache
+import tracing
 from c2w.main.constants import ROOM_IDS
 
 logging.basicConfig()
@@ -50,24 +60,32 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
         """
         self.serverProxy = serverProxy
         self.lossPr = lossPr
-        self.users = {}  # userId: user
-        self.seqNums = {}  # userId: seqNum
+        self.roomIndex = getRoomIndex(serverProxy)
+        self.users = self.roomIndex.users  # userId: user
+        self.senders = {}  # userId: ReliableSender of the packets to the user
+        self.timers = TimingWheel()  # retransmissions to all the users
         self.clientSeqNums = {}  # userId: seqNum expected to receive
         self.currentId = 1  # a variable for distributing user id,
                             # 0 is reserved for login use
-        self.movieList = []
+        self.movieCatalog = getMovieCatalog(serverProxy)
         self.userAddrs = {}  # userId: (host, addr)
-        self.packQueues = {}  # userId: list of frg packets
-
+        self.headerVersions = {}  # userId: header version of the user
+        self.addressUsers = {}  # (host, port): userId
+        # the datagrams to a user during a reactor iteration are sent
+        # together
+        self.coalescer = Coalescer(self.flushDatagrams)
+        # the users gone without a disconnectRequest are evicted
+        self.liveness = Liveness(self.sendAyt, self.evictUser)
+        self.reassemblers = {}  # userId: Reassembler, once it fragments
+        self.early = {}  # userId: {seqNum: datagram} received out of order
+        self.replays = {}  # userId: ReplayCache of the acks to the user
 
     def initMovieList(self):
         """read movie list config file"""
         # get movie list of the in the system and save it in the protocol
         #self.serverProxy.addMovie("Examplevideo.ogv", "127.0.0.1", 1991, "./Examplevideo.ogv")
-        movies = self.serverProxy.getMovieList()
-        for movie in movies:
-            self.movieList.append(Movie(movie.movieTitle, movie.movieId))
-        pass
+        self.movieCatalog.refresh()
+        self.roomIndex.setMovies(self.movieCatalog.serverMovies)
 
     def startProtocol(self):
         """
@@ -76,107 +94,200 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
         self.transport = LossyTransport(self.transport, self.lossPr)
         DatagramProtocol.transport = self.transport
         self.initMovieList()
+        tracing.installSignalHandler()
 
-    def sendPackBuf(self, packBuf, (host, port), callCount=0):
-        """
-        Send a binary packet, fragmented or not.
-        Resend if timeout passed.
-        the packBuf should be a string.
-        """
-        header = util.unpackHeader(packBuf)
-        print "###sending msg, with header:", header
-        print "###sending buf:", packBuf
-        # send ack packet
-        if header.ack == 1:
-            self.transport.write(packBuf, (host, port))
-            return
-
-        # not ack packet, set timeout and send later if packet is not received
-        # when an un-ack packet is received, we stop the timeout
-        if header.seqNum != self.seqNums[header.userId]:  # packet is received
-            return
-
-        # send the buf
-        self.transport.write(packBuf, (host, port))
-        callCount += 1
-        if callCount < attempt_num:
-            reactor.callLater(timeout, self.sendPackBuf,
-                              packBuf, (host, port), callCount)
+    def writeDatagram(self, buf, (host, port), coalesce=True):
+        tracing.recorder.record("out", (host, port), buf)
+        if coalesce:
+            self.coalescer.write((host, port), buf)
         else:
-            print "too man tries, packet aborted"
-            return
+            self.transport.write(buf, (host, port))
 
-    def sendPacket(self, pack, (host, port)):
+    def flushDatagrams(self, (host, port), bufs):
+        """
+        Send the datagrams written to a peer during a reactor iteration,
+        packed in containers if the user has the wide header. They are no
+        longer than its fragments, which fit the path.
+        """
+        userId = self.addressUsers.get((host, port))
+        if (len(bufs) > 1 and userId in self.senders and
+                self.headerVersions[userId] == codec.WIDE_HEADER):
+            bufs = codec.packContainers(bufs, codec.WIDE_HEADER_LENGTH +
+                                        self.getFragmentLength(userId))
+        for buf in bufs:
+            self.transport.write(buf, (host, port))
+
+    def sendPacket(self, pack, (host, port), onAcked=None):
+        """
+        Send a packet, fragmented if needed. The seqNum of a packet which
+        is not an ack is given by the sender of the user, and onAcked is
+        called when it is acked.
+        """
         # send an ack packet to registered or non registered user
         # ack packet is sent only once
-        print "###sending packet:", pack
+        if tracing.routing.debugOn:
+            tracing.routing.debug("sending packet: %s", pack)
         if pack.ack == 1:
-            print "###sending ACK packet### : ", pack
-            buf = util.packMsg(pack)
-            self.transport.write(buf.raw, (host, port))
+            buf = codec.packMsg(pack)
+            replays = self.replays.get(pack.userId)
+            if replays is not None:
+                replays.store(pack.seqNum, buf)
+            self.writeDatagram(buf, (host, port))
             return
 
-        # prepare a list of binary packet to send
-        dataBuf = util.packMsg(pack)[6:]
-        seqNum = pack.seqNum
-        while len(dataBuf) > 0:
-            if len(dataBuf) > max_data_length:
-                tmpHeader = Packet(1, pack.ack, pack.msgType, pack.roomType,
-                        seqNum, pack.userId, pack.destId, max_data_length, None)
-                headerBuf = util.packHeader(tmpHeader).raw
-                packBuf = headerBuf + dataBuf[:max_data_length]
-                dataBuf = dataBuf[max_data_length:]
-            else:  # last frgment
-                tmpHeader = Packet(0, pack.ack, pack.msgType, pack.roomType,
-                        seqNum, pack.userId, pack.destId, len(dataBuf), None)
-                headerBuf = util.packHeader(tmpHeader).raw
-                packBuf = headerBuf + dataBuf
-                dataBuf = ""
-            seqNum += 1
-            self.packQueues[pack.userId].append(packBuf)
-        self.sendPackBuf(self.extractCachedPacket(pack.userId), (host, port))
-
-    def extractCachedPacket(self, userId):
-        if self.packQueues[userId] == []:
-            print "No cached packet!"
-            return None
-        else:
-            packet = self.packQueues[userId][0]
-            self.packQueues[userId] = self.packQueues[userId][1:]
-            return packet
+        self.sendFragments(codec.fragmentMsg(
+                                pack, self.getFragmentLength(pack.userId)),
+                           pack.userId, onAcked=onAcked)
+
+    def broadcastPacket(self, pack, dests):
+        """
+        Send the same packet to several users.
+        The packet is encoded and fragmented only once per header version
+        and fragment length, then the userId and the seqNum in the header
+        of each fragment are rewritten for every destination.
+        """
+        # the header fields of the received packet may not fit in a legacy
+        # header, they are rewritten anyway
+        pack.seqNum = 0
+        pack.userId = 0
+        frags = {}  # (header version, fragment length): fragments
+        for destId in dests:
+            encoding = (self.headerVersions[destId],
+                        self.getFragmentLength(destId))
+            if encoding not in frags:
+                pack.headerVersion = encoding[0]
+                frags[encoding] = codec.fragmentMsg(pack, encoding[1])
+            self.sendFragments(frags[encoding], destId)
+
+    def getFragmentLength(self, userId):
+        """returns: the data length of the next fragments sent to the user"""
+        return self.senders[userId].fragmentSize.length
+
+    def groupByHeaderVersion(self, userIds):
+        """returns: header version: the userIds using it"""
+        groups = {}
+        for userId in userIds:
+            groups.setdefault(self.headerVersions[userId], []).append(userId)
+        return groups
+
+    def knowsUser(self, destId, userId):
+        """
+        returns: True if the id of the user fits in the header version of
+        the destination, legacy users never hear about the other ones
+        """
+        return userId < codec.idLimits[self.headerVersions[destId]]
+
+    def isLocal(self, userId):
+        """
+        returns: True if the user is served by this server, the room index
+        of a worker of a sharded server also holds the users of the other
+        workers
+        """
+        return userId in self.senders
+
+    def sendFragments(self, frags, userId, onAcked=None):
+        """
+        Send already encoded fragments to a user, their headers are
+        rewritten with the userId and the next seqNums of this user.
+        """
+        self.senders[userId].send(frags, userId, onAcked=onAcked)
 
+    def getFragmentStats(self):
+        """
+        returns: userId: fragment length statistics of the user
+        (see FragmentSize.getStats)
+        """
+        return dict((userId, sender.fragmentSize.getStats())
+                    for userId, sender in self.senders.items())
+
+    def getLivenessStats(self):
+        """returns: the liveness statistics (see Liveness.getStats)"""
+        return self.liveness.getStats()
 
+    def getReplayStats(self):
+        """
+        returns: userId: statistics of the acks replayed to the user
+        (see ReplayCache.getStats)
+        """
+        return dict((userId, replays.getStats())
+                    for userId, replays in self.replays.items())
 
-    def addUser(self, userName, (host, port)):
+    def getRttStats(self):
+        """
+        returns: userId: round trip time statistics of the user
+        (see RttEstimator.getStats)
+        """
+        return dict((userId, sender.rtt.getStats())
+                    for userId, sender in self.senders.items())
+
+    def addUser(self, userName, (host, port),
+                headerVersion=codec.LEGACY_HEADER,
+                fragmentLength=max_data_length, windowSize=window_size):
         """ add a new user into userList
-        returns: -1 if server is full, otherwise a user id
-                 -2 if userName exists
+        windowSize: packets in flight to the user, 1 for a stop-and-wait
+            client
+        returns: -1 if userName exists,
+                 -2 if server is full for the header version of the user,
+                 otherwise a user id
         """
-        if userName in [user.name for user in self.users.values()]:
-            print "### WARNING: username exist!"
+        if self.roomIndex.getUserIdByName(userName) is not None:
+            tracing.session.info("username %s exists", userName)
             return -1
 
         # Add new user
-        userId = self.serverProxy.addUser(userName, ROOM_IDS.MAIN_ROOM,
+        userId = self.roomIndex.ids.allocate()
+        if userId >= codec.idLimits[headerVersion]:
+            tracing.session.warning("user id %s too large for header "
+                                    "version %s", userId, headerVersion)
+            self.roomIndex.ids.release(userId, quarantine=False)
+            return -2
+        self.serverProxy.addUser(userName, ROOM_IDS.MAIN_ROOM,
                                  userAddress=(host, port))
-        self.users[userId] = User(userName, userId, status=1)
-        self.seqNums[userId] = 0
+        # no message is forwarded to the user before its user list
+        self.roomIndex.addUser(userId, userName, room=None,
+                               session=(host, port))
+        self.senders[userId] = ReliableSender(
+                lambda buf: self.writeDatagram(buf, self.userAddrs[userId]),
+                self.timers, windowSize=windowSize,
+                seqModulo=codec.seqModulos[headerVersion],
+                onGiveUp=lambda seqNum: self.senderGaveUp(userId),
+                fragmentSize=FragmentSize(fragmentLength),
+                # a lost container may be too large for the path
+                resend=lambda buf: self.writeDatagram(
+                        buf, self.userAddrs[userId], coalesce=False))
         self.clientSeqNums[userId] = 1  # loginRequest is received
         self.userAddrs[userId] = (host, port)
-        self.packQueues[userId] = []
+        self.addressUsers[(host, port)] = userId
+        self.headerVersions[userId] = headerVersion
+        self.replays[userId] = ReplayCache()
+        self.liveness.touch(userId)
         return userId
 
-    def informRefreshUserList(self, movieName=None):
-        """send userList to all the available main room users,
-        and if the movieName is not None, send all the new user
-        list to all the users in this movie room"""
-        userList = self.serverProxy.getUserList()
-        for user in userList:
-            if user.userChatRoom == ROOM_IDS.MAIN_ROOM:
-                self.sendUserList(user.userId, user.userAddress,
-                                  roomType=room_type["mainRoom"])
-            elif user.userChatRoom == movieName:
-                self.sendUserList(user.userId, user.userAddress,
+    def informUserListChange(self, user, change, movieName=None):
+        """send a userListDelta with the change of this user to the other
+        main room users, and if the movieName is not None, send all the new
+        user list to all the users in this movie room"""
+        versions = self.roomIndex.nextUserListVersion(user.userId)
+        dests = [userId for userId
+                 in self.roomIndex.getMembers(ROOM_IDS.MAIN_ROOM)
+                 if userId != user.userId and self.isLocal(userId) and
+                 self.knowsUser(userId, user.userId)]
+        # the size of an entry depends on the header version
+        for headerVersion, versionDests in self.groupByHeaderVersion(
+                dests).items():
+            deltaPack = Packet(frg=0, ack=0,
+                               msgType=type_code["userListDelta"],
+                               roomType=room_type["mainRoom"], seqNum=0,
+                               userId=0, destId=versions[headerVersion],
+                               length=(codec.deltaStructs[headerVersion].size
+                                       + user.length),
+                               data=[(change, user)],
+                               headerVersion=headerVersion)
+            self.broadcastPacket(deltaPack, versionDests)
+        if movieName != None:
+            for userId in filter(self.isLocal,
+                                 self.roomIndex.getMembers(movieName)):
+                self.sendUserList(userId, self.userAddrs[userId],
                                   roomType=room_type["movieRoom"],
                                   movieName=movieName)
 
@@ -193,13 +304,28 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
             self.sendPacket(pack, (host, port))
             return
 
-        tempUserId = self.addUser(pack.data, (host, port))
+        # the client offers its highest header version and its largest
+        # fragments in the destId
+        headerVersion, fragmentLength = codec.unpackLoginOptions(pack.destId)
+        headerVersion = min(headerVersion, header_version)
+        fragmentLength = max(max_data_length, min(fragmentLength,
+                max_datagram_length - codec.headerLengths[headerVersion]))
+        # a legacy client sends no options: it waits for each packet
+        # before the next one and would ack, then throw away, the packets
+        # received out of order
+        tempUserId = self.addUser(pack.data, (host, port), headerVersion,
+                                  fragmentLength,
+                                  window_size if pack.destId else 1)
+        if tempUserId == -2:
+            pack.turnIntoErrorPack(error_code["serverFilled"])
+            pack.userId = 0
+            pack.seqNum = 0
+            self.sendPacket(pack, (host, port))
+            return
         # userName exists
         if tempUserId == -1:
             # get userId by userName, the user exist
-            for userId, user in self.users.items():
-                if user.name == pack.data:
-                    tempUserId = userId
+            tempUserId = self.roomIndex.getUserIdByName(pack.data)
             """
             If the user with this userName has already received the
             loginRequest ACK, its seqNum is more than zero.
@@ -208,7 +334,8 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
             system but with seqNum equals 0, we can't pass the condition below,
             so we will resend an ACK.
             """
-            if self.seqNums[tempUserId] != 0:
+            if (not self.isLocal(tempUserId) or
+                    self.senders[tempUserId].base != 0):
                 # the server should send an errorMessage when login failed
                 pack.turnIntoErrorPack(error_code["userNotAvailable"])
                 pack.userId = 0  # send back to the login failed user
@@ -217,15 +344,27 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
                 return
 
         pack.userId = tempUserId
+        self.acceptLogin(pack, (host, port))
+
+    def acceptLogin(self, pack, (host, port)):
+        """ack the loginRequest of the user pack.userId, again if the ack
+        was lost"""
         pack.turnIntoAck()
+        # the ack tells the header version and the fragments used from now
+        # on, it has the header version
+        pack.headerVersion = self.headerVersions[pack.userId]
+        fragmentLength = self.senders[pack.userId].fragmentSize.negotiated
+        pack.destId = codec.packLoginOptions(pack.headerVersion,
+                fragmentLength if fragmentLength > max_data_length else 0)
         self.sendPacket(pack, (host, port))
 
-        # send movieList
-        self.sendMovieList(pack.userId, (host, port))
+        # send movieList, unless it is already on its way
+        if self.senders[pack.userId].nextSeqNum == 0:
+            self.sendMovieList(pack.userId, (host, port))
         pass
 
     def getMovieNameById(self, id):
-        return [movie.movieName for movie in self.movieList if movie.roomId==id][0]
+        return self.roomIndex.getMovieTitle(id)
 
     def changeRoomResponse(self, pack, (host, port)):
         if pack.roomType == room_type["movieRoom"]:
@@ -235,64 +374,82 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
             self.sendPacket(pack, (host, port))
 
             # update user list in the system
-            self.users[pack.userId].status=0  # not available
-            user = self.serverProxy.getUserById(pack.userId)
-            self.serverProxy.updateUserChatroom(user.userName, movie.movieTitle)
+            self.roomIndex.moveUser(pack.userId, movie.movieTitle)
+            self.serverProxy.updateUserChatroom(self.users[pack.userId].name,
+                                                movie.movieTitle)
 
             # This function will also send user list to the current user
-            self.informRefreshUserList(movieName=movie.movieTitle)
+            self.informUserListChange(self.users[pack.userId],
+                                      delta_code["statusChanged"],
+                                      movieName=movie.movieTitle)
             self.serverProxy.startStreamingMovie(movie.movieTitle)
         elif pack.roomType == room_type["mainRoom"]:
             pack.turnIntoAck()
             self.sendPacket(pack, (host,port))
             # update user list
-            self.users[pack.userId].status=1
-            user = self.serverProxy.getUserById(pack.userId)
-            movieName = user.userChatRoom
-            self.serverProxy.updateUserChatroom(user.userName,
+            movieName = self.roomIndex.getRoom(pack.userId)
+            self.roomIndex.moveUser(pack.userId, ROOM_IDS.MAIN_ROOM)
+            self.serverProxy.updateUserChatroom(self.users[pack.userId].name,
                                                 ROOM_IDS.MAIN_ROOM)
-            user = self.serverProxy.getUserById(pack.userId)
-            # This function will also send user list to the current user
-            self.informRefreshUserList(movieName=movieName)
+            self.informUserListChange(self.users[pack.userId],
+                                      delta_code["statusChanged"],
+                                      movieName=movieName)
+            self.sendUserList(pack.userId, (host, port),
+                              roomType=room_type["mainRoom"])
         else:
-            print "change room error: not expected roomType:", pack.roomType
+            tracing.session.warning("change room error: not expected "
+                                    "roomType: %s", pack.roomType)
         return
 
     def sendMovieList(self, userId, (host, port)):
-        length = 0
-        for movie in self.movieList:
-            length = length + 2 + movie.length
-        movieListPack = Packet(frg=0, ack=0, msgType=3,
-                            roomType=room_type["notApplicable"],
-                            seqNum=self.seqNums[userId],
-                            userId=userId, destId=0, length=length,
-                            data=self.movieList)
-        self.sendPacket(movieListPack, (host, port))
-        pass
+        if self.movieCatalog.refresh():  # the serverProxy movies changed
+            self.roomIndex.setMovies(self.movieCatalog.serverMovies)
+        self.sendFragments(self.movieCatalog.getFragments(
+                                self.getFragmentLength(userId),
+                                self.headerVersions[userId]),
+                           userId,
+                           onAcked=lambda: self.movieListAcked(userId))
+
+    def movieListAcked(self, userId):
+        """the new user gets the whole list, the others a delta"""
+        if tracing.session.infoOn:
+            tracing.session.info("user id=%s login success", userId)
+        self.roomIndex.moveUser(userId, ROOM_IDS.MAIN_ROOM)
+        self.informUserListChange(self.users[userId], delta_code["added"])
+        self.sendUserList(userId, self.userAddrs[userId],
+                          roomType=room_type["mainRoom"])
 
     def sendUserList(self, userId, (host, port), roomType=0, movieName=None):
         """send userList to a user. This user can be in main room and movie room,
         if the user is in a movie room, the movieName should not be None
         """
         users = {}
+        version = 0
+        headerVersion = self.headerVersions[userId]
         if (roomType == room_type["movieRoom"] and movieName != None):
-            for user in self.serverProxy.getUserList():
-                if user.userChatRoom == movieName:
-                    users[user.userId] = User(user.userName, user.userId,
-                                              status=0)
+            # users of a movie room are all not available
+            for memberId in self.roomIndex.getMembers(movieName):
+                users[memberId] = self.users[memberId]
         elif roomType == room_type["mainRoom"]:
-            users = self.users
+            users = self.roomIndex.getListedUsers()
+            # the following userListDeltas are applied from this version
+            version = self.roomIndex.userListVersions[headerVersion]
         else:
-            print "Unexpected error!"
+            tracing.routing.error("unexpected user list request: %s %s",
+                                  roomType, movieName)
 
+        if max(users or [0]) >= codec.idLimits[headerVersion]:
+            users = dict((memberId, user) for memberId, user in users.items()
+                         if self.knowsUser(userId, memberId))
+        entrySize = codec.userStructs[headerVersion].size
         length = 0
         for user in users.values():
-            length = length + 3 + user.length
+            length = length + entrySize + user.length
 
         userListPack = Packet(frg=0, ack=0, msgType=type_code["userList"],
-                              roomType=roomType, seqNum=self.seqNums[userId],
-                              userId=userId, destId=0, length=length,
-                              data=users)
+                              roomType=roomType, seqNum=0,
+                              userId=userId, destId=version, length=length,
+                              data=users, headerVersion=headerVersion)
         self.sendPacket(userListPack, (host, port))
         pass
 
@@ -301,43 +458,156 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
         """forward a message to related users
         There are two kinds of messages: mainRoom and movieRoom
         """
-        ackPack = pack.copy()
-        ackPack.turnIntoAck()
+        ackPack = pack.makeAck()
         self.sendPacket(ackPack, self.userAddrs[pack.userId])
-        dests = []
+        room = None
         if pack.roomType == room_type["mainRoom"]:
             # forward message to all the available users
-            dests = [user.userId for user in self.users.values()
-                        if user.status == status_code["available"]]
+            room = ROOM_IDS.MAIN_ROOM
         elif pack.roomType == room_type["movieRoom"]:
             # forward message to all the users in the same movie room
-            movie = self.serverProxy.getMovieById(pack.destId)
-            for user in self.serverProxy.getUserList():
-                if user.userChatRoom == movie.movieTitle:
-                    dests.append(user.userId)
+            room = self.roomIndex.getMovieTitle(pack.destId)
         else:
-            print "Unexpected room type when forwarding message!"
-        dests.remove(pack.userId)
+            tracing.routing.warning("unexpected room type when forwarding "
+                                    "message: %s", pack)
         pack.msgType = type_code["messageForward"]
         pack.destId = pack.userId  # the packet's sender
-        for destId in dests:
-            pack.userId = destId  # the packet's receiver
-            pack.seqNum = self.seqNums[destId]
-            self.sendPacket(pack, self.userAddrs[destId])
-        return
+        self.deliverMessage(pack, room)
 
-    def leaveResponse(self, pack):
+    def deliverMessage(self, pack, room):
+        """send a messageForward packet to the users of the room served by
+        this server, but its sender"""
+        dests = [userId for userId in self.roomIndex.getMembers(room)
+                 if userId != pack.destId and self.isLocal(userId) and
+                 self.knowsUser(userId, pack.destId)]
+        self.broadcastPacket(pack, dests)
+
+    def leaveResponse(self, pack, (host, port)):
         pack.turnIntoAck()
-        self.sendPacket(pack, self.userAddrs[pack.userId])
-        userName=self.users[pack.userId].name
-        self.serverProxy.removeUser(userName)
-        if pack.userId in self.users.keys():
-            del self.users[pack.userId]  #delete user from server's base
-        if pack.userId in self.seqNums.keys():
-            del self.seqNums[pack.userId]
-        if pack.userId in self.clientSeqNums.keys():
-            del self.clientSeqNums[pack.userId]
-        self.informRefreshUserList()
+        self.sendPacket(pack, (host, port))
+        # the ack of a user already removed was lost
+        if self.isLocal(pack.userId):
+            self.removeUser(pack.userId)
+
+    def removeUser(self, userId):
+        """forget a user who left or is gone, and tell its rooms"""
+        user = self.users[userId]
+        room = self.roomIndex.getRoom(userId)
+        self.forgetUser(userId)
+        movieName = None
+        if room is not None and room != ROOM_IDS.MAIN_ROOM:
+            movieName = room  # its members get their new user list
+        self.informUserListChange(user, delta_code["removed"],
+                                  movieName=movieName)
+
+    def forgetUser(self, userId):
+        """drop the session of a user, without telling the others"""
+        self.serverProxy.removeUser(self.users[userId].name)
+        self.roomIndex.removeUser(userId)  #delete user from server's base
+        self.roomIndex.ids.release(userId)
+        self.liveness.forget(userId)
+        del self.replays[userId]
+        if userId in self.reassemblers:
+            self.reassemblers.pop(userId).stop()
+        self.early.pop(userId, None)
+        self.senders.pop(userId).stop()
+        del self.clientSeqNums[userId]
+        del self.headerVersions[userId]
+        self.addressUsers.pop(self.userAddrs.pop(userId), None)
+
+    def sendAyt(self, userId):
+        """ask an idle user whether it is still there, its client acks"""
+        aytPack = Packet(frg=0, ack=0, msgType=type_code["AYT"],
+                         roomType=room_type["mainRoom"], seqNum=0,
+                         userId=userId, destId=0, length=0, data="",
+                         headerVersion=self.headerVersions[userId])
+        self.sendPacket(aytPack, self.userAddrs[userId])
+
+    def senderGaveUp(self, userId):
+        """a packet to the user is never acked, the user is gone"""
+        if self.isLocal(userId):
+            tracing.session.info("packet to user id=%s never acked: "
+                                 "evicted", userId)
+            self.removeUser(userId)
+
+    def evictUser(self, userId):
+        tracing.session.info("no datagram from user id=%s for %s seconds: "
+                             "evicted", userId, self.liveness.timeout)
+        self.removeUser(userId)
+
+    def reassemble(self, header, datagram, (host, port)):
+        """
+        Handle a datagram of a user which sends fragmented packets. The
+        fragments but the last one are acked here, the duplicates get
+        their ack again.
+        returns: the complete packet, handled like an unfragmented one,
+        or None
+        """
+        userId = header.userId
+        if not self.isLocal(userId):
+            tracing.session.info("fragment from an unknown user aborted: %s",
+                                 header)
+            return None
+        modulo = codec.seqModulos[self.headerVersions[userId]]
+        offset = codec.seqDiff(header.seqNum, self.clientSeqNums[userId],
+                               modulo)
+        if offset < 0:  # its ack was lost
+            if not self.replayAck(header, (host, port)) and header.frg == 1:
+                # the ack of a fragment but the last one has no body
+                self.sendPacket(header.makeAck(), (host, port))
+            return None
+        elif offset > 0:
+            self.holdEarly(header, datagram, offset)
+            return None
+        reassembler = self.reassemblers.get(userId)
+        if reassembler is None:
+            reassembler = self.reassemblers[userId] = Reassembler(self.timers)
+        pack = reassembler.add(header, datagram)
+        if pack is None:
+            self.clientSeqNums[userId] = (header.seqNum + 1) % modulo
+            if header.frg == 1:
+                self.sendPacket(header.makeAck(), (host, port))
+            else:  # the end of a packet discarded, it is not handled
+                self.sendPacket(header.makeErrorPack(
+                        error_code["invalidMessage"]), (host, port))
+        return pack
+
+    def replayAck(self, header, (host, port)):
+        """
+        A request is received again, its ack is probably lost: the same
+        ack is sent again, the request is not handled twice.
+        returns: False if the ack is not kept
+        """
+        buf = self.replays[header.userId].lookup(header.seqNum)
+        if buf is not None:
+            self.writeDatagram(buf, (host, port))
+            return True
+        if tracing.reliability.infoOn:
+            tracing.reliability.info("ack not kept, duplicate aborted: %s",
+                                     header)
+        return False
+
+    def holdEarly(self, header, datagram, offset):
+        """
+        A request received before a previous one of the user, which is
+        lost or late, is kept unacked until the previous ones are handled.
+        """
+        if offset < request_window:
+            self.early.setdefault(header.userId, {})[header.seqNum] = datagram
+        elif tracing.reliability.infoOn:
+            tracing.reliability.info("packet from the future aborted: %s",
+                                     header)
+
+    def userListResponse(self, pack, (host, port)):
+        """
+        The pack is a userListDelta request: the user missed a delta and
+        asks for the whole main room user list.
+        """
+        pack.turnIntoAck()
+        self.sendPacket(pack, (host, port))
+        if self.roomIndex.getRoom(pack.userId) == ROOM_IDS.MAIN_ROOM:
+            self.sendUserList(pack.userId, (host, port),
+                              roomType=room_type["mainRoom"])
 
     def datagramReceived(self, datagram, (host, port)):
         """
@@ -348,48 +618,81 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
         Called **by Twisted** when the server has received a UDP
         packet.
         """
-        pack = util.unpackMsg(datagram)
-        print "###packet received: ", pack
-
-        # the previous packet is received
-        if pack.ack == 1 and pack.seqNum == self.seqNums[pack.userId]:
-            self.seqNums[pack.userId] += 1
-            if pack.frg == 1:
-                self.sendPackBuf(self.extractCachedPacket(pack.userId), (host, port))
-                return
-            if pack.msgType == type_code["movieList"]:
-                self.informRefreshUserList()
-            if pack.msgType == type_code["userList"]:
-                # login success or change to movie room
-                if pack.seqNum == 1:
-                    print "user id=", pack.userId, " login success"
+        userId = self.addressUsers.get((host, port))
+        if userId is not None:
+            self.liveness.touch(userId)
+        if codec.isContainer(datagram):
+            for inner in codec.splitContainer(datagram):
+                self.datagramReceived(inner, (host, port))
             return
-        elif pack.ack == 1 and pack.seqNum != self.seqNums[pack.userId]:
-            print "Packet aborted because of seqNum error ", pack
+        tracing.recorder.record("in", (host, port), datagram)
+        self.handleDatagram(datagram, (host, port))
+
+        # the requests held until this one are handled now
+        held = self.early.get(userId)
+        while held:
+            datagram = held.pop(self.clientSeqNums[userId], None)
+            if datagram is None:
+                break
+            self.handleDatagram(datagram, (host, port))
+            held = self.early.get(userId)  # gone if the user left
+
+    def handleDatagram(self, datagram, (host, port)):
+        """handle a datagram received, not a container"""
+        # a packet sent to the user is received, no Packet is needed
+        ack = codec.peekAck(datagram)
+        if ack is not None:
+            seqNum, userId = ack
+            # a late ack of a user who left, its id may be given out again
+            if (self.userAddrs.get(userId) != (host, port) or
+                    not self.senders[userId].ackReceived(seqNum)):
+                if tracing.reliability.infoOn:
+                    tracing.reliability.info("unexpected ack aborted: %s",
+                                             codec.unpackHeader(datagram))
+            return
+
+        pack = codec.unpackHeader(datagram)
+        if (self.isLocal(pack.userId) and
+                self.userAddrs[pack.userId] != (host, port)):
+            # a late request of a user who left, whose id is given out again
+            if tracing.reliability.infoOn:
+                tracing.reliability.info("packet from another address than "
+                                         "the user's aborted: %s", pack)
             return
+        if pack.frg == 1 or pack.userId in self.reassemblers:
+            pack = self.reassemble(pack, datagram, (host, port))
+            if pack is None:
+                return
+        else:
+            pack.data = codec.decodeBody(pack, datagram)
+        if tracing.routing.debugOn:
+            tracing.routing.debug("packet received: %s", pack)
 
         # packet arrived is a request
-        if pack.userId in self.users.keys():
+        if self.isLocal(pack.userId):
             # receive an expected packet from a registered user
-            if pack.seqNum == self.clientSeqNums[pack.userId]:
-                self.clientSeqNums[pack.userId] += 1
+            modulo = codec.seqModulos[self.headerVersions[pack.userId]]
+            offset = codec.seqDiff(pack.seqNum,
+                                   self.clientSeqNums[pack.userId], modulo)
+            if offset == 0:
+                self.clientSeqNums[pack.userId] = (pack.seqNum + 1) % modulo
+            elif offset > 0:
+                # a previous request of the user is lost or late
+                self.holdEarly(pack, datagram, offset)
+                return
             else:
-                # this packet might be a resent packet, so send an ack
-                print "Previous ACKs is probably lost, re-handle the case"
-                if pack.msgType == type_code["message"]:
-                    self.forwardMessagePack(pack)
-                elif pack.msgType == type_code["roomRequest"]:
-                    self.changeRoomResponse(pack, (host, port))
-                elif pack.msgType == type_code["disconnectRequest"]:
-                    self.leaveResponse(pack)
-                else:  # type not defined
-                    print "type not defined or error packet"
+                self.replayAck(pack, (host, port))
                 return
 
-        # new user
-        if (pack.userId not in self.users.keys() and
-                pack.msgType == type_code["loginRequest"]):
-            self.loginResponse(pack, (host, port))
+        if not self.isLocal(pack.userId):
+            if pack.msgType == type_code["loginRequest"]:  # new user
+                self.loginResponse(pack, (host, port))
+            elif pack.msgType == type_code["disconnectRequest"]:
+                self.leaveResponse(pack, (host, port))
+            else:
+                # left or evicted
+                tracing.session.info("packet from an unknown user "
+                                     "aborted: %s", pack)
         elif pack.msgType == type_code["message"]:
             # forward the mainRoom msg or movieRoomMessage
             self.forwardMessagePack(pack)
@@ -397,10 +700,13 @@ class c2wUdpChatServerProtocol(DatagramProtocol):
             # (back to) mainRoom or (go to) movieRoom
             self.changeRoomResponse(pack, (host, port))
         elif pack.msgType == type_code["disconnectRequest"]:
-            self.leaveResponse(pack)
+            self.leaveResponse(pack, (host, port))
+        elif pack.msgType == type_code["userListDelta"]:
+            self.userListResponse(pack, (host, port))
         elif pack.msgType == type_code["leavePrivateChatRequest"]:
             pass
         elif pack.msgType == type_code["privateChatRequest"]:
             pass
         else:  # type not defined
-            print "type not defined or error packet"
+            tracing.routing.warning("type not defined or error packet: %s",
+                                    pack)
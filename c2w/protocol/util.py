@@ -1,7 +1,7 @@
 import ctypes
 import struct
 from packet import Packet
-from tables import type_code, room_type
+from tables import type_code, room_type, delta_code
 from data_strucs import Movie, User
 from c2w.main.constants import ROOM_IDS
 
@@ -173,6 +173,15 @@ def adaptMovieList(movieList):
         movies.append((movie.movieName, "127.0.0.1", "1991"))
     return movies
 
+def applyUserListDelta(users, entries):
+    """returns the users list updated with the entries of a userListDelta"""
+    users = list(users)
+    for change, entry in entries:
+        users = [user for user in users if user.userId != entry.userId]
+        if change != delta_code["removed"]:
+            users.append(entry)
+    return users
+
 def adaptUserList(users, movieName=None):
     """change users into GUI adapted format"""
     userList = []
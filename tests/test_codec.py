@@ -0,0 +1,141 @@
+"""
+Wire codec: the messages come back as they were sent with both header
+versions, and the seqNums compare right across their wraparound.
+
+usage: python -m unittest discover tests
+"""
+import unittest
+
+from c2w.protocol import codec, util
+from c2w.protocol.packet import Packet
+from c2w.protocol.data_strucs import Movie, User
+from c2w.protocol.tables import type_code, room_type, delta_code
+
+
+def message(headerVersion, seqNum=7, userId=3, data="hello"):
+    return Packet(frg=0, ack=0, msgType=type_code["message"],
+                  roomType=room_type["mainRoom"], seqNum=seqNum,
+                  userId=userId, destId=0, length=len(data), data=data,
+                  headerVersion=headerVersion)
+
+
+def userList(headerVersion, users):
+    length = sum(codec.userStructs[headerVersion].size + user.length
+                 for user in users)
+    return Packet(frg=0, ack=0, msgType=type_code["userList"],
+                  roomType=room_type["mainRoom"], seqNum=1, userId=2,
+                  destId=0, length=length,
+                  data=dict((user.userId, user) for user in users),
+                  headerVersion=headerVersion)
+
+
+class HeaderTest(unittest.TestCase):
+
+    def test_legacyHeader(self):
+        buf = codec.packMsg(message(codec.LEGACY_HEADER, 255, 254))
+        self.assertEqual(len(buf), codec.HEADER_LENGTH + 5)
+        self.assertEqual(buf, util.packMsg(message(0, 255, 254)).raw)
+        pack = codec.unpackMsg(buf)
+        self.assertEqual((pack.headerVersion, pack.seqNum, pack.userId,
+                          pack.data), (codec.LEGACY_HEADER, 255, 254,
+                                       "hello"))
+
+    def test_wideHeader(self):
+        buf = codec.packMsg(message(codec.WIDE_HEADER, 2 ** 32 - 1, 4000))
+        self.assertEqual(len(buf), codec.WIDE_HEADER_LENGTH + 5)
+        self.assertEqual(codec.headerLength(buf), codec.WIDE_HEADER_LENGTH)
+        pack = codec.unpackMsg(buf)
+        self.assertEqual((pack.headerVersion, pack.seqNum, pack.userId,
+                          pack.data), (codec.WIDE_HEADER, 2 ** 32 - 1, 4000,
+                                       "hello"))
+
+    def test_rewriteHeader(self):
+        for headerVersion, seqNum, userId in ((codec.LEGACY_HEADER, 200, 9),
+                                              (codec.WIDE_HEADER, 70000,
+                                               300)):
+            buf = bytearray(codec.packMsg(message(headerVersion)))
+            codec.rewriteHeader(buf, seqNum, userId)
+            pack = codec.unpackMsg(buf)
+            self.assertEqual((pack.seqNum, pack.userId, pack.data),
+                             (seqNum, userId, "hello"))
+
+    def test_loginOptions(self):
+        destId = codec.packLoginOptions(codec.WIDE_HEADER, 1024)
+        self.assertTrue(destId < 256)  # in a legacy header
+        self.assertEqual(codec.unpackLoginOptions(destId),
+                         (codec.WIDE_HEADER, 1024))
+        self.assertEqual(codec.unpackLoginOptions(0),
+                         (codec.LEGACY_HEADER, 0))
+
+
+class BodyTest(unittest.TestCase):
+
+    def test_userList(self):
+        for headerVersion, firstId in ((codec.LEGACY_HEADER, 10),
+                                       (codec.WIDE_HEADER, 3000)):
+            users = [User("u" * nameLength, firstId + nameLength,
+                          status=nameLength % 2)
+                     for nameLength in (0, 1, 200)]
+            pack = codec.unpackMsg(codec.packMsg(userList(headerVersion,
+                                                          users)))
+            self.assertEqual(repr(pack.data), repr(users))
+
+    def test_legacyUserListLikeUtil(self):
+        users = [User("alice", 1), User("bob", 2, status=0)]
+        buf = codec.packMsg(userList(codec.LEGACY_HEADER, users))
+        self.assertEqual(repr(codec.unpackMsg(buf)),
+                         repr(util.unpackMsg(buf)))
+
+    def test_userListDelta(self):
+        for headerVersion, userId in ((codec.LEGACY_HEADER, 200),
+                                      (codec.WIDE_HEADER, 60000)):
+            entries = [(delta_code["added"], User("carol", userId)),
+                       (delta_code["removed"], User("dave", 4, status=0))]
+            length = sum(codec.deltaStructs[headerVersion].size + user.length
+                         for change, user in entries)
+            pack = Packet(frg=0, ack=0, msgType=type_code["userListDelta"],
+                          roomType=room_type["mainRoom"], seqNum=1, userId=0,
+                          destId=3, length=length, data=entries,
+                          headerVersion=headerVersion)
+            self.assertEqual(repr(codec.unpackMsg(codec.packMsg(pack)).data),
+                             repr(entries))
+
+    def test_movieList(self):
+        movies = [Movie("first", 1), Movie("second", 300)]
+        length = sum(codec.movieStructs[codec.WIDE_HEADER].size + movie.length
+                     for movie in movies)
+        pack = Packet(frg=0, ack=0, msgType=type_code["movieList"],
+                      roomType=room_type["notApplicable"], seqNum=0,
+                      userId=1, destId=0, length=length, data=movies,
+                      headerVersion=codec.WIDE_HEADER)
+        self.assertEqual(repr(codec.unpackMsg(codec.packMsg(pack)).data),
+                         repr(movies))
+
+    def test_fragments(self):
+        pack = message(codec.LEGACY_HEADER, seqNum=254, data="x" * 25)
+        frags = codec.fragmentMsg(pack, 10)
+        headers = [codec.unpackHeader(str(frag)) for frag in frags]
+        self.assertEqual([(header.frg, header.seqNum, header.length)
+                          for header in headers],
+                         [(1, 254, 10), (1, 255, 10), (0, 0, 5)])
+
+
+class SeqNumTest(unittest.TestCase):
+
+    def test_legacyWrap(self):
+        self.assertEqual(codec.seqDiff(0, 255), 1)
+        self.assertEqual(codec.seqDiff(255, 0), -1)
+        self.assertEqual(codec.seqDiff(3, 250), 9)
+        self.assertEqual(codec.seqDiff(5, 5), 0)
+
+    def test_wideWrap(self):
+        modulo = codec.WIDE_SEQ_MODULO
+        self.assertEqual(codec.seqDiff(0, modulo - 1, modulo), 1)
+        self.assertEqual(codec.seqDiff(modulo - 1, 0, modulo), -1)
+        # far apart for a single byte, not for 32 bits
+        self.assertEqual(codec.seqDiff(300, 0, modulo), 300)
+        self.assertEqual(codec.seqDiff(300, 0), 44)
+
+
+if __name__ == "__main__":
+    unittest.main()
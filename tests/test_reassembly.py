@@ -0,0 +1,113 @@
+"""
+Reassembler: the datagrams are handed over in the order of their
+seqNums, whatever the order they come in, the duplicates are dropped,
+and a datagram beyond the window is refused, so that it is not acked.
+
+usage: python -m unittest discover tests
+"""
+import unittest
+
+from twisted.internet import task
+
+from c2w.protocol import codec
+from c2w.protocol.packet import Packet
+from c2w.protocol.reassembly import Reassembler
+from c2w.protocol.tables import type_code, room_type
+from c2w.protocol.timer_wheel import TimingWheel
+
+
+def datagram(seqNum, data, headerVersion=codec.LEGACY_HEADER):
+    return codec.packMsg(Packet(frg=0, ack=0, msgType=type_code["message"],
+                                roomType=room_type["mainRoom"],
+                                seqNum=seqNum, userId=0, destId=1,
+                                length=len(data), data=data,
+                                headerVersion=headerVersion))
+
+
+class ReassemblerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.timers = TimingWheel(clock=self.clock)
+        self.reassembler = Reassembler(self.timers, windowSize=4, timeout=10)
+
+    def tearDown(self):
+        self.reassembler.stop()
+        self.timers.stop()
+
+    def receive(self, buf):
+        """returns: the data of the packets handed over, None if refused"""
+        packs = self.reassembler.receive(codec.unpackHeader(buf), buf)
+        if packs is None:
+            return None
+        return [pack.data for pack in packs]
+
+    def test_outOfOrder(self):
+        self.assertEqual(self.receive(datagram(2, "c")), [])
+        self.assertEqual(self.receive(datagram(1, "b")), [])
+        self.assertEqual(self.receive(datagram(0, "a")), ["a", "b", "c"])
+        self.assertEqual(self.reassembler.expected, 3)
+        self.assertEqual(self.reassembler.pending, {})
+
+    def test_duplicate(self):
+        self.assertEqual(self.receive(datagram(0, "a")), ["a"])
+        self.assertEqual(self.receive(datagram(0, "a")), [])
+        self.assertEqual(self.receive(datagram(2, "c")), [])
+        self.assertEqual(self.receive(datagram(2, "c")), [])
+        self.assertEqual(self.receive(datagram(1, "b")), ["b", "c"])
+
+    def test_beyondTheWindow(self):
+        self.assertEqual(self.receive(datagram(4, "e")), None)
+        self.assertEqual(self.receive(datagram(3, "d")), [])
+        self.assertEqual(self.reassembler.pending.keys(), [3])
+        self.assertEqual(self.receive(datagram(0, "a")), ["a"])
+        # the window has moved, the sender sends it again
+        self.assertEqual(self.receive(datagram(4, "e")), [])
+
+    def test_windowAcrossTheWrap(self):
+        self.reassembler.expected = 254
+        self.assertEqual(self.receive(datagram(1, "d")), [])
+        self.assertEqual(self.receive(datagram(2, "e")), None)
+        self.assertEqual(self.receive(datagram(253, "z")), [])  # duplicate
+        self.assertEqual(self.receive(datagram(255, "b")), [])
+        self.assertEqual(self.receive(datagram(254, "a")), ["a", "b"])
+        self.assertEqual(self.receive(datagram(0, "c")), ["c", "d"])
+        self.assertEqual(self.reassembler.expected, 2)
+
+    def test_wideWindowAcrossTheWrap(self):
+        self.reassembler.expected = 2 ** 32 - 1
+        self.assertEqual(self.receive(datagram(0, "b", codec.WIDE_HEADER)),
+                         [])
+        self.assertEqual(self.receive(datagram(3, "e", codec.WIDE_HEADER)),
+                         None)
+        self.assertEqual(self.receive(datagram(2 ** 32 - 1, "a",
+                                               codec.WIDE_HEADER)),
+                         ["a", "b"])
+        self.assertEqual(self.reassembler.expected, 1)
+
+    def test_fragmentsOutOfOrder(self):
+        pack = Packet(frg=0, ack=0, msgType=type_code["message"],
+                      roomType=room_type["mainRoom"], seqNum=0, userId=0,
+                      destId=1, length=25, data="x" * 20 + "y" * 5)
+        frags = [str(frag) for frag in codec.fragmentMsg(pack, 10)]
+        self.assertEqual(self.receive(frags[2]), [])
+        self.assertEqual(self.receive(frags[0]), [])
+        self.assertEqual(self.receive(frags[1]), ["x" * 20 + "y" * 5])
+        self.assertEqual(self.reassembler.getStats()["completed"], 1)
+
+    def test_incompletePacketDiscarded(self):
+        pack = Packet(frg=0, ack=0, msgType=type_code["message"],
+                      roomType=room_type["mainRoom"], seqNum=0, userId=0,
+                      destId=1, length=25, data="x" * 25)
+        frags = [str(frag) for frag in codec.fragmentMsg(pack, 10)]
+        self.assertEqual(self.receive(frags[0]), [])
+        self.clock.advance(11)
+        self.assertEqual(self.reassembler.getStats()["discarded"], 1)
+        # the rest of the packet is dropped, the next one goes through
+        self.assertEqual(self.receive(frags[1]), [])
+        self.assertEqual(self.receive(frags[2]), [])
+        self.assertEqual(self.receive(datagram(3, "next")), ["next"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+ReliableSender: a packet lost is sent again on its own, until it is
+acked or given up after attempt_num tries, and the window goes on past
+it.
+
+usage: python -m unittest discover tests
+"""
+import unittest
+
+from twisted.internet import task
+
+from c2w.protocol import codec
+from c2w.protocol.config import attempt_num
+from c2w.protocol.packet import Packet
+from c2w.protocol.reliable import ReliableSender
+from c2w.protocol.tables import type_code, room_type
+from c2w.protocol.timer_wheel import TimingWheel
+
+
+def frags(count, headerVersion=codec.LEGACY_HEADER):
+    """count messages of one fragment each"""
+    return [codec.fragmentMsg(Packet(frg=0, ack=0,
+                                     msgType=type_code["message"],
+                                     roomType=room_type["mainRoom"],
+                                     seqNum=0, userId=0, destId=0, length=1,
+                                     data=str(i),
+                                     headerVersion=headerVersion), 100)[0]
+            for i in range(count)]
+
+
+class SenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.timers = TimingWheel(clock=self.clock)
+        self.written = []  # seqNums, in the order sent
+        self.gaveUp = []
+        self.sender = ReliableSender(self.write, self.timers, windowSize=4,
+                                     onGiveUp=self.gaveUp.append)
+
+    def tearDown(self):
+        self.sender.stop()
+        self.timers.stop()
+
+    def write(self, buf):
+        self.written.append(codec.unpackHeader(buf).seqNum)
+
+    def advance(self, seconds):
+        for i in range(int(seconds * 10)):
+            self.clock.advance(0.1)
+
+    def test_window(self):
+        self.sender.send(frags(6), 3)
+        self.assertEqual(self.written, [0, 1, 2, 3])
+        self.sender.ackReceived(1)  # the window waits for 0
+        self.assertEqual(self.written, [0, 1, 2, 3])
+        self.sender.ackReceived(0)
+        self.assertEqual(self.written, [0, 1, 2, 3, 4, 5])
+        self.assertFalse(self.sender.ackReceived(0))  # duplicate
+
+    def test_retransmitOnlyTheLostOne(self):
+        acked = []
+        rto = self.sender.rtt.rto  # the acks below shorten it
+        self.sender.send(frags(3), 3, onAcked=lambda: acked.append(True))
+        for seqNum in (0, 2):
+            self.sender.ackReceived(seqNum)
+        self.advance(rto + 0.2)
+        self.assertEqual(self.written, [0, 1, 2, 1])
+        self.assertEqual(acked, [])
+        self.sender.ackReceived(1)
+        self.assertEqual(acked, [True])
+        self.assertEqual(self.sender.base, 3)
+        self.assertEqual(self.sender.inFlight, {})
+
+    def test_backoffOncePerWindow(self):
+        rto = self.sender.rtt.rto
+        self.sender.send(frags(4), 3)
+        self.advance(rto + 0.2)
+        self.assertEqual(sorted(self.written[4:]), [0, 1, 2, 3])
+        self.assertEqual(self.sender.rtt.rto, 2 * rto)
+        self.assertEqual(self.sender.rtt.retransmissions, 4)
+
+    def test_giveUp(self):
+        self.sender.send(frags(2), 3)
+        self.sender.ackReceived(1)
+        self.advance(120)
+        self.assertEqual(self.written.count(0), attempt_num)
+        self.assertEqual(self.gaveUp, [0])
+        # the window goes on past the packet given up
+        self.assertEqual(self.sender.base, 2)
+        self.assertEqual(self.sender.inFlight, {})
+        self.sender.send(frags(1), 3)
+        self.assertEqual(self.written[-1], 2)
+
+    def test_seqNumWrap(self):
+        self.sender.base = self.sender.nextSeqNum = 254
+        self.sender.send(frags(4), 3)
+        self.assertEqual(self.written, [254, 255, 0, 1])
+        for seqNum in (254, 255, 0, 1):
+            self.assertTrue(self.sender.ackReceived(seqNum))
+        self.assertEqual(self.sender.base, 2)
+
+    def test_wideSeqNumWrap(self):
+        self.sender.seqModulo = codec.WIDE_SEQ_MODULO
+        self.sender.base = self.sender.nextSeqNum = 2 ** 32 - 1
+        self.sender.send(frags(2, codec.WIDE_HEADER), 3)
+        self.assertEqual(self.written, [2 ** 32 - 1, 0])
+        self.assertTrue(self.sender.ackReceived(2 ** 32 - 1))
+        self.assertTrue(self.sender.ackReceived(0))
+        self.assertEqual(self.sender.base, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
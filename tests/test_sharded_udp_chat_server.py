@@ -0,0 +1,139 @@
+"""
+Workers of a sharded UDP server connected by an in-memory bus: a user
+name is reserved on all the workers before a login is acked, two logins
+of the same name through two workers are not both accepted.
+
+usage: python -m unittest discover tests
+"""
+import marshal
+import unittest
+
+from twisted.internet import task
+
+from c2w.protocol import codec, timer_wheel
+from c2w.protocol.packet import Packet
+from c2w.protocol.tables import type_code, error_code
+
+
+class ServerProxy():
+    """The part of the serverProxy of ``c2w.main`` the logins use."""
+
+    def __init__(self):
+        self.names = []
+
+    def getMovieList(self):
+        return []
+
+    def addUser(self, userName, room, userAddress=None):
+        self.names.append(userName)
+
+    def removeUser(self, userName):
+        self.names.remove(userName)
+
+
+class Link():
+    """The bus connection of a worker to another one, the events wait in
+    the queue of the test"""
+
+    def __init__(self, queue, worker):
+        self.queue = queue
+        self.worker = worker
+
+    def sendString(self, data):
+        self.queue.append((self.worker, data))
+
+
+class Transport():
+    """The datagrams sent by a worker"""
+
+    def __init__(self):
+        self.sent = []
+
+    def write(self, datagram, addr):
+        self.sent.append((codec.unpackMsg(datagram), addr))
+
+
+class LoginTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = timer_wheel.reactor
+        timer_wheel.reactor = self.clock
+        from c2w.protocol.sharded_udp_chat_server import \
+            c2wShardedUdpChatServerProtocol
+        self.events = []
+        self.workers = []
+        for index in range(3):
+            worker = c2wShardedUdpChatServerProtocol(ServerProxy(), 0, index,
+                                                     3)
+            worker.transport = Transport()
+            self.workers.append(worker)
+        for worker in self.workers:
+            worker.bus.connections = [Link(self.events, other)
+                                      for other in self.workers
+                                      if other is not worker]
+
+    def tearDown(self):
+        timer_wheel.reactor = self.reactor
+
+    def logIn(self, worker, userName, port):
+        login = Packet(frg=0, ack=0, msgType=type_code["loginRequest"],
+                       roomType=3, seqNum=0, userId=0, destId=0,
+                       length=len(userName), data=userName)
+        worker.datagramReceived(codec.packMsg(login), ("127.0.0.1", port))
+
+    def deliver(self):
+        while self.events:
+            worker, data = self.events.pop(0)
+            worker.eventReceived(marshal.loads(data))
+        self.clock.advance(0)  # the coalesced datagrams
+
+    def replies(self, worker):
+        """the acks sent by the worker, errors with their code"""
+        return [(pack.msgType, pack.data) if pack.msgType ==
+                type_code["errorMessage"] else pack.msgType
+                for pack, addr in worker.transport.sent if pack.ack == 1]
+
+    def test_ackedOnceReserved(self):
+        first, second, third = self.workers
+        self.logIn(first, "alice", 5000)
+        self.clock.advance(0)
+        self.assertEqual(first.transport.sent, [])
+        self.deliver()
+        self.assertEqual(self.replies(first), [type_code["loginRequest"]])
+        # known to the others, in no room yet
+        for worker in (second, third):
+            self.assertEqual(worker.roomIndex.getUserIdByName("alice"), 1)
+        self.logIn(second, "alice", 5001)
+        self.deliver()
+        self.assertEqual(self.replies(second),
+                         [(type_code["errorMessage"],
+                           error_code["userNotAvailable"])])
+
+    def test_sameNameAtTheSameTime(self):
+        first, second, third = self.workers
+        self.logIn(first, "alice", 5000)
+        self.logIn(second, "alice", 5001)
+        self.deliver()
+        for worker in (first, second):
+            self.assertEqual(self.replies(worker),
+                             [(type_code["errorMessage"],
+                               error_code["userNotAvailable"])])
+        for worker in self.workers:
+            self.assertEqual(worker.roomIndex.names, {})
+            self.assertEqual(worker.serverProxy.names, [])
+        # the clients try again
+        self.logIn(second, "alice", 5001)
+        self.deliver()
+        self.assertEqual(self.replies(second)[-1], type_code["loginRequest"])
+
+    def test_retransmittedLoginWhileReserving(self):
+        first = self.workers[0]
+        self.logIn(first, "alice", 5000)
+        self.logIn(first, "alice", 5000)
+        self.deliver()
+        self.assertEqual(self.replies(first), [type_code["loginRequest"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
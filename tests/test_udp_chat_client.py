@@ -0,0 +1,180 @@
+"""
+UDP client against a server which loses datagrams or stops answering:
+the requests are handled in order, and a request never acked closes the
+session instead of leaving a gap in the seqNums.
+
+usage: python -m unittest discover tests
+"""
+import unittest
+
+from twisted.internet import task
+
+from c2w.protocol import codec, timer_wheel
+from c2w.protocol.data_strucs import User
+from c2w.protocol.packet import Packet
+from c2w.protocol.tables import state_code, type_code, room_type
+
+
+class RecordingProxy():
+    """Client proxy stand-in, the names of the calls in order."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append(name)
+
+
+class Server():
+    """
+    Transport of the client, the server end. Like the chat servers, it
+    handles the requests in the order of their seqNums: a request received
+    before a missing one is held unacked until the missing one comes, and
+    a duplicate is acked again.
+    """
+
+    def __init__(self):
+        """
+        .. attribute:: lose
+        Number of the next datagrams lost on their way to the server
+        """
+        self.client = None
+        self.up = True
+        self.lose = 0
+        self.expected = 0  # seqNum of the next request handled
+        self.held = {}  # seqNum: request received before a missing one
+        self.handled = []  # data of the requests, in the order handled
+        self.received = 0  # datagrams received, the acks of the client too
+
+    def write(self, datagram, addr):
+        if not self.up:
+            return
+        if self.lose:
+            self.lose -= 1
+            return
+        self.received += 1
+        header = codec.unpackHeader(datagram)
+        if header.ack == 1:
+            return
+        offset = codec.seqDiff(header.seqNum, self.expected)
+        if offset > 0:
+            self.held[header.seqNum] = datagram
+            return
+        self.handle(header, datagram, duplicate=offset < 0)
+        while self.expected in self.held:
+            datagram = self.held.pop(self.expected)
+            self.handle(codec.unpackHeader(datagram), datagram)
+
+    def handle(self, header, datagram, duplicate=False):
+        data = codec.decodeBody(header, datagram)
+        if not duplicate:
+            self.expected += 1
+            self.handled.append(data)
+        ack = header.makeAck()
+        if header.msgType == type_code["loginRequest"]:
+            ack.userId = 5
+        ack.data = data
+        self.client.datagramReceived(codec.packMsg(ack), ("127.0.0.1", 1900))
+
+
+class RequestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.reactor = timer_wheel.reactor
+        timer_wheel.reactor = self.clock
+        from c2w.protocol.udp_chat_client import c2wUdpChatClientProtocol
+        self.proxy = RecordingProxy()
+        self.server = Server()
+        self.client = c2wUdpChatClientProtocol("127.0.0.1", 1900, self.proxy,
+                                               0)
+        self.client.transport = self.server
+        self.server.client = self.client
+
+    def tearDown(self):
+        timer_wheel.reactor = self.reactor
+
+    def advance(self, seconds):
+        for i in range(int(seconds * 10)):
+            self.clock.advance(0.1)
+
+    def logIn(self):
+        self.client.sendLoginRequestOIE("alice")
+        self.assertEqual(self.client.requests, {})
+        # the movie list and the user list are left out
+        self.client.state = state_code["inMainRoom"]
+
+    def test_loginRejected(self):
+        self.server.up = False
+        self.client.sendLoginRequestOIE("alice")
+        self.advance(120)
+        self.assertEqual(self.proxy.calls, ["connectionRejectedONE"])
+        self.assertEqual(self.client.state, state_code["disconnected"])
+
+    def test_firstDatagramLost(self):
+        self.server.lose = 1
+        self.client.sendLoginRequestOIE("alice")
+        self.assertEqual(self.server.handled, [])
+        self.advance(5)
+        self.assertEqual(self.server.handled, ["alice"])
+        self.assertEqual(self.client.userId, 5)
+
+    def test_requestLostBeforeTheNextOnes(self):
+        self.logIn()
+        self.server.lose = 1
+        self.client.sendChatMessageOIE("first")
+        self.client.sendChatMessageOIE("second")
+        # held by the server until the first one is retransmitted
+        self.assertEqual(self.server.handled, ["alice"])
+        self.assertEqual(self.server.held.keys(), [2])
+        self.advance(5)
+        self.assertEqual(self.server.handled, ["alice", "first", "second"])
+        self.assertEqual(self.client.requests, {})
+        self.assertEqual(self.client.sender.inFlight, {})
+
+    def test_sessionClosedOnGiveUp(self):
+        self.logIn()
+        self.server.up = False
+        self.client.sendChatMessageOIE("lost")
+        self.advance(120)
+        self.assertEqual(self.proxy.calls, ["connectionRejectedONE"])
+        self.assertEqual(self.client.state, state_code["disconnected"])
+        self.assertEqual(self.client.requests, {})
+        self.assertEqual(self.client.sender.inFlight, {})
+        # the server is back: no later request skips the lost seqNum, and
+        # nothing is acked, the server evicts the silent user
+        self.server.up = True
+        forward = Packet(frg=0, ack=0, msgType=type_code["messageForward"],
+                         roomType=room_type["mainRoom"], seqNum=3, userId=5,
+                         destId=2, length=5, data="hello")
+        self.client.datagramReceived(codec.packMsg(forward),
+                                     ("127.0.0.1", 1900))
+        self.advance(60)
+        self.assertEqual(self.server.received, 1)
+        self.assertEqual(self.server.handled, ["alice"])
+
+    def test_packetBeyondTheWindowNotAcked(self):
+        self.logIn()
+        self.client.users = [User("bob", 2)]
+        received = self.server.received
+        window = self.client.dHandler.reassembler.windowSize
+        for seqNum in (window, 0):
+            forward = Packet(frg=0, ack=0, msgType=type_code["messageForward"],
+                             roomType=room_type["mainRoom"], seqNum=seqNum,
+                             userId=5, destId=2, length=5, data="hello")
+            self.client.datagramReceived(codec.packMsg(forward),
+                                         ("127.0.0.1", 1900))
+        # only the ack of seqNum 0, the server sends the other one again
+        self.assertEqual(self.server.received, received + 1)
+
+    def test_leaveCompletesOnGiveUp(self):
+        self.logIn()
+        self.server.up = False
+        self.client.sendLeaveSystemRequestOIE()
+        self.advance(120)
+        self.assertEqual(self.proxy.calls,
+                         ["leaveSystemOKONE", "applicationQuit"])
+
+
+if __name__ == "__main__":
+    unittest.main()